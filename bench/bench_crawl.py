@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import time
+
+import scan
+from bench.replay import ReplayServer, DEFAULT_ROOT
+from crawler import Crawler, DEFAULT_CONCURRENCY
+from models.chapter import Chapter
+from models.item import Item
+from util import fetch
+from util.throttle import Scheduler
+
+
+def crawl_sequential(search_url: str, limit: int) -> {str: int}:
+    stats = {"listing": 1, "item": 0, "chapter": 0}
+
+    for page in range(1, min(scan.get_total_pages(search_url) + 1, limit)):
+        stats["listing"] += 1
+
+        for url in scan.get_item_urls(page, search_url):
+            item = Item(url).load()
+            stats["item"] += 1
+
+            for chapter_url in item.chapter_urls:
+                Chapter(chapter_url).load()
+                stats["chapter"] += 1
+
+    return stats
+
+
+def crawl_async(search_url: str, limit: int, concurrency: int) -> {str: int}:
+    crawler = Crawler(concurrency=concurrency, search_url=search_url, store=False)
+    return asyncio.run(crawler.crawl(limit))
+
+
+def report(name: str, stats: {str: int}, elapsed: float):
+    pages = stats["listing"] + stats["item"] + stats["chapter"]
+    print(f"{name:<12} {pages:>6} pages {elapsed:>8.2f}s {pages / elapsed:>8.1f} pages/s  {stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the sequential and the async crawl on recorded pages")
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    parser.add_argument("--pages", type=int, default=1, help="Number of recorded listing pages")
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[4, DEFAULT_CONCURRENCY, 32])
+    parser.add_argument("--throttle", action="store_true",
+                        help="Pace requests with the per-host scheduler (util.throttle), off against the replay")
+    args = parser.parse_args()
+
+    # The replay server is one local host, the politeness budgets would measure themselves instead of the crawl
+    fetch.client.scheduler = Scheduler() if args.throttle else None
+
+    with ReplayServer(args.root) as server:
+        search_url = server.local_url(scan.MAIN_SEARCH_URL)
+
+        start = time.perf_counter()
+        stats = crawl_sequential(search_url, args.pages + 1)
+        report("sequential", stats, time.perf_counter() - start)
+
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            stats = crawl_async(search_url, args.pages + 1, concurrency)
+            report(f"async x{concurrency}", stats, time.perf_counter() - start)
@@ -0,0 +1,109 @@
+import argparse
+import os
+import re
+import time
+import tracemalloc
+from urllib.parse import unquote
+
+from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+
+from bench.replay import DEFAULT_ROOT
+from models import extract
+from util import util
+
+ITEM_PATH = re.compile(r"^manga-[^/]+$")
+CHAPTER_PATH = re.compile(r"^manga-[^/]+/chapter-[^/]+$")
+
+
+def legacy_extract_item(html: str) -> dict:
+    """
+    The per-field lookups Item used to do, every one starting again from the root of a full html.parser tree.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    info = lambda: soup.find('div', class_='panel-story-info')
+
+    fields = {"name": soup.find('div', class_="story-info-right").find('h1').text}
+
+    links = info().find('div', class_='story-info-right').find_all('a', class_='a-h')
+    fields["authors"] = [el['href'] for el in links if re.search("/author/", el['href'])]
+    fields["genres"] = [el['href'] for el in links if re.search("/genre-[0-9]+$", el['href'])]
+
+    div = info().find('div', class_="panel-story-info-description")
+    fields["description"] = ''.join(div.find_all(string=True, recursive=False)).strip()
+    fields["views"] = util.parse_to_integer(
+        info().find('div', class_='story-info-right-extent').find_all('span', class_='stre-value')[1].text)
+    fields["rating"] = float(soup.find("em", {"property": "v:average"}).text)
+    fields["votes"] = int(soup.find("em", {"property": "v:votes"}).text)
+    fields["last_updated"] = info().find('div', class_='story-info-right-extent').find('span', class_='stre-value').text
+    fields["thumbnail_url"] = info().find('span', class_="info-image").find('img')['src']
+
+    table = soup.find('table', class_='variations-tableInfo')
+    fields["table"] = [row.get_text(strip=True) for row in table.find_all('tr')]
+
+    chapters_div = soup.find('div', class_="panel-story-chapter-list")
+    fields["chapter_urls"] = [link['href'] for link in chapters_div.find_all('a', class_="chapter-name")]
+
+    return fields
+
+
+def legacy_extract_image_urls(html: str) -> [str]:
+    soup = BeautifulSoup(html, 'html.parser')
+    container = soup.find('div', class_="container-chapter-reader")
+    return [el['src'] for el in container.find_all('img')]
+
+
+def load_fixtures(root: str) -> ([bytes], [bytes]):
+    items, chapters = [], []
+
+    for host in os.listdir(root):
+        for name in os.listdir(os.path.join(root, host)):
+            path = unquote(name)
+            target = items if ITEM_PATH.match(path) else chapters if CHAPTER_PATH.match(path) else None
+
+            if target is not None:
+                with open(os.path.join(root, host, name), 'rb') as f:
+                    target.append(f.read())
+
+    return items, chapters
+
+
+def measure(name: str, func, pages: [bytes], rounds: int):
+    if not pages:
+        return
+
+    texts = [page.decode('utf-8', errors='replace') for page in pages]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        for text in texts:
+            func(text)
+
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f"{name:<36} {len(texts) * rounds / elapsed:>8.1f} pages/s   peak {util.format_size(peak):>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the old and the single pass page extraction")
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    items, chapters = load_fixtures(args.root)
+    print(f"{len(items)} item pages, {len(chapters)} chapter pages, {args.rounds} rounds\n")
+
+    parsers = [p for p in ("html.parser", "lxml") if builder_registry.lookup(p) is not None]
+
+    measure("item: legacy", legacy_extract_item, items, args.rounds)
+    for p in parsers:
+        measure(f"item: single pass ({p})", lambda html: extract.extract_item(html, p), items, args.rounds)
+
+    measure("chapter: legacy", legacy_extract_image_urls, chapters, args.rounds)
+    for p in parsers:
+        measure(f"chapter: single pass ({p})", lambda html: extract.extract_image_urls(html, p), chapters,
+                args.rounds)
@@ -0,0 +1,136 @@
+"""
+Ingest rate of the storage backends: saves the same synthetic items and chapters (see `bench.bench_models`) through
+`storage.db` in scan-sized batches, then stores a batch of image objects, once per backend, and reports rows/s and
+objects/s.
+
+The Postgres run truncates every table of the database named with `--db-name` and stores the objects in the in-memory
+object store (see `bench.objectstore`), never point it at the real library. The SQLite run uses a temporary directory.
+"""
+import argparse
+import hashlib
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench.bench_models import build_items, image_urls
+from bench.objectstore import ObjectStoreServer
+from models.chapter import Chapter
+from models.urls import UrlList
+from storage.backend import POSTGRES, SQLITE
+from storage.context import Config, configure, get_context
+
+TABLES = ["item_chapters", "item_authors", "item_genres", "items", "chapter_images", "chapters", "authors", "genres"]
+
+
+def use_backend(backend: str, db_name: str, store: ObjectStoreServer, directory: str):
+    env = dict(os.environ, STORAGE_BACKEND=backend)
+
+    if backend == POSTGRES:
+        host, port = store.address
+        env.update(DB_NAME=db_name, MINIO_ADDR=host, MINIO_PORT=str(port))
+        env.setdefault("MINIO_ACCESS_KEY", "bench")
+        env.setdefault("MINIO_SECRET_KEY", "bench-secret")
+    else:
+        env.update(SQLITE_PATH=os.path.join(directory, "library.db"),
+                   OBJECT_STORE_PATH=os.path.join(directory, "objects"))
+
+    configure(Config(env))
+
+
+def reset_db(backend: str):
+    from storage import registry
+    from storage.db import DB
+
+    DB.create()
+    if backend == POSTGRES:
+        with DB.get_connection() as conn:
+            conn.cursor().execute(f"TRUNCATE {', '.join(TABLES)} CASCADE")
+
+    registry.AUTHORS.clear()
+    registry.GENRES.clear()
+
+
+def chapters_of(item_chapters: [(str, int, str)], images: int, rng: random.Random) -> [Chapter]:
+    chapters = []
+
+    for i, (_, _, url) in enumerate(item_chapters):
+        chapter = Chapter(url)
+        chapter.image_urls = UrlList(image_urls(rng, i, images))
+        chapter._done("images")
+        chapters.append(chapter)
+
+    return chapters
+
+
+def ingest(items: list, batch: int, images: int, seed: int) -> (float, int, int):
+    """
+    Saves the items, their chapters and their image urls, one transaction per batch the way a scan does.
+    Returns the seconds taken, the chapters and the image rows written.
+    """
+    from storage.db import DB
+
+    rng = random.Random(seed)
+    chapters = image_rows = 0
+    start = time.perf_counter()
+
+    for offset in range(0, len(items), batch):
+        with DB.get_connection() as conn:
+            new = DB.save_items(items[offset:offset + batch], conn, upload_thumbnail=False, save_new_chapters=False)
+            batch_chapters = chapters_of(new, images, rng)
+
+            DB.save_chapters(batch_chapters, conn)
+            DB.save_item_chapters(new, conn)
+
+        chapters += len(batch_chapters)
+        image_rows += len(batch_chapters) * images
+
+    return time.perf_counter() - start, chapters, image_rows
+
+
+def put_objects(count: int, size: int, seed: int) -> float:
+    rng = random.Random(seed)
+    backend = get_context().backend
+    blobs = [rng.randbytes(size) for _ in range(count)]
+
+    start = time.perf_counter()
+    for data in blobs:
+        backend.put_object("bench.images", hashlib.sha256(data).hexdigest() + ".webp", data, "image/webp")
+
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingest through each storage backend")
+    parser.add_argument("--db-name", default=None, help="Scratch database for the postgres run, it's truncated")
+    parser.add_argument("--backends", nargs="+", choices=[POSTGRES, SQLITE], default=[SQLITE])
+    parser.add_argument("--items", type=int, default=5_000)
+    parser.add_argument("--chapters-per-item", type=int, default=30, help="Mean chapter urls per item")
+    parser.add_argument("--images", type=int, default=40, help="Image urls per chapter")
+    parser.add_argument("--batch", type=int, default=24, help="Items per transaction, one listing page")
+    parser.add_argument("--objects", type=int, default=500)
+    parser.add_argument("--object-size", type=int, default=200 * 1024)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if POSTGRES in args.backends and not args.db_name:
+        parser.error("--db-name is required for the postgres backend")
+
+    print(f"{'backend':<10} {'items/s':>9} {'chapters/s':>11} {'images/s':>10} {'objects/s':>10} {'MiB/s':>8}")
+    with ObjectStoreServer() as store, tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends:
+            use_backend(backend, args.db_name, store, directory)
+            reset_db(backend)
+
+            items = build_items(args.items, args.chapters_per_item, True, args.seed)
+            for i, item in enumerate(items):
+                item.last_updated = datetime(2024, 1, 1) + timedelta(minutes=i)
+            elapsed, chapters, image_rows = ingest(items, args.batch, args.images, args.seed)
+            put_elapsed = put_objects(args.objects, args.object_size, args.seed)
+
+            print(f"{backend:<10} {len(items) / elapsed:>9.0f} {chapters / elapsed:>11.0f} "
+                  f"{image_rows / elapsed:>10.0f} {args.objects / put_elapsed:>10.0f} "
+                  f"{args.objects * args.object_size / put_elapsed / 2 ** 20:>8.1f}")
+
+    get_context().close()
@@ -0,0 +1,155 @@
+"""
+Memory of a batch of synthetic items and chapters in the compact models (slots, shared Author and Genre instances,
+urls stored as `UrlList`) against the layout they replaced (a `__dict__` per instance, new Author and Genre objects
+per item, lists of full url strings). Nothing is fetched, the fields are set the way the loaders set them.
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from models.chapter import Chapter
+from models.item import Item
+from models.metadata import Author, Genre
+from models.urls import UrlList
+
+GENRES = 40
+STATUSES = ["ongoing", "completed"]
+
+
+class LegacyAuthor:
+    def __init__(self, name: str, url: str, id: str):
+        self.name = name
+        self.id = id
+        self.url = url
+
+
+class LegacyGenre:
+    def __init__(self, name: str, url: str, id: int):
+        self.name = name
+        self.id = id
+        self.url = url
+
+
+class LegacyPage:
+    def __init__(self, url: str):
+        self.url = url
+        self._page = None
+        self._loaded = set()
+
+
+def item_fields(rng: random.Random, i: int, authors: int, chapters: int) -> dict:
+    url = f"https://chapmanganato.to/manga-{i:07d}"
+    author_ids = {rng.randrange(authors) for _ in range(rng.randint(1, 2))}
+    genre_ids = {rng.randint(1, GENRES) for _ in range(rng.randint(2, 6))}
+
+    return {
+        "name": f"Item {i}",
+        "authors": [(f"Author {a}", f"https://manganato.com/author/story/author{a}", f"author{a}") for a in author_ids],
+        "genres": [(f"Genre {g}", f"https://manganato.com/genre-{g}", g) for g in genre_ids],
+        "description": f"Description of item {i} " * 10,
+        "views": rng.randint(0, 10_000_000),
+        "rating": round(rng.uniform(1, 5), 1),
+        "votes": rng.randint(0, 50_000),
+        "last_updated": None,
+        "thumbnail_url": f"https://avt.mkklcdnv6temp.com/fld/{i % 97}/{i}/thumb.jpg",
+        "status": rng.choice(STATUSES),
+        "alternative": None,
+        "chapter_urls": [f"{url}/chapter-{n}" for n in range(1, rng.randint(1, 2 * chapters))],
+    }
+
+
+def image_urls(rng: random.Random, i: int, images: int) -> [str]:
+    base = (f"https://v{rng.randint(1, 9)}.mkklcdnv6tempv5.com/img/tab_{rng.randint(1, 40)}/0{i % 5}/{i // 7}/{i}"
+            f"/chapter_{i}")
+    return [f"{base}/{n}-{rng.getrandbits(40):x}-o.jpg" for n in range(1, images + 1)]
+
+
+def build_items(count: int, chapters: int, compact: bool, seed: int) -> list:
+    rng = random.Random(seed)
+    authors = max(count // 5, 1)
+    items = []
+
+    for i in range(count):
+        fields = item_fields(rng, i, authors, chapters)
+
+        if compact:
+            fields["authors"] = [Author.of(*a) for a in fields["authors"]]
+            fields["genres"] = [Genre.of(*g) for g in fields["genres"]]
+
+            item = Item(f"https://chapmanganato.to/manga-{i:07d}")
+            item._set(fields)
+            item._done("metadata", "chapters")
+        else:
+            fields["authors"] = [LegacyAuthor(*a) for a in fields["authors"]]
+            fields["genres"] = [LegacyGenre(*g) for g in fields["genres"]]
+
+            item = LegacyPage(f"https://chapmanganato.to/manga-{i:07d}")
+            for key, value in fields.items():
+                setattr(item, key, value)
+
+        items.append(item)
+
+    return items
+
+
+def build_chapters(count: int, images: int, compact: bool, seed: int) -> list:
+    rng = random.Random(seed)
+    chapters = []
+
+    for i in range(count):
+        url = f"https://chapmanganato.to/manga-{i % 1000:07d}/chapter-{i}"
+        urls = image_urls(rng, i, images)
+
+        if compact:
+            chapter = Chapter(url)
+            chapter.image_urls = UrlList(urls)
+            chapter._done("images")
+        else:
+            chapter = LegacyPage(url)
+            chapter.name = url.split('/')[-1]
+            chapter.image_urls = urls
+
+        chapters.append(chapter)
+
+    return chapters
+
+
+def measure(build, *args) -> (int, float):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    objects = build(*args)
+
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del objects
+    gc.collect()
+    return current, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory of synthetic items and chapters, compact against legacy")
+    parser.add_argument("--items", type=int, default=50_000)
+    parser.add_argument("--chapters-per-item", type=int, default=30, help="Mean chapter urls per item")
+    parser.add_argument("--chapters", type=int, default=5_000, help="Chapters with image urls")
+    parser.add_argument("--images", type=int, default=40, help="Image urls per chapter")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'batch':<36} {'layout':<8} {'MiB':>9} {'bytes each':>11} {'seconds':>8}")
+    for name, build, count, size in [
+        (f"{args.items} items", build_items, args.items, args.chapters_per_item),
+        (f"{args.chapters} chapters x {args.images} images", build_chapters, args.chapters, args.images),
+    ]:
+        results = {}
+        for layout, compact in (("legacy", False), ("compact", True)):
+            current, elapsed = measure(build, count, size, compact, args.seed)
+            results[layout] = current
+            print(f"{name:<36} {layout:<8} {current / 2 ** 20:>9.1f} {current // count:>11} {elapsed:>8.2f}")
+
+        print(f"{'':<36} {'saved':<8} {(1 - results['compact'] / results['legacy']) * 100:>8.1f}%\n")
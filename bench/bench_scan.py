@@ -0,0 +1,171 @@
+"""
+End-to-end scan benchmark: scans the recorded fixtures (see `bench.replay`, record with `--images`) through the replay
+server into a local Postgres and the in-memory object store, and reports items/min, chapters/min, bytes stored and
+where the time went per stage.
+
+Every run can be appended to a history file (`--history`) and is compared with the last run of the same settings, so
+regressions show up as a slowdown against the previous numbers.
+
+The benchmark truncates every table of the database named with `--db-name`, never point it at the real library.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import scan
+from bench.objectstore import ObjectStoreServer
+from bench.replay import ReplayServer, DEFAULT_ROOT
+from util import fetch, metrics
+from util.httpcache import DiskCache
+from util.throttle import Scheduler
+
+TABLES = ["item_chapters", "item_authors", "item_genres", "items", "chapter_images", "chapters", "authors", "genres",
+          "object_sources", "stored_objects", "mirror_images", "crawl_frontier"]
+REGRESSION_THRESHOLD = 0.10  # slower than the last comparable run by more than this is reported
+
+
+def use_object_store(store: ObjectStoreServer):
+    # Read by the storage context on first use, the environment wins over .env
+    host, port = store.address
+    os.environ["MINIO_ADDR"] = host
+    os.environ["MINIO_PORT"] = str(port)
+    os.environ.setdefault("MINIO_ACCESS_KEY", "bench")
+    os.environ.setdefault("MINIO_SECRET_KEY", "bench-secret")
+
+
+def reset_db():
+    from storage import registry
+    from storage.db import DB
+
+    DB.create()
+    with DB.get_connection() as conn:
+        conn.cursor().execute(f"TRUNCATE {', '.join(TABLES)} CASCADE")
+
+    registry.AUTHORS.clear()
+    registry.GENRES.clear()
+
+
+def run_scan(mode: str, search_url: str, pages: int, concurrency: int):
+    if mode == "sequential":
+        # Only the recorded listing pages, the others are 404s the frontier would retry with backoff
+        scan.scan_frontier(restart=True, search_url=search_url, max_pages=pages)
+    else:
+        from crawler import Crawler
+        crawler = Crawler(concurrency=concurrency, search_url=search_url)
+        asyncio.run(crawler.crawl(pages + 1))
+
+
+def run_mirror() -> dict:
+    from storage.mirror import Mirror
+
+    with Mirror() as mirror:
+        return mirror.run()
+
+
+def stage_breakdown(summary: dict) -> [(str, float, int)]:
+    """
+    Returns (metric, total seconds, count) of every timed path, slowest first.
+    """
+    return sorted(((name, h["total"], h["count"]) for name, h in summary["histograms"].items()),
+                  key=lambda row: row[1], reverse=True)
+
+
+def counter(summary: dict, name: str) -> float:
+    return sum(c["value"] for key, c in summary["counters"].items() if key == name or key.startswith(name + "{"))
+
+
+def compare(result: dict, history: str):
+    if not os.path.isfile(history):
+        return
+
+    with open(history) as f:
+        previous = [json.loads(line) for line in f if line.strip()]
+
+    previous = [r for r in previous if r["settings"] == result["settings"]]
+    if not previous:
+        return
+
+    last = previous[-1]
+    for key in ("items_per_min", "chapters_per_min"):
+        if last[key] and result[key] < last[key] * (1 - REGRESSION_THRESHOLD):
+            print(f"REGRESSION: {key} {result[key]} vs {last[key]} on {last['date']}")
+        else:
+            print(f"{key}: {result[key]} (last run {last[key]})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark a full scan against the replay server")
+    parser.add_argument("--db-name", required=True, help="Scratch database, every table in it is truncated")
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    parser.add_argument("--mode", choices=["sequential", "crawler"], default="crawler")
+    parser.add_argument("--pages", type=int, default=1, help="Number of recorded listing pages")
+    parser.add_argument("--concurrency", type=int, default=16, help="crawler: global concurrency")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean delay per response in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of responses that are 503s")
+    parser.add_argument("--mirror", action="store_true", help="Also mirror the chapter images after the scan")
+    parser.add_argument("--throttle", action="store_true",
+                        help="Pace requests with the per-host scheduler (util.throttle), off against the replay")
+    parser.add_argument("--history", default=None, help="Append the result to this JSONL file and compare")
+    args = parser.parse_args()
+
+    os.environ["DB_NAME"] = args.db_name
+
+    with ReplayServer(args.root, latency=args.latency, error_rate=args.error_rate) as replay, \
+            ObjectStoreServer() as store, tempfile.TemporaryDirectory() as cache_dir:
+        use_object_store(store)
+        # A fresh HTTP cache, so no page is answered from an earlier run
+        fetch.client.cache = DiskCache(os.path.join(cache_dir, "http.sqlite"))
+        fetch.client.scheduler = Scheduler() if args.throttle else None
+
+        reset_db()
+        metrics.REGISTRY.reset()
+
+        start = time.perf_counter()
+        run_scan(args.mode, replay.local_url(scan.MAIN_SEARCH_URL), args.pages, args.concurrency)
+        scan_seconds = time.perf_counter() - start
+
+        mirror_stats = run_mirror() if args.mirror else None
+        elapsed = time.perf_counter() - start
+
+        summary = metrics.summary()
+        items = counter(summary, "items_saved_total")
+        chapters = counter(summary, "chapters_saved_total")
+
+        result = {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "settings": {key: getattr(args, key) for key in ("mode", "pages", "concurrency", "latency", "error_rate",
+                                                            "mirror", "throttle")},
+            "seconds": round(elapsed, 2),
+            "scan_seconds": round(scan_seconds, 2),
+            "items": items,
+            "chapters": chapters,
+            "items_per_min": round(items * 60 / scan_seconds, 1),
+            "chapters_per_min": round(chapters * 60 / scan_seconds, 1),
+            "objects": store.object_count(),
+            "bytes_stored": store.stored_bytes(),
+            "replay": dict(replay.stats),
+            "mirror": mirror_stats,
+            "limits": fetch.limits(),
+            "stages": {name: {"seconds": total, "count": count} for name, total, count in stage_breakdown(summary)},
+        }
+
+    print(f"{args.mode}: {items:.0f} items, {chapters:.0f} chapters in {scan_seconds:.1f}s, "
+          f"{result['items_per_min']} items/min, {result['chapters_per_min']} chapters/min, "
+          f"{result['objects']} objects, {result['bytes_stored']} bytes stored")
+    print(f"replay: {result['replay']}")
+    if result["limits"]:
+        print(f"limits: {result['limits']}")
+    print()
+
+    print(f"{'stage':<60} {'seconds':>10} {'count':>8}")
+    for name, total, count in stage_breakdown(summary):
+        print(f"{name:<60} {total:>10.2f} {count:>8}")
+
+    if args.history:
+        compare(result, args.history)
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(result) + "\n")
@@ -0,0 +1,162 @@
+"""
+Search latency on a synthetic library: fills a scratch database with `--items` generated items (100k by default) with
+authors and genres, then times a fixed set of queries through `storage.search`, uncached and from the cache.
+
+The benchmark truncates the library tables of the database named with `--db-name`, never point it at the real library.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+SYLLABLES = ["ka", "ri", "to", "shi", "ma", "no", "ye", "ron", "dra", "gon", "sen", "hu", "lin", "xia", "zu", "mei",
+             "ta", "ken", "sho", "ra", "vel", "mor", "an", "el", "is", "ul", "gar", "tha", "bel", "ion"]
+WORDS = ["the", "of", "a", "demon", "king", "sword", "return", "academy", "hero", "villainess", "system", "tower",
+         "cultivation", "reincarnated", "love", "story", "martial", "god", "dungeon", "hunter", "level", "solo",
+         "princess", "magic", "emperor", "regression", "school", "revenge", "legend", "immortal"]
+STATUSES = ["ongoing", "completed"]  # stored lowercase, see `models.extract`
+GENRES = 40
+
+
+def word(rng: random.Random) -> str:
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def title(rng: random.Random) -> str:
+    return ' '.join(rng.choice(WORDS + [word(rng)]) for _ in range(rng.randint(2, 6))).title()
+
+
+def generate(items: int, seed: int = 0):
+    """
+    Returns rows for items, authors, genres, item_authors and item_genres. Views and genre popularity are skewed like
+    the real listing, a few items and genres take most of it.
+    """
+    rng = random.Random(seed)
+    start = datetime(2015, 1, 1)
+
+    genres = [(i, word(rng).title(), f"https://manganato.com/genre-{i}") for i in range(1, GENRES + 1)]
+    authors = [(f"author{i}", f"{word(rng).title()} {word(rng).title()}", f"https://manganato.com/author/story/{i}")
+               for i in range(max(items // 5, 1))]
+
+    item_rows, item_authors, item_genres = [], [], []
+    for i in range(items):
+        url = f"https://chapmanganato.to/manga-{i:07d}"
+        updated = start + timedelta(seconds=rng.randint(0, 10 * 365 * 24 * 3600))
+        item_rows.append((url, updated.isoformat(), title(rng), title(rng) if rng.random() < 0.6 else None,
+                          rng.choice(STATUSES), ' '.join(rng.choice(WORDS + [word(rng)]) for _ in range(60)), None,
+                          int(rng.lognormvariate(10, 2)), round(rng.uniform(1, 5), 1), rng.randint(0, 50000)))
+
+        for author_id in {rng.choice(authors)[0] for _ in range(rng.randint(1, 2))}:
+            item_authors.append((url, author_id))
+        for genre_id in {min(int(rng.paretovariate(1.2)), GENRES) for _ in range(rng.randint(2, 6))}:
+            item_genres.append((url, genre_id))
+
+    return item_rows, authors, genres, item_authors, item_genres
+
+
+def load(items: int, seed: int = 0) -> [tuple]:
+    from storage.bulk import copy_rows
+    from storage.db import DB
+
+    item_rows, authors, genres, item_authors, item_genres = generate(items, seed)
+
+    DB.create()
+    with DB.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('TRUNCATE item_chapters, item_authors, item_genres, items, authors, genres CASCADE')
+
+        copy_rows(cursor, 'genres', ['genre_id', 'name', 'url'], genres)
+        copy_rows(cursor, 'authors', ['author_id', 'name', 'url'], authors)
+        copy_rows(cursor, 'items', ['item_url', 'last_updated', 'name', 'alternative', 'status', 'description',
+                                    'thumbnail_object_name', 'views', 'rating', 'votes'], item_rows)
+        copy_rows(cursor, 'item_authors', ['item_url', 'author_id'], item_authors)
+        copy_rows(cursor, 'item_genres', ['item_url', 'genre_id'], item_genres)
+
+    with DB.get_connection() as conn:
+        conn.autocommit = True
+        conn.cursor().execute('VACUUM ANALYZE items, item_authors, item_genres')
+        conn.autocommit = False
+
+    return item_rows
+
+
+def queries(item_rows: [tuple], seed: int = 0) -> [(str, dict)]:
+    rng = random.Random(seed)
+    name = rng.choice(item_rows)[2]
+    typo = name[:3] + name[4:] if len(name) > 6 else name
+
+    return [
+        ("browse by views", {}),
+        ("browse by rating, page 50", {"sort": "rating", "page": 50}),
+        ("latest updates", {"sort": "last_updated"}),
+        ("popular genre", {"genres": [1]}),
+        ("rare genre", {"genres": [GENRES - 1]}),
+        ("two genres, completed", {"genres": [1, 2], "statuses": ["completed"]}),
+        ("genre without another", {"genres": [1], "exclude_genres": [2]}),
+        ("author", {"authors": ["author7"]}),
+        ("common word", {"text": "dungeon"}),
+        ("exact title", {"text": name}),
+        ("title with a typo", {"text": typo}),
+        ("title part", {"text": ' '.join(name.split()[:2])}),
+        ("word in genre by views", {"text": "demon", "genres": [3], "sort": "views"}),
+        ("genre facets", {"genres": [1], "facets": True}),
+        ("word facets", {"text": "king", "facets": True}),
+    ]
+
+
+def time_query(kwargs: dict, repeat: int, cached: bool) -> [float]:
+    from storage import search
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        search.search(cached=cached, **kwargs)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def report(label: str, timings: [float], total: int = None):
+    timings = sorted(timings)
+    p95 = timings[min(int(len(timings) * 0.95), len(timings) - 1)]
+    matches = f"{total:>8}" if total is not None else ""
+    print(f"{label:<32} {statistics.median(timings) * 1000:>9.2f} {p95 * 1000:>9.2f} {timings[-1] * 1000:>9.2f} "
+          f"{matches}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark search on a synthetic library")
+    parser.add_argument("--db-name", required=True, help="Scratch database, its library tables are truncated")
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-load", action="store_true", help="Reuse the library of the last run")
+    args = parser.parse_args()
+
+    os.environ["DB_NAME"] = args.db_name
+
+    from storage import search
+
+    if args.skip_load:
+        from storage.db import DB
+        with DB.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT item_url, last_updated, name FROM items')
+            rows = cursor.fetchall()
+    else:
+        start = time.perf_counter()
+        rows = load(args.items, args.seed)
+        print(f"Loaded {len(rows)} items in {time.perf_counter() - start:.1f}s\n")
+
+    print(f"{'query':<32} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'matches':>8}")
+    for label, kwargs in queries(rows, args.seed):
+        search.clear_cache()
+        total = search.search(cached=False, **kwargs).total
+        report(label, time_query(kwargs, args.repeat, cached=False), total)
+
+    print("\ncached")
+    for label, kwargs in queries(rows, args.seed):
+        search.search(**kwargs)
+        report(label, time_query(kwargs, args.repeat, cached=True))
@@ -0,0 +1,153 @@
+"""
+Simulation of the AIMD window of `util.throttle` against modelled hosts, in simulated time and with a fixed seed, so
+every run gives the same numbers and takes a fraction of a second.
+
+Every host model answers a request after a header latency that grows once more requests are in flight than it can
+serve, then sends a body whose transfer time depends on its size. The window is fed either the time to the headers
+(what `util.fetch` samples) or the whole transfer time, to show why the body must not count:
+
+    cdn           mixed small and large images, never fails, serves 48 requests at once
+    fail-above-6  small pages, answers 503 to every request beyond 6 in flight
+"""
+import argparse
+import heapq
+import random
+from collections import Counter
+
+from util import throttle
+from util.throttle import Budget
+
+SAMPLES = ["headers", "total"]
+DEFAULT_REQUESTS = 3000
+
+
+class Host:
+    """
+    Parameters:
+        name (str): Name in the report.
+        header_latency (float): Seconds to the headers while the host isn't overloaded.
+        capacity (int): Requests in flight the host serves without queueing, the header latency grows in proportion
+            above it.
+        fail_above (int): Requests in flight above which the host answers 503, never if None.
+        bandwidth (float): Bytes per second per connection.
+        sizes ([(float, int, int)]): (share, min bytes, max bytes) of the body sizes.
+    """
+
+    def __init__(self, name: str, header_latency: float, capacity: int, fail_above: int = None,
+                 bandwidth: float = 4 * 2 ** 20, sizes: [(float, int, int)] = ((1.0, 20_000, 40_000),)):
+        self.name = name
+        self.header_latency = header_latency
+        self.capacity = capacity
+        self.fail_above = fail_above
+        self.bandwidth = bandwidth
+        self.sizes = sizes
+
+    def respond(self, in_flight: int, rng: random.Random) -> (float, float, bool):
+        """
+        Returns (seconds to the headers, seconds of the body transfer, whether it's an error) of a request sent with
+        `in_flight` requests in flight, itself included.
+        """
+        headers = self.header_latency * max(1.0, in_flight / self.capacity) * rng.uniform(0.9, 1.1)
+
+        if self.fail_above is not None and in_flight > self.fail_above:
+            return headers, 0.0, True
+
+        share = rng.random()
+        for size_share, low, high in self.sizes:
+            if share < size_share:
+                return headers, rng.randint(low, high) / self.bandwidth, False
+            share -= size_share
+
+        return headers, 0.0, False
+
+
+HOSTS = {
+    "cdn": Host("cdn", header_latency=0.04, capacity=48,
+                sizes=((0.7, 10_000, 60_000), (0.3, 500_000, 3_000_000))),
+    "fail-above-6": Host("fail-above-6", header_latency=0.08, capacity=32, fail_above=6),
+}
+BUDGET = Budget(rate=None, burst=1, min_window=1, max_window=64, initial_window=4)
+
+
+class Clock:
+    """
+    Simulated `time` for `util.throttle`, which only reads `time.monotonic()` in the window.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def simulate(host: Host, sample: str, requests: int, budget: Budget = BUDGET, seed: int = 0) -> dict:
+    """
+    Sends `requests` requests (errors are retried) as fast as the window allows and reports the throughput, errors
+    and how the window moved.
+    """
+    rng = random.Random(seed)
+    clock = Clock()
+    real_time, throttle.time = throttle.time, clock
+
+    try:
+        window = throttle.Window(budget)
+        in_flight = []  # heap of (finish, seq, headers seconds, total seconds, error)
+        queued, succeeded, errors, seq = requests, 0, 0, 0
+        window_seconds = 0.0  # integral of the window over time
+        peak = window.limit
+        decreases = Counter()
+
+        while succeeded < requests:
+            while queued and window.in_flight < int(window.limit):
+                window.acquire()
+                headers, transfer, error = host.respond(window.in_flight, rng)
+                heapq.heappush(in_flight, (clock.now + headers + transfer, seq, headers, headers + transfer, error))
+                queued -= 1
+                seq += 1
+
+            finish, _, headers, total, error = heapq.heappop(in_flight)
+            window_seconds += window.limit * (finish - clock.now)
+            clock.now = finish
+
+            reason = window.release(headers if sample == "headers" else total, error)
+            if reason is not None:
+                decreases[reason] += 1
+            peak = max(peak, window.limit)
+
+            if error:
+                errors += 1
+                queued += 1
+            else:
+                succeeded += 1
+    finally:
+        throttle.time = real_time
+
+    return {
+        "host": host.name,
+        "sample": sample,
+        "seconds": round(clock.now, 2),
+        "requests_per_sec": round(requests / clock.now, 1),
+        "errors": errors,
+        "mean_window": round(window_seconds / clock.now, 1),
+        "peak_window": round(peak, 1),
+        "final_window": round(window.limit, 1),
+        "decreases": dict(decreases),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the throttle window against modelled hosts")
+    parser.add_argument("--host", choices=list(HOSTS), nargs='+', default=list(HOSTS))
+    parser.add_argument("--sample", choices=SAMPLES, nargs='+', default=SAMPLES,
+                        help="Latency fed to the window: time to the headers or the whole transfer")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'host':<14} {'sample':<8} {'req/s':>8} {'errors':>7} {'mean win':>9} {'peak':>6} {'final':>6}  decreases")
+    for name in args.host:
+        for sample in args.sample:
+            r = simulate(HOSTS[name], sample, args.requests, seed=args.seed)
+            print(f"{r['host']:<14} {r['sample']:<8} {r['requests_per_sec']:>8.1f} {r['errors']:>7} "
+                  f"{r['mean_window']:>9.1f} {r['peak_window']:>6.1f} {r['final_window']:>6.1f}  {r['decreases']}")
@@ -0,0 +1,241 @@
+"""
+Encoder benchmark over a corpus of fixture images: encode ms/image, output bytes and peak RSS per format, quality and
+WebP `method`, and of `transcode()` over the variant sets the thumbnail pipeline and the mirror store.
+
+Every setting runs in its own child process, so the peak RSS of one setting isn't hidden by an earlier one. Collect a
+corpus from the recorded replay fixtures (thumbnails and chapter images) with `collect` first.
+
+`variants` times one `transcode()` (one decode, every variant) against decoding once per variant, and sweeps
+`target_bytes` to show the ms, bytes and quality it costs.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from bench.bench_extract import load_fixtures
+from bench.replay import DEFAULT_ROOT
+from models import extract
+from util import util
+
+DEFAULT_CORPUS = os.path.join(DEFAULT_ROOT, "images")
+FORMATS = ["HEIF", "WEBP", "JPEG"]
+QUALITIES = [40, 60, 80]
+WEBP_METHODS = [0, 4, 6]
+VARIANT_SETS = ["thumbnail", "page"]
+
+
+def collect(root: str = DEFAULT_ROOT, corpus: str = DEFAULT_CORPUS, limit: int = 50) -> int:
+    """
+    Downloads up to `limit` thumbnails and chapter images referenced by the recorded pages into `corpus`.
+    """
+    from util import fetch
+
+    os.makedirs(corpus, exist_ok=True)
+    items, chapters = load_fixtures(root)
+
+    urls = [extract.extract_metadata(page.decode('utf-8', errors='replace'))["thumbnail_url"] for page in items]
+    for page in chapters:
+        urls += extract.extract_image_urls(page.decode('utf-8', errors='replace')) or []
+
+    count = 0
+    for url in dict.fromkeys(urls):
+        if count >= limit:
+            break
+
+        res = fetch.get(url)
+        if res.status_code != 200:
+            print(f"Couldn't download {url}")
+            continue
+
+        name = f"{count:04d}_{os.path.basename(urlsplit(url).path)}"
+        with open(os.path.join(corpus, name), 'wb') as f:
+            f.write(res.content)
+        count += 1
+
+    return count
+
+
+def load_corpus(corpus: str) -> [bytes]:
+    images = []
+
+    for name in sorted(os.listdir(corpus)):
+        with open(os.path.join(corpus, name), 'rb') as f:
+            images.append(f.read())
+
+    return images
+
+
+def peak_rss() -> int:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure(corpus: str, format: str, quality: int, method: int, rounds: int) -> dict:
+    """
+    Runs in the child process: decodes every image once, then encodes it `rounds` times with one setting.
+    """
+    from util import transcode
+
+    images = [transcode.decode(data) for data in load_corpus(corpus)]
+    baseline = peak_rss()
+
+    output_bytes = 0
+    failed = 0
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        for image in images:
+            try:
+                output_bytes += len(transcode.encode(image, format, quality, method))
+            except transcode.TranscodeError:
+                failed += 1
+
+    elapsed = time.perf_counter() - start
+    encoded = len(images) * rounds - failed
+
+    return {
+        "format": format,
+        "quality": quality,
+        "method": method,
+        "images": len(images),
+        "failed": failed,
+        "ms_per_image": round(elapsed * 1000 / encoded, 2) if encoded else None,
+        "bytes_per_image": output_bytes // encoded if encoded else None,
+        "peak_rss": peak_rss(),
+        "decoded_rss": baseline,
+    }
+
+
+def run_child(corpus: str, format: str, quality: int, method: int, rounds: int) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-m", "bench.bench_transcode", "child", "--corpus", corpus, "--format", format,
+         "--quality", str(quality), "--method", str(method), "--rounds", str(rounds)],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def with_target(variants, target_bytes: int | None) -> list:
+    """
+    Copies of `variants` targeting `target_bytes`, the variants as configured if None.
+    """
+    from util.transcode import Variant
+
+    if target_bytes is None:
+        return variants
+
+    return [Variant(v.name, v.format, v.max_size, v.quality, target_bytes, v.method) for v in variants]
+
+
+def measure_variants(images: [bytes], variants, rounds: int) -> dict:
+    """
+    Runs `transcode()` over every image `rounds` times and, for comparison, a decode per variant. Returns ms/image of
+    both and bytes and quality per variant.
+    """
+    from util import transcode
+
+    output_bytes = {v.name: 0 for v in variants}
+    quality = {v.name: 0 for v in variants}
+    encoded = 0
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in images:
+            try:
+                outputs = transcode.transcode(data, variants)
+            except transcode.TranscodeError:
+                continue
+
+            encoded += 1
+            for name, output in outputs.items():
+                output_bytes[name] += len(output.data)
+                quality[name] += output.quality
+    shared = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in images:
+            for variant in variants:
+                try:
+                    transcode.transcode(data, [variant])
+                except transcode.TranscodeError:
+                    pass
+    separate = time.perf_counter() - start
+
+    return {
+        "images": len(images),
+        "ms_per_image": round(shared * 1000 / encoded, 2) if encoded else None,
+        "ms_per_image_separate": round(separate * 1000 / encoded, 2) if encoded else None,
+        "variants": {
+            name: {
+                "bytes_per_image": output_bytes[name] // encoded if encoded else None,
+                "quality": round(quality[name] / encoded, 1) if encoded else None,
+            }
+            for name in output_bytes
+        },
+    }
+
+
+def settings(formats: [str], qualities: [int], methods: [int]) -> [(str, int, int)]:
+    # `method` only affects WebP, the other formats are measured once per quality
+    return [(f, q, m) for f in formats for q in qualities for m in (methods if f == "WEBP" else [methods[-1]])]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the image encoders over a fixture corpus")
+    parser.add_argument("command", choices=["collect", "run", "variants", "child"], nargs='?', default="run")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="Recorded replay fixtures, for collect")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--limit", type=int, default=50, help="Images to collect")
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--format", nargs='+', default=FORMATS)
+    parser.add_argument("--quality", type=int, nargs='+', default=QUALITIES)
+    parser.add_argument("--method", type=int, nargs='+', default=WEBP_METHODS)
+    parser.add_argument("--set", choices=list(VARIANT_SETS), nargs='+', default=list(VARIANT_SETS),
+                        help="Variant sets, for variants")
+    parser.add_argument("--target-bytes", type=int, nargs='+', default=[],
+                        help="target_bytes to sweep, for variants (the configured variants always run)")
+    args = parser.parse_args()
+
+    if args.command == "collect":
+        print(f"Collected {collect(args.root, args.corpus, args.limit)} images into {args.corpus}")
+    elif args.command == "child":
+        print(json.dumps(measure(args.corpus, args.format[0], args.quality[0], args.method[0], args.rounds)))
+    elif args.command == "variants":
+        from util.transcode import PAGE_VARIANTS, THUMBNAIL_VARIANTS
+
+        images = load_corpus(args.corpus) if os.path.isdir(args.corpus) else []
+        if not images:
+            sys.exit(f"No images in {args.corpus}, run `python -m bench.bench_transcode collect` first")
+
+        sets = {"thumbnail": THUMBNAIL_VARIANTS, "page": PAGE_VARIANTS}
+        print(f"{len(images)} images, {args.rounds} rounds\n")
+        print(f"{'set':<10} {'target':>8} {'ms/image':>10} {'separate':>10}  variants (bytes/image @ quality)")
+
+        for name in args.set:
+            for target in [None, *args.target_bytes]:
+                r = measure_variants(images, with_target(sets[name], target), args.rounds)
+                outputs = ", ".join(f"{v}: {util.format_size(o['bytes_per_image'] or 0)} @ {o['quality']}"
+                                    for v, o in r["variants"].items())
+                print(f"{name:<10} {util.format_size(target) if target else '-':>8} {r['ms_per_image'] or 0:>10.2f} "
+                      f"{r['ms_per_image_separate'] or 0:>10.2f}  {outputs}")
+    else:
+        count = len(os.listdir(args.corpus)) if os.path.isdir(args.corpus) else 0
+        if not count:
+            sys.exit(f"No images in {args.corpus}, run `python -m bench.bench_transcode collect` first")
+
+        print(f"{count} images, {args.rounds} rounds\n")
+        print(f"{'format':<6} {'q':>3} {'method':>6} {'ms/image':>10} {'bytes/image':>12} {'peak RSS':>12}")
+
+        for format, quality, method in settings([f.upper() for f in args.format], args.quality, args.method):
+            r = run_child(args.corpus, format, quality, method, args.rounds)
+            print(f"{format:<6} {quality:>3} {method if format == 'WEBP' else '-':>6} {r['ms_per_image'] or 0:>10.2f} "
+                  f"{util.format_size(r['bytes_per_image'] or 0):>12} {util.format_size(r['peak_rss']):>12}")
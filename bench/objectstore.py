@@ -0,0 +1,163 @@
+"""
+In-memory stand-in for MinIO, just enough of the S3 API for `storage.media`: bucket location, exists and create, and
+putting, getting and heading objects. Signatures aren't checked.
+
+Point the storage context at it by setting MINIO_ADDR and MINIO_PORT before the first `get_context()`.
+"""
+import argparse
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, urlsplit
+
+LOCATION = ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<LocationConstraint xmlns="http://s3.amazonaws.com/doc/2006-03-01/"></LocationConstraint>')
+
+
+class ObjectStoreServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.buckets = {}
+        self.stats = {"puts": 0, "gets": 0, "bytes": 0}
+
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def address(self) -> (str, int):
+        return self._server.server_address[:2]
+
+    def stored_bytes(self) -> int:
+        with self._lock:
+            return sum(len(data) for objects in self.buckets.values() for data, _ in objects.values())
+
+    def object_count(self) -> int:
+        with self._lock:
+            return sum(len(objects) for objects in self.buckets.values())
+
+    def _handler(self):
+        store = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _target(self) -> (str, str, str):
+                parts = urlsplit(self.path)
+                bucket, _, name = unquote(parts.path).lstrip('/').partition('/')
+                return bucket, name, parts.query
+
+            def _send(self, status: int, body: bytes = b"", headers: {str: str} = None, with_body: bool = True):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+
+                if with_body and body:
+                    self.wfile.write(body)
+
+            def _read_body(self) -> bytes:
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+
+                # Streaming uploads are sent as aws-chunked: "<hex size>;chunk-signature=...\r\n<data>\r\n"
+                if "aws-chunked" in self.headers.get("Content-Encoding", "") or \
+                        self.headers.get("x-amz-content-sha256", "").startswith("STREAMING-"):
+                    body = _decode_chunked(body)
+
+                return body
+
+            def do_HEAD(self):
+                self._get(with_body=False)
+
+            def do_GET(self):
+                self._get(with_body=True)
+
+            def _get(self, with_body: bool):
+                bucket, name, query = self._target()
+
+                with store._lock:
+                    objects = store.buckets.get(bucket)
+                    found = objects.get(name) if objects is not None and name else None
+
+                if objects is None:
+                    self._send(404, with_body=with_body)
+                elif not name:
+                    body = LOCATION.encode() if "location" in query else b""
+                    self._send(200, body, {"Content-Type": "application/xml"}, with_body)
+                elif found is None:
+                    self._send(404, with_body=with_body)
+                else:
+                    data, content_type = found
+                    with store._lock:
+                        store.stats["gets"] += int(with_body)
+                    self._send(200, data, {"Content-Type": content_type,
+                                           "ETag": '"' + hashlib.md5(data).hexdigest() + '"'}, with_body)
+
+            def do_PUT(self):
+                bucket, name, _ = self._target()
+                body = self._read_body()
+
+                with store._lock:
+                    exists = bucket in store.buckets
+
+                    if not name:
+                        store.buckets.setdefault(bucket, {})
+                    elif exists:
+                        store.buckets[bucket][name] = (body, self.headers.get("Content-Type", "binary/octet-stream"))
+                        store.stats["puts"] += 1
+                        store.stats["bytes"] += len(body)
+
+                if name and not exists:
+                    self._send(404)
+                else:
+                    self._send(200, headers={"ETag": '"' + hashlib.md5(body).hexdigest() + '"'})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _decode_chunked(body: bytes) -> bytes:
+    data = bytearray()
+    position = 0
+
+    while position < len(body):
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        if size == 0:
+            break
+
+        start = line_end + 2
+        data += body[start:start + size]
+        position = start + size + 2
+
+    return bytes(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve an in-memory S3 stand-in")
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+
+    server = ObjectStoreServer(port=args.port)
+    print(f"Serving an in-memory object store on {server.address}")
+    server.serve_forever()
@@ -0,0 +1,220 @@
+"""
+Local stand-in for the manganato hosts that replays saved pages.
+
+Fixtures live in `<root>/<host>/<quoted path>`, e.g. `fixtures/chapmanganato.to/manga-wo999471%2Fchapter-4`.
+The server answers `GET /<host>/<path>` with the saved file and rewrites every `https://<host>/` link inside
+HTML to point back at itself, so the scraper never leaves the machine. Responses can be delayed and a share of them
+answered with a 503 to replay a slow or flaky site, and they carry an ETag so conditional requests get their 304.
+"""
+import argparse
+import hashlib
+import mimetypes
+import os
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote, urlsplit
+
+from bs4 import BeautifulSoup
+
+import scan
+from models import extract
+from util import fetch
+
+DEFAULT_ROOT = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def fixture_path(root: str, url: str) -> str:
+    parts = urlsplit(url)
+    path = parts.path.lstrip('/') or "index"
+    return os.path.join(root, parts.netloc, quote(path, safe=''))
+
+
+class ReplayServer:
+    """
+    Parameters:
+        latency (float): Mean delay of every response in seconds, uniformly jittered by +-50%.
+        error_rate (float): Share of the requests answered with a 503 instead.
+        seed (int): Seed of the delays and errors, so runs are comparable.
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.root = root
+        self.hosts = [h for h in os.listdir(root) if os.path.isdir(os.path.join(root, h))]
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = {"requests": 0, "errors": 0, "not_modified": 0, "bytes": 0}
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def local_url(self, url: str) -> str:
+        parts = urlsplit(url)
+        return f"{self.url}/{parts.netloc}{parts.path}"
+
+    def rewrite(self, body: bytes) -> bytes:
+        for host in self.hosts:
+            body = body.replace(f"https://{host}/".encode(), f"{self.url}/{host}/".encode())
+        return body
+
+    def _draw(self) -> (float, bool):
+        with self._lock:
+            delay = self.latency * self._random.uniform(0.5, 1.5) if self.latency else 0.0
+            fail = self._random.random() < self.error_rate
+            self.stats["requests"] += 1
+            self.stats["errors"] += int(fail)
+
+        return delay, fail
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._reply(with_body=True)
+
+            def do_HEAD(self):
+                self._reply(with_body=False)
+
+            def _reply(self, with_body: bool):
+                delay, fail = server._draw()
+                if delay:
+                    time.sleep(delay)
+                if fail:
+                    self.send_error(503)
+                    return
+
+                host, _, path = self.path.lstrip('/').partition('/')
+                file = fixture_path(server.root, f"https://{host}/{path}")
+
+                if not os.path.isfile(file):
+                    self.send_error(404)
+                    return
+
+                with open(file, 'rb') as f:
+                    body = f.read()
+
+                content_type = mimetypes.guess_type(path)[0] or "text/html; charset=utf-8"
+                if content_type.startswith("text/html"):
+                    body = server.rewrite(body)
+
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    server._count("not_modified")
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+
+                if with_body:
+                    server._count("bytes", len(body))
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def record_url(url: str, root: str = DEFAULT_ROOT) -> bytes:
+    dest = fixture_path(root, url)
+    if os.path.isfile(dest):
+        with open(dest, 'rb') as f:
+            return f.read()
+
+    response = fetch.get(url)
+    response.raise_for_status()
+
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    with open(dest, 'wb') as f:
+        f.write(response.content)
+
+    return response.content
+
+
+def record(pages: int = 1, items_per_page: int = 5, chapters_per_item: int = None, root: str = DEFAULT_ROOT,
+           images: bool = False):
+    """
+    Saves a small slice of the live site: the first listing pages, some of their items and their (newest) chapters,
+    with `images` also the thumbnails and chapter images.
+    """
+    record_url(scan.MAIN_SEARCH_URL, root)
+
+    for page in range(1, pages + 1):
+        soup = BeautifulSoup(record_url(scan.MAIN_SEARCH_URL + str(page), root), 'html.parser')
+        item_urls = [link["href"] for link in soup.find_all(class_=scan.COLLECTION_ITEM_LINK_CLASS)]
+
+        for item_url in item_urls[:items_per_page]:
+            html = record_url(item_url, root)
+            soup = BeautifulSoup(html, 'html.parser')
+            chapter_links = soup.find_all('a', class_="chapter-name")
+
+            if images:
+                record_url(extract.extract_metadata(html)["thumbnail_url"], root)
+
+            for link in chapter_links[:chapters_per_item]:
+                chapter_html = record_url(link['href'], root)
+
+                if images:
+                    for image_url in extract.extract_image_urls(chapter_html) or []:
+                        record_url(image_url, root)
+            print(f"Recorded {item_url}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record or replay manganato fixtures")
+    parser.add_argument("command", choices=["record", "serve"])
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--pages", type=int, default=1)
+    parser.add_argument("--items", type=int, default=5)
+    parser.add_argument("--chapters", type=int, default=None, help="Chapters per item, all by default")
+    parser.add_argument("--images", action="store_true", help="record: also the thumbnails and chapter images")
+    parser.add_argument("--latency", type=float, default=0.0, help="serve: mean delay per response in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="serve: share of responses that are 503s")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.pages, args.items, args.chapters, args.root, args.images)
+    else:
+        server = ReplayServer(args.root, port=args.port, latency=args.latency, error_rate=args.error_rate)
+        print(f"Serving {args.root} on {server.url}")
+        server.serve_forever()
@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+
+import scan
+from models.chapter import Chapter
+from models.item import Item
+from storage.db import DB
+from storage.thumbnails import ThumbnailPipeline
+from util import fetch, metrics
+
+DEFAULT_CONCURRENCY = 16
+# Every stage stays below the global limit, so no single stage can take every global slot
+DEFAULT_STAGE_LIMITS = {
+    "listing": 4,
+    "item": 8,
+    "parse": 4,
+    "chapter": 12,
+    "db": 2,
+    "thumbnail": min(os.cpu_count() or 2, 8),
+}
+DEFAULT_QUEUE_SIZE = 32
+DEFAULT_BATCH_SIZE = 16  # items per DB transaction
+
+_DONE = object()
+
+
+class Crawler:
+    """
+    Crawls the listing, item and chapter pages concurrently.
+
+    The crawl is a pipeline of stages connected by bounded queues:
+    listing page -> item url -> scraped item (with its new chapters) -> DB writer -> thumbnail uploader.
+    A full queue blocks the stage feeding it, so a slow DB or uploader throttles the scrapers instead of letting
+    scraped items pile up in memory, and the first item is saved as soon as it has been scraped.
+
+    The scraping itself is still done by the blocking code in `scan`, `Item` and `Chapter`; every call runs on a
+    worker thread and has to hold the semaphore of its stage and then the global semaphore, so no more than
+    `concurrency` requests are in flight. A call only competes for a global slot once its stage lets it run, and
+    every stage limit is below `concurrency`, so no single stage can starve the others.
+
+    Parameters:
+        concurrency (int): Max number of blocking calls running at the same time.
+        stage_limits (dict): Max number of concurrent calls per stage
+            ("listing", "item", "parse", "chapter", "db", "thumbnail"), also the number of workers of each stage.
+            Keep each below `concurrency`.
+        queue_size (int): Capacity of the queues between the stages.
+        batch_size (int): Max number of scraped items the DB writer saves in one transaction.
+        search_url (str): Listing url, point this to a local replay server for benchmarks.
+        store (bool): Save the scraped items to the DB. When False every chapter of every item is scraped.
+        incremental (bool): Only crawl the items that changed since the last run, see `scan.iter_changed_item_urls`.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, stage_limits: {str: int} = None,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, batch_size: int = DEFAULT_BATCH_SIZE,
+                 search_url: str = scan.MAIN_SEARCH_URL, store: bool = True, incremental: bool = False):
+        self.concurrency = concurrency
+        self.stage_limits = {**DEFAULT_STAGE_LIMITS, **(stage_limits or {})}
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.search_url = search_url
+        self.store = store
+        self.incremental = incremental and store
+
+        self.stats = {"listing": 0, "item": 0, "chapter": 0, "saved": 0, "unchanged": 0, "failed": 0}
+
+        self._executor = None
+        self._thumbnails = None
+        self._global = None
+        self._stages = {}
+        self._start = 0.0
+
+    async def _run(self, stage: str, func, *args):
+        queued = time.perf_counter()
+
+        # The stage permit first: a call waiting for its stage must not hold a global slot other stages need
+        async with self._stages[stage], self._global:
+            metrics.observe("stage_wait_seconds", time.perf_counter() - queued, stage=stage)
+
+            with metrics.timer("stage_seconds", stage=stage):
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+        self.stats[stage] = self.stats.get(stage, 0) + 1
+        return result
+
+    async def crawl(self, limit: int = 99999999):
+        self._global = asyncio.Semaphore(self.concurrency)
+        self._stages = {stage: asyncio.Semaphore(n) for stage, n in self.stage_limits.items()}
+        self._start = time.perf_counter()
+
+        stages = [
+            ("listing", self.crawl_page, 1),
+            ("item", self.crawl_item, 1),
+            ("db", self.save_items, self.batch_size),
+            ("thumbnail", self.upload_thumbnail, 1),
+        ]
+        if not self.store:
+            stages = stages[:2]
+
+        queues = [asyncio.Queue(self.queue_size) for _ in stages] + [None]
+
+        with ExitStack() as stack:
+            self._executor = stack.enter_context(ThreadPoolExecutor(max_workers=self.concurrency))
+            if self.store:
+                # Thumbnails are encoded in a process pool, one process per allowed concurrent thumbnail
+                self._thumbnails = stack.enter_context(ThumbnailPipeline(self.stage_limits["thumbnail"]))
+
+            workers = [
+                [asyncio.create_task(self._worker(name, handler, queues[i], queues[i + 1], batch_size))
+                 for _ in range(self.stage_limits[name])]
+                for i, (name, handler, batch_size) in enumerate(stages)
+            ]
+
+            if self.incremental:
+                await self._produce_changed(queues[1], limit)
+            else:
+                total_pages = await self._run("listing", scan.get_total_pages, self.search_url)
+                for page in range(1, min(total_pages + 1, limit)):
+                    await queues[0].put(page)
+
+            # Close the stages in order: every result of a stage is queued before the sentinels for the next one.
+            for i, stage_workers in enumerate(workers):
+                for _ in stage_workers:
+                    await queues[i].put(_DONE)
+                await asyncio.gather(*stage_workers)
+
+            if self._thumbnails is not None:
+                self.stats["thumbnails"] = self._thumbnails.stats()
+
+        return self.stats
+
+    async def _produce_changed(self, item_urls: asyncio.Queue, limit: int):
+        # The stop condition depends on the listing order, so the listing is read page by page on one thread
+        loop = asyncio.get_running_loop()
+        changed = scan.iter_changed_item_urls(limit=limit, search_url=self.search_url)
+
+        while (url := await loop.run_in_executor(self._executor, next, changed, None)) is not None:
+            await item_urls.put(url)
+
+    async def _worker(self, stage: str, handler, inbox: asyncio.Queue, outbox: asyncio.Queue, batch_size: int = 1):
+        done = False
+
+        while not done and (job := await inbox.get()) is not _DONE:
+            # Batched stages get a list with whatever else is already waiting, up to batch_size jobs
+            if batch_size > 1:
+                job = [job]
+                while len(job) < batch_size and not inbox.empty():
+                    next_job = inbox.get_nowait()
+                    if next_job is _DONE:
+                        done = True
+                        break
+                    job.append(next_job)
+
+            try:
+                results = await handler(job)
+            except Exception as e:
+                self.stats["failed"] += 1
+                logging.error(f"Stage {stage} failed for {job}, {e}", exc_info=True)
+                print(f"Stage {stage} failed for {job}, {e}")
+                continue
+
+            if outbox is not None:
+                for result in results or ():
+                    await outbox.put(result)
+
+    async def crawl_page(self, page: int) -> [str]:
+        return await self._run("listing", scan.get_item_urls, page, self.search_url)
+
+    async def crawl_item(self, url: str) -> [(Item, {str: Chapter})]:
+        page = await self._run("item", fetch.get_page, url)
+
+        # A 304 means the page is unchanged since it was cached, which is before the item was committed (or the DB
+        # was reset or imported since). Only skip the parse and everything after it when the item is stored.
+        if page.not_modified and self.store and await self._run("db", self._is_stored, url):
+            self.stats["unchanged"] += 1
+            return []
+
+        try:
+            item = Item(url, page)
+            await self._run("parse", item.load_metadata)
+
+            # Only outdated items get their chapter list parsed, see `_pending_chapter_urls`
+            if self.store:
+                chapter_urls = await self._run("db", self._pending_chapter_urls, item)
+            else:
+                chapter_urls = await self._run("parse", lambda: item.chapter_urls)
+
+            chapters = await asyncio.gather(*(self._run("chapter", self._scrape_chapter, u)
+                                              for u in set(chapter_urls)))
+        except Exception:
+            fetch.forget(url)
+            raise
+
+        return [(item, {c.url: c for c in chapters})]
+
+    async def save_items(self, jobs: [(Item, {str: Chapter})]) -> [Item]:
+        items = [item for item, _ in jobs]
+        chapters = {url: chapter for _, item_chapters in jobs for url, chapter in item_chapters.items()}
+
+        try:
+            await self._run("db", self._save, items, chapters)
+        except Exception:
+            # Drop the cached pages so the next run doesn't take the 304 for items that were never stored
+            for item in items:
+                fetch.forget(item.url)
+            raise
+
+        self.stats["saved"] += len(items)
+        self.stats.setdefault("first_saved_after", round(time.perf_counter() - self._start, 2))
+
+        # Every saved item goes on, unchanged thumbnails are recognised by the thumbnail stage with a conditional GET
+        return items
+
+    async def upload_thumbnail(self, item: Item):
+        await self._run("thumbnail", self._thumbnails.upload, item.url, item.thumbnail_url)
+
+    @staticmethod
+    def _scrape_chapter(url: str) -> Chapter:
+        return Chapter(url).load()
+
+    @staticmethod
+    def _is_stored(url: str) -> bool:
+        with DB.get_connection(readonly=True) as conn:
+            return url in DB.get_sync_states([url], conn)
+
+    @staticmethod
+    def _pending_chapter_urls(item: Item) -> [str]:
+        with DB.get_connection(readonly=True) as conn:
+            if not DB.is_item_outdated(item, conn):
+                return []
+
+            return DB.get_unknown_chapters([url for _, url in DB.get_new_chapters(item, conn)], conn)
+
+    @staticmethod
+    def _save(items: [Item], chapters: {str: Chapter}):
+        with DB.get_connection() as conn:
+            DB.save_items(items, conn, chapters, upload_thumbnail=False)
+
+
+def crawl_all_to_db(concurrency: int = DEFAULT_CONCURRENCY, stage_limits: {str: int} = None,
+                    queue_size: int = DEFAULT_QUEUE_SIZE, batch_size: int = DEFAULT_BATCH_SIZE, limit: int = 99999999,
+                    incremental: bool = False):
+    crawler = Crawler(concurrency=concurrency, stage_limits=stage_limits, queue_size=queue_size,
+                      batch_size=batch_size, incremental=incremental)
+    return asyncio.run(crawler.crawl(limit))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crawl the whole listing concurrently and save it to the DB")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    for stage, n in DEFAULT_STAGE_LIMITS.items():
+        parser.add_argument(f"--{stage}-limit", type=int, default=n)
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--limit", type=int, default=99999999, help="Stop before this listing page")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only crawl the items updated since the last run, newest first")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    DB.create()
+
+    with metrics.exported(args.metrics_port, args.metrics_json):
+        print(crawl_all_to_db(concurrency=args.concurrency,
+                              stage_limits={stage: getattr(args, f"{stage}_limit") for stage in DEFAULT_STAGE_LIMITS},
+                              queue_size=args.queue_size,
+                              batch_size=args.batch_size,
+                              limit=args.limit,
+                              incremental=args.incremental))
@@ -1,7 +1,10 @@
-from bs4 import BeautifulSoup
-import requests
 import logging
 
+from util import fetch, metrics
+from models import extract
+from models.lazy import LazyPage
+from models.urls import UrlList
+
 
 logging.basicConfig(
     filename='scan.log',
@@ -10,47 +13,47 @@ logging.basicConfig(
 )
 
 
-class Chapter:
-    def __init__(self, chapter_url: str):
-        self.url: str = chapter_url
-        self.name: str = chapter_url.split('/')[-1].strip()
-        self.image_urls: [str] = self.scrape_img_urls()
+class Chapter(LazyPage):
+    """
+    Handle on a chapter page, the reader page is only fetched once `image_urls` is read.
+    """
 
+    LOADERS = {**LazyPage.LOADERS, "image_urls": "load"}
+    GROUPS = {"images"}
 
-    def scrape_img_urls(self):
-        response = requests.get(self.url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        img_urls = []
+    __slots__ = ("name", "image_urls")
 
-        container = soup.find('div', class_="container-chapter-reader")
-        if container is not None:
-            img_urls = [el['src'] for el in container.find_all('img')]
-        else:
-            logging.error(f"Couldn't scrape chapter {self.url}", exc_info=True)
+    image_urls: UrlList
 
-        return img_urls
+    def __init__(self, chapter_url: str, page: fetch.Page = None):
+        super().__init__(chapter_url, page)
+        self.name: str = chapter_url.split('/')[-1].strip()
 
-    def get_size(self):
-        headers = {
-            "Referer": "https://manganato.com/"
-        }
+    def load(self):
+        self.image_urls = UrlList(self.scrape_img_urls())
 
-        total = 0
+        self._done("images")
+        return self
 
-        for i, url in enumerate(self.image_urls):
-            response = requests.head(url, headers=headers)
+    @metrics.timer("scrape_img_urls_seconds")
+    def scrape_img_urls(self):
+        img_urls = extract.extract_image_urls(self.fetch().content)
 
-            if response.status_code == 200 and 'Content-Length' in response.headers:
-                size = int(response.headers['Content-Length'])
-                total += size
+        if img_urls is None:
+            logging.error(f"Couldn't scrape chapter {self.url}", exc_info=True)
+            metrics.inc("chapters_total", result="failed")
+            img_urls = []
+        else:
+            metrics.inc("chapters_total", result="scraped")
+            metrics.inc("chapter_images_total", len(img_urls))
 
-        return total
+        return img_urls
 
-    def __str__(self):
-        return ', '.join(f"{key}={value}" for key, value in self.__dict__.items())
+    def get_size(self):
+        return sum(size for size in fetch.content_lengths(self.image_urls) if size is not None)
 
 
 if __name__ == "__main__":
-    c = Chapter("https://chapmanganato.to/manga-wo999471/chapter-4")
+    c = Chapter("https://chapmanganato.to/manga-wo999471/chapter-4").load()
 
     print(c)
\ No newline at end of file
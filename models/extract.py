@@ -0,0 +1,152 @@
+"""
+Single pass extraction of item and chapter pages.
+
+Only the subtrees that hold data are parsed (see the strainers below), and every field is read from them in one walk
+instead of searching the whole document again per field.
+"""
+import os
+import re
+from datetime import datetime
+
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import builder_registry
+from dotenv import load_dotenv
+
+from util import metrics, util
+from models.metadata import Author, Genre
+
+LAST_UPDATE_DATE_FORMAT = "%b %d,%Y - %H:%M"
+
+STORY_INFO_CLASS = "panel-story-info"
+CHAPTER_LIST_CLASS = "panel-story-chapter-list"
+CHAPTER_READER_CLASS = "container-chapter-reader"
+
+METADATA_STRAINER = SoupStrainer('div', class_=STORY_INFO_CLASS)
+CHAPTERS_STRAINER = SoupStrainer('div', class_=CHAPTER_LIST_CLASS)
+ITEM_STRAINER = SoupStrainer('div', class_=[STORY_INFO_CLASS, CHAPTER_LIST_CLASS])
+CHAPTER_READER_STRAINER = SoupStrainer('div', class_=CHAPTER_READER_CLASS)
+
+METADATA_FIELDS = ("name", "authors", "genres", "description", "views", "rating", "votes", "last_updated",
+                   "thumbnail_url", "status", "alternative")
+
+load_dotenv()
+
+# "lxml" is several times faster than the pure python "html.parser" but is an optional dependency
+HTML_PARSER = os.environ.get("HTML_PARSER", "html.parser")
+if builder_registry.lookup(HTML_PARSER) is None:
+    HTML_PARSER = "html.parser"
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def parse(html: str | bytes, strainer: SoupStrainer = None, parser: str = None) -> BeautifulSoup:
+    return BeautifulSoup(html, parser or HTML_PARSER, parse_only=strainer)
+
+
+@metrics.timer("extract_seconds", kind="item")
+def extract_item(html: str | bytes, parser: str = None) -> dict:
+    """
+    Extracts every `Item` field from an item page.
+    """
+    soup = parse(html, ITEM_STRAINER, parser)
+
+    return {
+        **_metadata(soup.find('div', class_=STORY_INFO_CLASS)),
+        "chapter_urls": _chapter_urls(soup.find('div', class_=CHAPTER_LIST_CLASS)),
+    }
+
+
+@metrics.timer("extract_seconds", kind="metadata")
+def extract_metadata(html: str | bytes, parser: str = None) -> dict:
+    """
+    Extracts every `Item` field except the chapter urls.
+    """
+    return _metadata(parse(html, METADATA_STRAINER, parser).find('div', class_=STORY_INFO_CLASS))
+
+
+@metrics.timer("extract_seconds", kind="chapter_urls")
+def extract_chapter_urls(html: str | bytes, parser: str = None) -> [str]:
+    return _chapter_urls(parse(html, CHAPTERS_STRAINER, parser).find('div', class_=CHAPTER_LIST_CLASS))
+
+
+@metrics.timer("extract_seconds", kind="image_urls")
+def extract_image_urls(html: str | bytes, parser: str = None) -> list[str] | None:
+    """
+    Extracts the image urls of a chapter page, or None when the page has no reader container.
+    """
+    container = parse(html, CHAPTER_READER_STRAINER, parser).find('div', class_=CHAPTER_READER_CLASS)
+    if container is None:
+        return None
+
+    return [el['src'] for el in container.find_all('img')]
+
+
+def _metadata(info) -> dict:
+    if info is None:
+        raise ExtractionError(f"No {STORY_INFO_CLASS} on page")
+
+    right = info.find('div', class_="story-info-right")
+    extent = info.find('div', class_='story-info-right-extent')
+    extent_values = extent.find_all('span', class_='stre-value')
+
+    authors = []
+    genres = []
+    for el in right.find_all('a', class_='a-h'):
+        url = el['href']
+        if re.search("/author/", url):
+            authors.append(Author.of(el.text, url, url.split('/')[-1] or el.text))
+
+        if re.search("/genre-[0-9]+$", url):
+            genres.append(Genre.of(el.text, url, int(re.findall("[0-9]+$", url)[-1])))
+
+    table = _table(right.find('table', class_='variations-tableInfo'))
+
+    description = info.find('div', class_="panel-story-info-description")
+
+    return {
+        "name": right.find('h1').text,
+        "authors": authors,
+        "genres": genres,
+        "description": ''.join(description.find_all(string=True, recursive=False)).strip(),
+        "views": util.parse_to_integer(extent_values[1].text),
+        "rating": float(info.find("em", {"property": "v:average"}).text),
+        "votes": int(info.find("em", {"property": "v:votes"}).text),
+        "last_updated": _last_updated(extent_values[0].text),
+        "thumbnail_url": info.find('span', class_="info-image").find('img')['src'],
+        "status": table.get('status').lower(),
+        "alternative": table.get('alternative'),
+    }
+
+
+def _last_updated(date_string: str) -> datetime:
+    date_string = re.sub("[AP]M", "", date_string).strip()
+
+    return datetime.strptime(date_string, LAST_UPDATE_DATE_FORMAT)
+
+
+def _table(table) -> {str: str}:
+    data = {}
+
+    for row in table.find_all('tr'):
+        label = row.find('td', class_='table-label').get_text(strip=True).replace(':', '').lower().strip()
+        value_tag = row.find('td', class_='table-value')
+
+        if value_tag.find('h2'):
+            value = value_tag.find('h2').get_text(strip=True)
+        elif value_tag.find_all('a'):  # Check if the value contains multiple links.
+            value = ' - '.join(link.get_text(strip=True) for link in value_tag.find_all('a'))
+        else:
+            value = value_tag.get_text(strip=True)
+
+        data[label] = value
+
+    return data
+
+
+def _chapter_urls(chapters_div) -> [str]:
+    if chapters_div is None:
+        return []
+
+    return [link['href'] for link in reversed(chapters_div.find_all('a', class_="chapter-name"))]
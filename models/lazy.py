@@ -0,0 +1,92 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from util import fetch
+
+DEFAULT_PREFETCH_WORKERS = 8
+
+
+class LazyPage:
+    """
+    Lightweight handle on a scraped page: nothing is fetched or parsed until a field is read.
+
+    Subclasses map every lazy field to the method that loads it in `LOADERS`. A loader parses only the part of the
+    page it needs, sets its fields as plain attributes and marks its group as done in `GROUPS`; once every group is
+    loaded the raw page is dropped. Fields are slots, subclasses declare theirs in `__slots__`.
+    """
+    __slots__ = ("url", "not_modified", "_page", "_loaded")
+
+    LOADERS: {str: str} = {"not_modified": "fetch"}
+    GROUPS: {str} = set()
+
+    def __init__(self, url: str, page: fetch.Page = None):
+        self.url: str = url
+        self._page = page
+        self._loaded = set()
+
+        if page is not None:
+            self.not_modified = page.not_modified
+
+    def __getattr__(self, name: str):
+        loader = type(self).LOADERS.get(name)
+        if loader is None:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        getattr(self, loader)()
+        return object.__getattribute__(self, name)
+
+    def fetch(self) -> fetch.Page:
+        if self._page is None:
+            self._page = fetch.get_page(self.url)
+            self.not_modified = self._page.not_modified
+
+        return self._page
+
+    def is_loaded(self) -> bool:
+        return self._loaded >= self.GROUPS
+
+    def _done(self, *groups: str):
+        self._loaded.update(groups)
+
+        if self.is_loaded():
+            self._page = None
+
+    def fields(self) -> {str: object}:
+        """
+        Returns the fields that are loaded, without loading the others.
+        """
+        fields = {}
+        for cls in reversed(type(self).__mro__):
+            for key in getattr(cls, '__slots__', ()):
+                if key.startswith('_'):
+                    continue
+                try:
+                    fields[key] = object.__getattribute__(self, key)
+                except AttributeError:
+                    pass
+
+        return fields
+
+    def __str__(self):
+        return ', '.join(f"{key}={value}" for key, value in self.fields().items())
+
+
+def prefetch(handles: [LazyPage], workers: int = DEFAULT_PREFETCH_WORKERS) -> [LazyPage]:
+    """
+    Fetches the pages of many handles concurrently, so reading their fields later doesn't wait on the network.
+    A handle that fails here is left as is and fetched again (and raises) when it is read.
+    """
+
+    def fetch_one(handle: LazyPage):
+        if handle.is_loaded():
+            return
+
+        try:
+            handle.fetch()
+        except Exception as e:
+            logging.error(f"Couldn't prefetch {handle.url}, {e}")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(fetch_one, handles))
+
+    return handles
@@ -1,28 +1,68 @@
+import threading
 
+__all__ = ["Author", "Genre"]
+
+
+class _Record:
+    """
+    Immutable record with slots instead of a `__dict__`. `of()` returns one shared instance per distinct value, so the
+    few thousand authors and few dozen genres of a whole listing exist once no matter how many items reference them.
+    """
+    __slots__ = ()
+
+    _interned: dict
+    _lock = threading.Lock()
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            object.__setattr__(self, key, value)
+
+    @classmethod
+    def of(cls, *args):
+        instance = cls(*args)
+        key = instance.key()
+
+        with cls._lock:
+            return cls._interned.setdefault(key, instance)
+
+    def key(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"'{type(self).__name__}' object is immutable")
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def __reduce__(self):
+        return type(self).of, (self.name, self.url, self.id)
+
+    def __str__(self):
+        return ', '.join(f"{key}={getattr(self, key)}" for key in self.__slots__)
+
+
+class Author(_Record):
+    __slots__ = ("name", "id", "url")
+    _interned = {}
 
-class Author:
     def __init__(self, name : str, url: str, id: str):
-        self.name = name
-        self.id = id
-        self.url = url
+        super().__init__(name=name, id=id, url=url)
 
     @staticmethod
     def empty():
         return Author("","","")
 
-    def __str__(self):
-        return ', '.join(f"{key}={value}" for key, value in self.__dict__.items())
 
+class Genre(_Record):
+    __slots__ = ("name", "id", "url")
+    _interned = {}
 
-class Genre:
     def __init__(self, name: str, url: str, id: int):
-        self.name = name
-        self.id = id
-        self.url = url
+        super().__init__(name=name, id=id, url=url)
 
     @staticmethod
     def empty():
         return Genre("", "", -1)
-
-    def __str__(self):
-        return ', '.join(f"{key}={value}" for key, value in self.__dict__.items())
\ No newline at end of file
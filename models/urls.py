@@ -0,0 +1,52 @@
+import os
+import sys
+from collections.abc import Sequence
+
+SEPARATOR = "\n"  # never part of a url, it's percent-encoded
+
+
+class UrlList(Sequence):
+    """
+    Read-only list of urls kept as their common prefix (up to the last '/') and one string with the rest of every url.
+    A chapter's image urls or an item's chapter urls share most of their characters, so this costs a fraction of a
+    list of full strings and two objects instead of one per url. Iterate it rather than index it, indexing splits the
+    suffixes every time.
+    """
+    __slots__ = ("prefix", "_suffixes", "_length")
+
+    def __init__(self, urls: [str] = ()):
+        urls = list(urls)
+        prefix = os.path.commonprefix(urls)
+
+        self.prefix = sys.intern(prefix[:prefix.rfind('/') + 1])
+        self._suffixes = SEPARATOR.join(url[len(self.prefix):] for url in urls)
+        self._length = len(urls)
+
+    def suffixes(self) -> [str]:
+        return self._suffixes.split(SEPARATOR) if self._length else []
+
+    def __iter__(self):
+        return (self.prefix + suffix for suffix in self.suffixes())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.prefix + suffix for suffix in self.suffixes()[index]]
+
+        return self.prefix + self.suffixes()[index]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, UrlList):
+            return self.prefix == other.prefix and self._suffixes == other._suffixes and self._length == other._length
+
+        return isinstance(other, Sequence) and not isinstance(other, str) and list(self) == list(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"UrlList({list(self)!r})"
+
+    def __reduce__(self):
+        return UrlList, (list(self),)
@@ -1,8 +1,16 @@
+import argparse
+from datetime import date, datetime
+
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 
+from storage import frontier
+from storage.backend import POSTGRES
+from storage.context import get_context
 from storage.db import DB
+from util import fetch, metrics
 from util.imageutil import *
+from models.chapter import Chapter
 from models.item import Item
 import logging
 
@@ -12,13 +20,19 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'  # Log format
 )
 
-MAIN_SEARCH_URL = "https://manganato.com/genre-all/"
+MAIN_SEARCH_URL = "https://manganato.com/genre-all/"  # sorted by last update, newest first
 LAST_PAGE_CLASS = "page-last"
+COLLECTION_ITEM_CLASS = "content-genres-item"
 COLLECTION_ITEM_LINK_CLASS = "genres-item-name"
+COLLECTION_ITEM_CHAPTER_CLASS = "genres-item-chap"
+COLLECTION_ITEM_TIME_CLASS = "genres-item-time"
+COLLECTION_ITEM_DATE_FORMAT = "%b %d,%y"
+
+STOP_AFTER_UNCHANGED = 48  # two listing pages
 
 
-def get_total_pages() -> int:
-    response = requests.get(MAIN_SEARCH_URL)
+def get_total_pages(search_url: str = MAIN_SEARCH_URL) -> int:
+    response = fetch.get(search_url)
 
     soup = BeautifulSoup(response.text, 'html.parser')
 
@@ -28,19 +42,24 @@ def get_total_pages() -> int:
     return total_pages
 
 
+def iter_item_urls(limit: int = 99999999, search_url: str = MAIN_SEARCH_URL):
+    for i in tqdm(range(1, min(get_total_pages(search_url) + 1, limit)), desc="Fetching item urls", unit="page"):
+        yield from get_item_urls(i, search_url)
+
+
 def get_all_item_urls(limit: int = 99999999) -> [str]:
-    res = []
+    return list(iter_item_urls(limit))
 
-    for i in tqdm(range(1, min(get_total_pages() + 1, limit)), desc="Fetching item urls", unit="page"):
-        res += get_item_urls(i)
 
-    return res
+def get_item_urls(page: int, search_url: str = MAIN_SEARCH_URL):
+    return get_listing_item_urls(search_url + str(page))
 
 
-def get_item_urls(page: int):
+def get_listing_item_urls(listing_url: str) -> [str]:
     item_urls = []
 
-    response = requests.get(MAIN_SEARCH_URL + str(page))
+    response = fetch.get(listing_url)
+    response.raise_for_status()
     soup = BeautifulSoup(response.text, 'html.parser')
 
     links = soup.find_all(class_=COLLECTION_ITEM_LINK_CLASS)
@@ -51,34 +70,226 @@ def get_item_urls(page: int):
     return item_urls
 
 
+class ListingEntry:
+    def __init__(self, url: str, latest_chapter_url: str | None, updated: date | None):
+        self.url = url
+        self.latest_chapter_url = latest_chapter_url
+        self.updated = updated
+
+    def is_unchanged(self, stored: (datetime, str) = None) -> bool:
+        """
+        Compares the entry against the stored (last_updated, latest chapter url) of its item. The listing only has
+        the day of the update, so an item counts as unchanged when its newest chapter is the stored one and it wasn't
+        updated after the stored day.
+        """
+        if stored is None:
+            return False
+
+        last_updated, latest_chapter_url = stored
+
+        return (self.latest_chapter_url == latest_chapter_url
+                and (self.updated is None or self.updated <= last_updated.date()))
+
+
+def get_listing_entries(page: int, search_url: str = MAIN_SEARCH_URL) -> [ListingEntry]:
+    response = fetch.get(search_url + str(page))
+    soup = BeautifulSoup(response.text, 'html.parser')
+
+    entries = []
+    for el in soup.find_all(class_=COLLECTION_ITEM_CLASS):
+        link = el.find(class_=COLLECTION_ITEM_LINK_CLASS)
+        if link is None:
+            continue
+
+        chapter = el.find(class_=COLLECTION_ITEM_CHAPTER_CLASS)
+        time_el = el.find(class_=COLLECTION_ITEM_TIME_CLASS)
+
+        try:
+            updated = datetime.strptime(time_el.text.strip(), COLLECTION_ITEM_DATE_FORMAT).date()
+        except (AttributeError, ValueError):
+            updated = None
+
+        entries.append(ListingEntry(link["href"], chapter["href"] if chapter is not None else None, updated))
+
+    return entries
+
+
+def iter_changed_item_urls(stop_after: int = STOP_AFTER_UNCHANGED, limit: int = 99999999,
+                           search_url: str = MAIN_SEARCH_URL):
+    """
+    Yields the urls of the items that changed since they were stored, newest first, and stops once `stop_after`
+    unchanged items were seen in a row. Each listing page costs one DB query.
+    """
+    unchanged = 0
+
+    for page in range(1, min(get_total_pages(search_url) + 1, limit)):
+        entries = get_listing_entries(page, search_url)
+
+        with DB.get_connection(readonly=True) as conn:
+            stored = DB.get_sync_states([entry.url for entry in entries], conn)
+
+        for entry in entries:
+            if entry.is_unchanged(stored.get(entry.url)):
+                unchanged += 1
+            else:
+                unchanged = 0
+                yield entry.url
+
+        if unchanged >= stop_after:
+            logging.info(f"Incremental scan stopped at page {page} after {unchanged} unchanged items")
+            return
+
+
 def add_item_from_url(urls: [str], l: [Item]):
     for url in urls:
         l.append(Item(url))
 
-def add_all_to_db():
-    item_urls = get_all_item_urls()
+def add_all_to_db(incremental: bool = False, restart: bool = False):
+    if not incremental:
+        if get_context().dialect == POSTGRES:
+            scan_frontier(restart)
+        else:
+            # Without the frontier a full scan can't resume, the crawler still skips unchanged items
+            from crawler import crawl_all_to_db
+            print(crawl_all_to_db())
+        return
 
-    for url in item_urls:
+    for url in iter_changed_item_urls():
         print(url)
         try:
             item = Item(url)
+            item.load_metadata()
         except Exception as e:
             logging.error(f"Couldn't scrape {url}, {e}", exc_info=True)
             print(f"Couldn't scrape {url}, {e}")
-            pass
+            continue
 
         try:
             with DB.get_connection() as conn:
-                DB.save_item(item, conn)
+                DB.save_item(item, conn, upload_thumbnail=False)
+
+            # Uploaded after the commit, so the encode doesn't hold the transaction open. Unchanged thumbnails are
+            # only revalidated, see `storage.objects`
+            DB.upload_thumbnail(item)
         except Exception as e:
             logging.error(f"Couldn't save {url}, {e}, item: {Item}", exc_info=True)
             print(f"Couldn't save {url}, {e}, item: {Item}")
             pass
 
 
-if __name__ == "__main__":
-    DB.create()
+def scan_frontier(restart: bool = False, search_url: str = MAIN_SEARCH_URL, max_pages: int = None):
+    """
+    Full scan driven by the crawl frontier (see `storage.frontier`) in this process: resumes the last scan if it
+    didn't finish, starts a new one otherwise or if `restart` is set. A new scan covers at most `max_pages` listing
+    pages. See `worker` to share a scan between processes.
+    """
+    from worker import Worker
 
-    add_all_to_db()
+    if get_context().dialect != POSTGRES:
+        raise RuntimeError("The crawl frontier needs the postgres backend, see storage.backend")
 
+    with DB.get_connection() as conn:
+        if not start_scan(conn, restart, search_url, max_pages):
+            # Nobody else works on this scan, so whatever was in progress was interrupted
+            logging.info(f"Resuming the last scan, {frontier.recover(conn)} entries were in progress")
+
+    Worker(batch_size=1).run()
+
+
+def start_scan(connection, restart: bool = False, search_url: str = MAIN_SEARCH_URL, max_pages: int = None) -> bool:
+    """
+    Seeds the frontier with every listing page (the first `max_pages` if given) if the last scan finished or
+    `restart` is set, returns whether it did.
+    """
+    count, _ = frontier.remaining(connection)
+    if count and not restart:
+        return False
+
+    frontier.clear(connection)
+    pages = get_total_pages(search_url)
+    if max_pages is not None:
+        pages = min(pages, max_pages)
+    frontier.add([(frontier.LISTING, search_url + str(page), None, page) for page in range(1, pages + 1)],
+                 connection)
+    logging.info(f"Started a new scan of {pages} listing pages")
+
+    return True
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def process_entry(kind: str, url: str, parent: str = None, position: int = None, worker_id: str = None):
+    """
+    Fetches one frontier entry and saves its results, marking it done in the same transaction.
+    Listing pages add their items, items add their new chapters, chapters are placed in every item that added them
+    (see `frontier.placements`).
+
+    Raises:
+        LeaseLost: `worker_id` doesn't hold the entry's lease anymore, nothing was saved.
+    """
+    if kind == frontier.LISTING:
+        urls = get_listing_item_urls(url)
+
+        with DB.get_connection() as conn:
+            frontier.add([(frontier.ITEM, item_url, None, None) for item_url in urls], conn)
+            _done(kind, url, conn, worker_id)
+
+    elif kind == frontier.ITEM:
+        item = Item(url)
+        item.load_metadata()
+
+        with DB.get_connection() as conn:
+            new_chapters = DB.save_item(item, conn, upload_thumbnail=False, save_new_chapters=False)
+
+            # Only chapters that were never scraped become entries, known ones are placed right away
+            unknown = set(DB.get_unknown_chapters([chapter_url for _, _, chapter_url in new_chapters], conn))
+            DB.save_item_chapters([row for row in new_chapters if row[2] not in unknown], conn)
+            placed = frontier.add([(frontier.CHAPTER, chapter_url, item_url, nr)
+                                   for item_url, nr, chapter_url in new_chapters if chapter_url in unknown], conn)
+            # Chapters another item's entry finished in the meantime
+            DB.save_item_chapters([(item_url, nr, chapter_url) for _, chapter_url, item_url, nr in placed], conn)
+            _done(kind, url, conn, worker_id)
+
+        try:
+            DB.upload_thumbnail(item)
+        except Exception as e:
+            logging.error(f"Couldn't upload the thumbnail of {url}, {e}", exc_info=True)
+
+    elif kind == frontier.CHAPTER:
+        chapter = Chapter(url).load()
+
+        with DB.get_connection() as conn:
+            DB.save_chapters([chapter], conn)
+            _done(kind, url, conn, worker_id)
+            DB.save_item_chapters([(item_url, nr, url) for item_url, nr in frontier.placements(url, conn)], conn)
+
+    else:
+        raise ValueError(f"Unknown frontier entry kind {kind}")
+
+
+def _done(kind: str, url: str, connection, worker_id: str = None):
+    # Raising rolls back the entry's results, the worker that holds the lease now saves them
+    if not frontier.done(kind, url, connection, worker_id):
+        raise LeaseLost(f"Lease on {kind} {url} expired")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan the whole listing and save it to the DB")
+    parser.add_argument("--sequential", action="store_true", help="Scrape one item at a time instead of the pipeline")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only scan the items updated since the last run, newest first")
+    parser.add_argument("--restart", action="store_true",
+                        help="Start a new sequential scan instead of resuming the last unfinished one")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    DB.create()
 
+    with metrics.exported(args.metrics_port, args.metrics_json):
+        if args.sequential:
+            add_all_to_db(args.incremental, args.restart)
+        else:
+            from crawler import crawl_all_to_db
+            print(crawl_all_to_db(incremental=args.incremental))
@@ -0,0 +1,58 @@
+"""
+Where the library lives: a database for the tables and an object store for the images. `StorageContext` holds the
+backend picked with STORAGE_BACKEND:
+
+    postgres  Postgres and MinIO, the default. Everything works, including the crawl frontier, worker mode, the mirror
+              and search.
+    sqlite    One SQLite file (SQLITE_PATH) and a content-addressed directory of objects (OBJECT_STORE_PATH), no
+              services needed. Scans run through the crawler, the Postgres only parts aren't available.
+
+The tables are written with the same SQL on both, `%s` placeholders and `= ANY(%s)` are translated for SQLite, and the
+set based writes go through `storage.bulk`, which picks the statement that is fast on each.
+"""
+from contextlib import contextmanager
+
+POSTGRES = "postgres"
+SQLITE = "sqlite"
+
+
+class Backend:
+    dialect: str
+
+    @contextmanager
+    def connection(self, readonly: bool = False):
+        """
+        Yields a connection; commits when the block succeeds, rolls back when it raises. A `readonly` block promises
+        not to write, so it doesn't have to wait for the writer.
+        """
+        raise NotImplementedError
+
+    def connect(self):
+        """
+        Opens a new connection outside of `connection()`, e.g. for long running cursors. The caller closes it.
+        """
+        raise NotImplementedError
+
+    def put_object(self, bucket_name: str, object_name: str, data: bytes, content_type: str):
+        raise NotImplementedError
+
+    def fput_object(self, bucket_name: str, object_name: str, path: str):
+        raise NotImplementedError
+
+    def fget_object(self, bucket_name: str, object_name: str, destination: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def create_backend(config) -> Backend:
+    if config.backend == POSTGRES:
+        from storage.postgres import PostgresBackend
+        return PostgresBackend(config)
+
+    if config.backend == SQLITE:
+        from storage.sqlite import SQLiteBackend
+        return SQLiteBackend(config)
+
+    raise ValueError(f"Unknown STORAGE_BACKEND {config.backend}, expected {POSTGRES} or {SQLITE}")
@@ -0,0 +1,136 @@
+"""
+Helpers for set based writes: rows are streamed into a session local staging table with COPY and merged into the
+real table with a single INSERT ... SELECT, instead of one statement per row.
+
+Every helper takes a Postgres or a SQLite cursor (see `storage.sqlite`) and uses what is fast on each: multi-row
+statements and COPY on Postgres, where every statement is a round-trip, and prepared `executemany` on SQLite, where
+statements are function calls.
+"""
+import io
+
+from psycopg2 import extras
+
+from storage.sqlite import SQLiteCursor
+
+PAGE_SIZE = 1000  # rows per multi-row statement
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return r'\N'
+
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def execute_values(cursor, sql: str, rows: [tuple], page_size: int = PAGE_SIZE):
+    """
+    Runs `sql` with its `VALUES %s` expanded to the rows, `page_size` rows per statement.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+
+    if isinstance(cursor, SQLiteCursor):
+        template = "(" + ", ".join(["%s"] * len(rows[0])) + ")"
+        cursor.executemany(sql.replace("VALUES %s", "VALUES " + template, 1), rows)
+        return
+
+    extras.execute_values(cursor, sql, rows, page_size=page_size)
+
+
+def delete_rows(cursor, table: str, columns: [str], rows: [tuple], page_size: int = PAGE_SIZE):
+    """
+    Deletes the rows of `table` whose `columns` equal one of `rows`.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+
+    if isinstance(cursor, SQLiteCursor):
+        cursor.executemany(f"DELETE FROM {table} WHERE {' AND '.join(f'{c} = %s' for c in columns)}", rows)
+        return
+
+    extras.execute_values(cursor, f'''
+        DELETE FROM {table} t USING (VALUES %s) AS v({', '.join(columns)})
+        WHERE {' AND '.join(f't.{c} = v.{c}' for c in columns)}
+    ''', rows, page_size=page_size)
+
+
+def update_rows(cursor, table: str, key_columns: [str], set_columns: [str], rows: [tuple],
+                page_size: int = PAGE_SIZE):
+    """
+    Sets `set_columns` of the rows of `table` matching `key_columns`, every row is the keys followed by the new values.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+
+    if isinstance(cursor, SQLiteCursor):
+        assignments = ', '.join(f'{c} = %s' for c in set_columns)
+        condition = ' AND '.join(f'{c} = %s' for c in key_columns)
+        keys = len(key_columns)
+        cursor.executemany(f"UPDATE {table} SET {assignments} WHERE {condition}",
+                           (row[keys:] + row[:keys] for row in map(tuple, rows)))
+        return
+
+    new_columns = [f'new_{c}' for c in set_columns]
+    extras.execute_values(cursor, f'''
+        UPDATE {table} t SET {', '.join(f'{c} = v.new_{c}' for c in set_columns)}
+        FROM (VALUES %s) AS v({', '.join(key_columns + new_columns)})
+        WHERE {' AND '.join(f't.{c} = v.{c}' for c in key_columns)}
+    ''', rows, page_size=page_size)
+
+
+def staging_table(cursor, table: str) -> str:
+    """
+    Creates (once per session) an empty staging copy of `table` without its constraints and returns its name.
+    """
+    staging = f"staging_{table}"
+
+    if isinstance(cursor, SQLiteCursor):
+        cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {staging} AS SELECT * FROM {table} WHERE false')
+        cursor.execute(f'DELETE FROM {staging}')
+        return staging
+
+    cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table}) ON COMMIT DELETE ROWS')
+    cursor.execute(f'TRUNCATE {staging}')
+
+    return staging
+
+
+def copy_rows(cursor, table: str, columns: [str], rows: [tuple]) -> int:
+    """
+    Streams rows into `table` with COPY, returns the number of rows sent.
+    """
+    if isinstance(cursor, SQLiteCursor):
+        rows = list(rows)
+        cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                           rows)
+        return len(rows)
+
+    buffer = io.StringIO()
+    count = 0
+
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(v) for v in row))
+        buffer.write('\n')
+        count += 1
+
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+    return count
+
+
+def stage_rows(cursor, table: str, columns: [str], rows: [tuple]) -> str:
+    """
+    Copies rows into the staging table of `table` and returns the staging table's name.
+    """
+    staging = staging_table(cursor, table)
+    copy_rows(cursor, staging, columns, rows)
+
+    return staging
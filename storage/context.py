@@ -0,0 +1,165 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from storage.backend import Backend, POSTGRES, create_backend
+
+DEFAULT_POOL_MIN = 1
+DEFAULT_POOL_MAX = 10
+DEFAULT_SQLITE_PATH = "library.db"
+DEFAULT_OBJECT_STORE_PATH = "objects"
+
+
+class Config:
+    """
+    Storage settings, read from the environment (and .env) once.
+    """
+
+    def __init__(self, env: {str: str}):
+        self.backend = env.get('STORAGE_BACKEND', POSTGRES)
+
+        self.db = {
+            "dbname": env.get('DB_NAME'),
+            "user": env.get('DB_USER'),
+            "password": env.get('DB_PASSWORD'),
+            "host": env.get('DB_ADDR'),
+            "port": env.get('DB_PORT'),
+        }
+        self.pool_min = int(env.get('DB_POOL_MIN', DEFAULT_POOL_MIN))
+        self.pool_max = int(env.get('DB_POOL_MAX', DEFAULT_POOL_MAX))
+
+        self.minio_endpoint = f"{env.get('MINIO_ADDR')}:{env.get('MINIO_PORT')}"
+        self.minio_access_key = env.get('MINIO_ACCESS_KEY')
+        self.minio_secret_key = env.get('MINIO_SECRET_KEY')
+
+        self.sqlite_path = env.get('SQLITE_PATH', DEFAULT_SQLITE_PATH)
+        self.object_store_path = env.get('OBJECT_STORE_PATH', DEFAULT_OBJECT_STORE_PATH)
+
+    @staticmethod
+    def from_env():
+        load_dotenv()
+        return Config(os.environ)
+
+
+class StorageContext:
+    """
+    Process wide storage handles: the backend picked in the config (see `storage.backend`), created on first use and
+    shared by every thread afterwards.
+    """
+
+    def __init__(self, config: Config = None):
+        self._config = config
+        self._backend = None
+        self._after_commit = {}
+        self._lock = threading.Lock()
+
+    @property
+    def config(self) -> Config:
+        if self._config is None:
+            self._config = Config.from_env()
+        return self._config
+
+    @property
+    def backend(self) -> Backend:
+        with self._lock:
+            if self._backend is None:
+                self._backend = create_backend(self.config)
+
+            return self._backend
+
+    @property
+    def dialect(self) -> str:
+        return self.config.backend
+
+    @contextmanager
+    def connection(self, readonly: bool = False):
+        """
+        Borrows a connection; commits when the block succeeds, rolls back when it raises. A `readonly` block must not
+        write, see `SQLiteBackend.connection`.
+        """
+        with self.backend.connection(readonly) as conn:
+            # A block nested on the same connection (SQLite) commits with the outer one, so do its callbacks
+            nested = id(conn) in self._after_commit
+            if not nested:
+                self._after_commit[id(conn)] = []
+            registered = len(self._after_commit[id(conn)])
+
+            try:
+                yield conn
+            except BaseException:
+                if nested:
+                    # Only the nested block's savepoint is rolled back, and its callbacks with it
+                    del self._after_commit[id(conn)][registered:]
+                else:
+                    self._after_commit.pop(id(conn), None)
+                raise
+
+            if nested:
+                return
+            callbacks = self._after_commit.pop(id(conn), [])
+
+        # Only reached when the block committed
+        for callback in callbacks:
+            callback()
+
+    def after_commit(self, conn, callback):
+        """
+        Calls `callback` once the transaction of a connection borrowed with `connection()` commits, never if it's
+        rolled back. Use it for in-process state that mirrors what's committed. Callbacks on connections that weren't
+        borrowed with `connection()` are dropped.
+        """
+        callbacks = self._after_commit.get(id(conn))
+        if callbacks is not None:
+            callbacks.append(callback)
+
+    def connect(self):
+        """
+        Opens a new connection outside of the pool, e.g. for long running server-side cursors.
+        """
+        return self.backend.connect()
+
+    def minio(self):
+        """
+        The MinIO client, postgres backend only.
+        """
+        return self.backend.minio()
+
+    def ensure_bucket(self, bucket_name: str):
+        if self.dialect == POSTGRES:
+            self.backend.ensure_bucket(bucket_name)
+
+    def close(self):
+        with self._lock:
+            if self._backend is not None:
+                self._backend.close()
+                self._backend = None
+
+
+_context = None
+_context_lock = threading.Lock()
+
+
+def get_context() -> StorageContext:
+    global _context
+
+    with _context_lock:
+        if _context is None:
+            _context = StorageContext()
+
+        return _context
+
+
+def configure(config: Config) -> StorageContext:
+    """
+    Replaces the process wide context, e.g. to switch backends in a benchmark. The old one is closed.
+    """
+    global _context
+
+    with _context_lock:
+        if _context is not None:
+            _context.close()
+
+        _context = StorageContext(config)
+        return _context
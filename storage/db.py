@@ -2,21 +2,22 @@ from datetime import datetime
 
 from models.chapter import Chapter
 from models.item import Item
+from models.lazy import prefetch
 from models.metadata import Author, Genre
 
-import psycopg2
-import tempfile
-
-from dotenv import load_dotenv
-import os
-
-from storage.media import store_object
-from util.imageutil import download_image, convert_to_heif
+from storage import registry, search
+from storage.backend import POSTGRES
+from storage.bulk import PAGE_SIZE, delete_rows, execute_values, stage_rows, update_rows
+from storage.context import get_context
+from storage.thumbnails import upload_thumbnail
+from util import metrics
 
 
 class DB:
     @staticmethod
     def create():
+        postgres = get_context().dialect == POSTGRES
+
         with DB.get_connection() as connection:
             cursor = connection.cursor()
 
@@ -48,11 +49,15 @@ class DB:
                            chapter_url TEXT,
                            image_url TEXT,
                            image_url_nr INTEGER,
+                           byte_size BIGINT,
                            PRIMARY KEY (chapter_url, image_url_nr),
                            FOREIGN KEY (chapter_url) REFERENCES chapters(chapter_url)
                        )
                    ''')
 
+            if postgres:
+                cursor.execute('ALTER TABLE chapter_images ADD COLUMN IF NOT EXISTS byte_size BIGINT')
+
             cursor.execute('''
                         CREATE TABLE IF NOT EXISTS items (
                             item_url TEXT PRIMARY KEY,
@@ -99,160 +104,440 @@ class DB:
                         )
                     ''')
 
+            cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS stored_objects (
+                            bucket TEXT,
+                            content_hash TEXT,
+                            object_name TEXT,
+                            byte_size BIGINT,
+                            created TEXT,
+                            PRIMARY KEY (bucket, content_hash)
+                        )
+                    ''')
+
+            cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS object_sources (
+                            bucket TEXT,
+                            source_url TEXT,
+                            content_hash TEXT,
+                            etag TEXT,
+                            byte_size BIGINT,
+                            checked TEXT,
+                            PRIMARY KEY (bucket, source_url),
+                            FOREIGN KEY (bucket, content_hash) REFERENCES stored_objects(bucket, content_hash)
+                        )
+                    ''')
+
+            # No foreign key on chapter_images, a rescan can drop or renumber its rows
+            cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS mirror_images (
+                            chapter_url TEXT,
+                            image_url_nr INTEGER,
+                            image_url TEXT,
+                            status TEXT,
+                            object_name TEXT,
+                            byte_size BIGINT,
+                            attempts INTEGER,
+                            last_error TEXT,
+                            updated TEXT,
+                            PRIMARY KEY (chapter_url, image_url_nr)
+                        )
+                    ''')
+
+            # The crawl frontier and search are Postgres only, see `storage.backend`
+            if not postgres:
+                return
+
+            # Scan state, see `storage.frontier`
+            cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS crawl_frontier (
+                            kind TEXT,
+                            url TEXT,
+                            state TEXT NOT NULL DEFAULT 'pending',
+                            parent TEXT,
+                            position INTEGER,
+                            placements JSONB NOT NULL DEFAULT '[]',
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            last_error TEXT,
+                            next_attempt TIMESTAMPTZ NOT NULL DEFAULT now(),
+                            leased_by TEXT,
+                            lease_expires TIMESTAMPTZ,
+                            updated TIMESTAMPTZ NOT NULL DEFAULT now(),
+                            seq BIGSERIAL,
+                            PRIMARY KEY (kind, url)
+                        )
+                    ''')
+
+            cursor.execute('ALTER TABLE crawl_frontier ADD COLUMN IF NOT EXISTS leased_by TEXT')
+            cursor.execute('ALTER TABLE crawl_frontier ADD COLUMN IF NOT EXISTS lease_expires TIMESTAMPTZ')
+            cursor.execute("ALTER TABLE crawl_frontier ADD COLUMN IF NOT EXISTS placements JSONB NOT NULL DEFAULT '[]'")
+            cursor.execute('CREATE INDEX IF NOT EXISTS crawl_frontier_ready ON crawl_frontier (state, next_attempt)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS crawl_frontier_leases ON crawl_frontier (state, lease_expires)')
+
+            search.create_indexes(connection)
+
     @staticmethod
     def save_author(author: Author, connection):
-        cursor = connection.cursor()
+        DB.save_authors([author], connection)
 
-        cursor.execute('''
+    @staticmethod
+    def save_genre(genre: Genre, connection):
+        DB.save_genres([genre], connection)
+
+    @staticmethod
+    def save_authors(authors: [Author], connection):
+        # Only new or changed authors are written, see `storage.registry`
+        authors = registry.AUTHORS.changed(authors, connection)
+        if not authors:
+            return
+
+        # Sorted, so concurrent writers lock the shared rows in the same order instead of deadlocking
+        execute_values(connection.cursor(), '''
                     INSERT INTO authors (author_id, name, url)
-                    VALUES (%s, %s, %s)
+                    VALUES %s
                     ON CONFLICT(author_id) DO UPDATE SET
                         name = excluded.name,
                         url = excluded.url
-                ''', (author.id, author.name, author.url))
+                ''', [(a.id, a.name, a.url) for a in authors], page_size=PAGE_SIZE)
+
+        registry.AUTHORS.written(authors, connection)
 
     @staticmethod
-    def save_genre(genre: Genre, connection):
-        cursor = connection.cursor()
+    def save_genres(genres: [Genre], connection):
+        genres = registry.GENRES.changed(genres, connection)
+        if not genres:
+            return
 
-        cursor.execute('''
+        execute_values(connection.cursor(), '''
                         INSERT INTO genres (genre_id, name, url)
-                        VALUES (%s, %s, %s)
+                        VALUES %s
                         ON CONFLICT(genre_id) DO UPDATE SET
                             name = excluded.name,
                             url = excluded.url
-                    ''', (genre.id, genre.name, genre.url))
+                    ''', [(g.id, g.name, g.url) for g in genres], page_size=PAGE_SIZE)
+
+        registry.GENRES.written(genres, connection)
 
     @staticmethod
     def save_chapter(chapter: Chapter, connection):
-        cursor = connection.cursor()
-        print(chapter.name)
-
-        cursor.execute('''
-            INSERT INTO chapters (chapter_url, name)
-            VALUES (%s, %s)
-            ON CONFLICT (chapter_url) DO NOTHING
-        ''', (chapter.url, chapter.name))
-
-        cursor.execute('DELETE FROM chapter_images WHERE chapter_url = %s', (chapter.url,))
-
-        for i, image_url in enumerate(chapter.image_urls):
-            cursor.execute('''
-                        INSERT INTO chapter_images (chapter_url, image_url, image_url_nr)
-                        VALUES (%s, %s, %s)
-                    ''', (chapter.url, image_url, i))
+        DB.save_chapters([chapter], connection)
 
     @staticmethod
-    def is_item_outdated(item: Item, connection):
-        cursor = connection.cursor()
+    @metrics.timer("db_save_chapters_seconds")
+    def save_chapters(chapters: [Chapter], connection):
+        chapters = list({chapter.url: chapter for chapter in chapters}.values())
+        if not chapters:
+            return
 
-        cursor.execute('SELECT last_updated FROM items WHERE item_url = %s', (item.url,))
-        row = cursor.fetchone()
+        metrics.inc("chapters_saved_total", len(chapters))
 
-        if row is None:
-            return True
+        cursor = connection.cursor()
 
-        db_last_updated = datetime.fromisoformat(row[0])
+        staging_chapters = stage_rows(cursor, 'chapters', ['chapter_url', 'name'],
+                                      ((c.url, c.name) for c in chapters))
+        staging_images = stage_rows(cursor, 'chapter_images', ['chapter_url', 'image_url', 'image_url_nr'],
+                                    ((c.url, image_url, i)
+                                     for c in chapters for i, image_url in enumerate(c.image_urls)))
 
-        return item.last_updated > db_last_updated
+        cursor.execute(f'''
+            INSERT INTO chapters (chapter_url, name)
+            SELECT chapter_url, name FROM {staging_chapters} WHERE true
+            ON CONFLICT (chapter_url) DO NOTHING
+        ''')
+
+        # Upserted instead of replaced, so the sizes found by `storage.sizing` survive a rescan of an unchanged chapter
+        cursor.execute(f'''
+            DELETE FROM chapter_images
+            WHERE chapter_url IN (SELECT chapter_url FROM {staging_chapters})
+              AND NOT EXISTS (
+                SELECT 1 FROM {staging_images} s
+                WHERE s.chapter_url = chapter_images.chapter_url AND s.image_url_nr = chapter_images.image_url_nr
+              )
+        ''')
+
+        cursor.execute(f'''
+            INSERT INTO chapter_images (chapter_url, image_url, image_url_nr)
+            SELECT chapter_url, image_url, image_url_nr FROM {staging_images} WHERE true
+            ON CONFLICT (chapter_url, image_url_nr) DO UPDATE SET
+                image_url = excluded.image_url,
+                byte_size = NULL
+            WHERE chapter_images.image_url IS DISTINCT FROM excluded.image_url
+        ''')
 
     @staticmethod
-    def upload_thumbnail(item: Item, object_name: str):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            ext = item.thumbnail_url.split('.')[-1]
+    def is_item_outdated(item: Item, connection):
+        return item.url in DB.get_outdated([item], connection)
 
-            original_dest = f"{temp_dir}/original.{ext}"
-            compressed_dest = f"{temp_dir}/compressed.heif"
+    @staticmethod
+    def get_outdated(items: [Item], connection) -> {str}:
+        """
+        Returns the urls of the items that aren't stored yet or are stored with an older `last_updated`.
+        """
+        cursor = connection.cursor()
 
-            download_image(item.thumbnail_url, original_dest)
-            convert_to_heif(original_dest, compressed_dest, quality=40)
+        cursor.execute('SELECT item_url, last_updated FROM items WHERE item_url = ANY(%s)',
+                       ([item.url for item in items],))
+        stored = {row[0]: datetime.fromisoformat(row[1]) for row in cursor.fetchall()}
 
-            store_object("mangalib.thumbnail", object_name, compressed_dest)
+        return {item.url for item in items if item.url not in stored or item.last_updated > stored[item.url]}
 
+    @staticmethod
+    def upload_thumbnail(item: Item, connection=None) -> str:
+        """
+        Stores the item's thumbnail unless an identical one is already stored, returns what happened (see
+        `storage.objects`). Pass the connection if the item isn't committed yet.
+        """
+        return upload_thumbnail(item.url, item.thumbnail_url, connection=connection).status
 
     @staticmethod
     def is_thumbnail_in_db(item: Item, connection):
+        return item.url in DB.get_thumbnails_in_db([item], connection)
+
+    @staticmethod
+    def get_thumbnails_in_db(items: [Item], connection) -> {str}:
         cursor = connection.cursor()
 
         query = '''
-                        SELECT thumbnail_object_name
+                        SELECT item_url
                         FROM items
-                        WHERE item_url = %s
+                        WHERE item_url = ANY(%s) AND thumbnail_object_name IS NOT NULL
                     '''
 
-        cursor.execute(query, (item.url,))
-        result = cursor.fetchone()
+        cursor.execute(query, ([item.url for item in items],))
 
-        return result is not None
+        return {row[0] for row in cursor.fetchall()}
 
+    @staticmethod
+    def save_item(item: Item, connection, chapters: {str: Chapter} = None, upload_thumbnail: bool = True,
+                  save_new_chapters: bool = True) -> [(str, int, str)]:
+        return DB.save_items([item], connection, chapters, upload_thumbnail, save_new_chapters)
 
     @staticmethod
-    def save_item(item: Item, connection):
+    @metrics.timer("db_save_items_seconds")
+    def save_items(items: [Item], connection, chapters: {str: Chapter} = None, upload_thumbnail: bool = True,
+                   save_new_chapters: bool = True) -> [(str, int, str)]:
+        """
+        Saves many items with a fixed number of round-trips: every table is written with one multi-row statement
+        (or one COPY for the chapter images) no matter how many items, authors, genres or chapters there are.
+        Everything happens in the connection's current transaction.
+
+        Parameters:
+            items ([Item]): Items to save.
+            connection: Open DB connection.
+            chapters (dict): Already scraped chapters by url, other new chapters are scraped here.
+            upload_thumbnail (bool): Upload the thumbnails, unchanged ones are only revalidated. Pass False and upload
+                after the commit (see `storage.thumbnails`) to keep the transaction short.
+            save_new_chapters (bool): Scrape and save the new chapters of outdated items. Pass False to only get them
+                and save them later with `save_chapters` and `save_item_chapters`. Chapters that only moved are
+                renumbered either way.
+
+        Returns:
+            (item url, chapter nr, chapter url) of the chapters new to outdated items, see `sync_item_chapters`.
+        """
+        items = list({item.url: item for item in items}.values())
+        if not items:
+            return []
+
+        metrics.inc("items_saved_total", len(items))
+
         cursor = connection.cursor()
+        urls = [item.url for item in items]
 
-        outdated = DB.is_item_outdated(item, connection)
-        thumbnail_in_db = DB.is_thumbnail_in_db(item, connection)
-        thumbnail_object_name = f"thumbnail_{item.url.split('/')[-1]}.heif"
+        outdated = DB.get_outdated(items, connection)
 
-        cursor.execute('''
+        execute_values(cursor, '''
             INSERT INTO items (item_url, last_updated, name, alternative, status, description, thumbnail_object_name, 
                                 views, rating, votes)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            VALUES %s
             ON CONFLICT(item_url) DO UPDATE SET
                 last_updated = excluded.last_updated,
                 name = excluded.name,
                 status = excluded.status,
                 description = excluded.description,
-                thumbnail_object_name = excluded.thumbnail_object_name,
                 views = excluded.views,
                 rating = excluded.rating,
                 votes = excluded.votes
-                ''', (item.url, item.last_updated.isoformat(), item.name, item.alternative, item.status,
-                      item.description, thumbnail_object_name, item.views, item.rating, item.votes))
+                ''', [(item.url, item.last_updated.isoformat(), item.name, item.alternative, item.status,
+                       item.description, None, item.views, item.rating, item.votes)
+                      for item in items], page_size=PAGE_SIZE)
 
-        cursor.execute('DELETE FROM item_authors WHERE item_url = %s', (item.url,))
-        for author in item.authors:
-            DB.save_author(author, connection)
-            cursor.execute('''INSERT INTO item_authors (item_url, author_id) VALUES (%s, %s)
-                            ON CONFLICT (item_url, author_id) DO NOTHING''', (item.url, author.id))
+        DB.save_authors([author for item in items for author in item.authors], connection)
+        cursor.execute('DELETE FROM item_authors WHERE item_url = ANY(%s)', (urls,))
+        execute_values(cursor, '''INSERT INTO item_authors (item_url, author_id) VALUES %s
+                            ON CONFLICT (item_url, author_id) DO NOTHING''',
+                       list({(item.url, author.id) for item in items for author in item.authors}),
+                       page_size=PAGE_SIZE)
 
-        cursor.execute('DELETE FROM item_genres WHERE item_url = %s', (item.url,))
-        for genre in item.genres:
-            DB.save_genre(genre, connection)
-            cursor.execute('''INSERT INTO item_genres (item_url, genre_id) VALUES (%s, %s) 
-                                ON CONFLICT (item_url, genre_id) DO NOTHING''', (item.url, genre.id))
+        DB.save_genres([genre for item in items for genre in item.genres], connection)
+        cursor.execute('DELETE FROM item_genres WHERE item_url = ANY(%s)', (urls,))
+        execute_values(cursor, '''INSERT INTO item_genres (item_url, genre_id) VALUES %s 
+                                ON CONFLICT (item_url, genre_id) DO NOTHING''',
+                       list({(item.url, genre.id) for item in items for genre in item.genres}),
+                       page_size=PAGE_SIZE)
 
-        if not thumbnail_in_db:
-            DB.upload_thumbnail(item, thumbnail_object_name)
+        if upload_thumbnail:
+            for item in items:
+                DB.upload_thumbnail(item, connection)
 
-        if outdated:
-            cursor.execute('SELECT chapter_nr, chapter_url FROM item_chapters WHERE item_url = %s', (item.url,))
-            existing_chapters = {(row[0], row[1]) for row in cursor.fetchall()}
+        new_chapters = DB.sync_item_chapters([item for item in items if item.url in outdated], connection)
+        if not new_chapters or not save_new_chapters:
+            return new_chapters
 
-            for i, chapter_url in enumerate(item.chapter_urls):
-                if (i, chapter_url) not in existing_chapters:
-                    cursor.execute('DELETE FROM item_chapters WHERE chapter_nr=%s AND item_url=%s', (i, item.url))
+        # Chapters shared with another item or placed before a renumbering are stored already
+        chapters = chapters or {}
+        unknown = DB.get_unknown_chapters([chapter_url for _, _, chapter_url in new_chapters], connection)
+        DB.save_chapters(prefetch([chapters.get(url) or Chapter(url) for url in unknown]), connection)
 
-                    chapter = Chapter(chapter_url)
-                    DB.save_chapter(chapter, connection)
-                    cursor.execute('INSERT INTO item_chapters (item_url, chapter_url, chapter_nr) VALUES (%s, %s, %s)',
-                                   (item.url, chapter_url, i))
+        DB.save_item_chapters(new_chapters, connection)
+
+        return new_chapters
+
+    @staticmethod
+    def save_item_chapters(item_chapters: [(str, int, str)], connection):
+        """
+        Places (item url, chapter nr, chapter url) rows, replacing whatever chapter was stored at that position.
+        The chapters have to be saved already.
+        """
+        cursor = connection.cursor()
+
+        rows = [(item_url, chapter_url, i) for item_url, i, chapter_url in item_chapters]
+        delete_rows(cursor, 'item_chapters', ['item_url', 'chapter_nr'], [(item_url, i) for item_url, _, i in rows],
+                    page_size=PAGE_SIZE)
+        execute_values(cursor, 'INSERT INTO item_chapters (item_url, chapter_url, chapter_nr) VALUES %s', rows,
+                       page_size=PAGE_SIZE)
 
     @staticmethod
-    def get_connection():
-        load_dotenv()
-
-        try:
-            return psycopg2.connect(
-                dbname=os.environ['DB_NAME'],
-                user=os.environ['DB_USER'],
-                password=os.environ['DB_PASSWORD'],
-                host=os.environ['DB_ADDR'],
-                port=os.environ['DB_PORT']
+    def get_new_chapters(item: Item, connection) -> [(int, str)]:
+        return [(i, chapter_url) for _, i, chapter_url in DB.get_all_new_chapters([item], connection)]
+
+    @staticmethod
+    def get_all_new_chapters(items: [Item], connection) -> [(str, int, str)]:
+        """
+        Returns (item url, chapter nr, chapter url) for every chapter of the items whose url isn't stored for that item
+        yet. Chapters stored at another position aren't new, `sync_item_chapters` only renumbers them.
+        """
+        _, _, added = _diff_chapters(items, DB.get_item_chapters(items, connection))
+        return added
+
+    @staticmethod
+    def get_item_chapters(items: [Item], connection) -> {str: [(int, str)]}:
+        """
+        Returns the stored (chapter nr, chapter url) of every item.
+        """
+        cursor = connection.cursor()
+
+        cursor.execute('SELECT item_url, chapter_nr, chapter_url FROM item_chapters WHERE item_url = ANY(%s)',
+                       ([item.url for item in items],))
+
+        stored = {}
+        for item_url, nr, chapter_url in cursor.fetchall():
+            stored.setdefault(item_url, []).append((nr, chapter_url))
+
+        return stored
+
+    @staticmethod
+    def sync_item_chapters(items: [Item], connection) -> [(str, int, str)]:
+        """
+        Matches the stored chapter lists of the items with `item.chapter_urls` by url instead of position: chapters gone
+        upstream are deleted and moved chapters are renumbered in bulk, so a renumbering upstream doesn't rewrite the
+        whole series. A fixed number of statements no matter how many chapters moved.
+
+        Returns:
+            (item url, chapter nr, chapter url) of the chapters new to their item, to be placed with
+            `save_item_chapters` once they're saved. Only the ones `get_unknown_chapters` returns need scraping.
+        """
+        if not items:
+            return []
+
+        removed, moved, added = _diff_chapters(items, DB.get_item_chapters(items, connection))
+        cursor = connection.cursor()
+
+        delete_rows(cursor, 'item_chapters', ['item_url', 'chapter_nr'], removed, page_size=PAGE_SIZE)
+
+        if moved:
+            # (item_url, chapter_nr) is unique and checked per row, shifting every chapter by one in place would
+            # collide. Move them to free negative numbers first, then flip them to their new numbers.
+            update_rows(cursor, 'item_chapters', ['item_url', 'chapter_nr'], ['chapter_nr'],
+                        [(item_url, old_nr, -1 - new_nr) for item_url, old_nr, new_nr in moved], page_size=PAGE_SIZE)
+            cursor.execute('''
+                UPDATE item_chapters SET chapter_nr = -1 - chapter_nr
+                WHERE item_url = ANY(%s) AND chapter_nr < 0
+            ''', (list({item_url for item_url, _, _ in moved}),))
+
+        metrics.inc("item_chapters_synced_total", len(removed), change="removed")
+        metrics.inc("item_chapters_synced_total", len(moved), change="moved")
+        metrics.inc("item_chapters_synced_total", len(added), change="added")
+
+        return added
+
+    @staticmethod
+    def get_unknown_chapters(chapter_urls: [str], connection) -> [str]:
+        """
+        Returns the urls that aren't in `chapters` yet, in order and without duplicates.
+        """
+        chapter_urls = list(dict.fromkeys(chapter_urls))
+        if not chapter_urls:
+            return []
+
+        cursor = connection.cursor()
+        cursor.execute('SELECT chapter_url FROM chapters WHERE chapter_url = ANY(%s)', (chapter_urls,))
+        known = {row[0] for row in cursor.fetchall()}
+
+        return [url for url in chapter_urls if url not in known]
+
+    @staticmethod
+    def get_sync_states(item_urls: [str], connection) -> {str: (datetime, str)}:
+        """
+        Returns (last_updated, url of the newest chapter) of every stored item in `item_urls`, in one query.
+        """
+        cursor = connection.cursor()
+
+        cursor.execute('''
+            SELECT i.item_url, i.last_updated, (
+                SELECT chapter_url FROM item_chapters ic
+                WHERE ic.item_url = i.item_url
+                ORDER BY ic.chapter_nr DESC
+                LIMIT 1
             )
+            FROM items i
+            WHERE i.item_url = ANY(%s)
+        ''', (list(item_urls),))
 
-        except psycopg2.OperationalError as e:
-            raise RuntimeError("Couldn't connect to database: " + str(e))
+        return {row[0]: (datetime.fromisoformat(row[1]), row[2]) for row in cursor.fetchall()}
+
+    @staticmethod
+    def get_connection(readonly: bool = False):
+        """
+        Borrows a connection from the process wide pool, use as `with DB.get_connection() as conn:`.
+        The transaction is committed (or rolled back) and the connection returned to the pool at the end of the block.
+        Pass `readonly` for blocks that only read, on SQLite they don't wait for the writer then.
+        """
+        return get_context().connection(readonly)
+
+
+def _diff_chapters(items: [Item], stored: {str: [(int, str)]}) -> ([(str, int)], [(str, int, int)], [(str, int, str)]):
+    """
+    Returns the stored rows to delete as (item url, chapter nr), the ones to move as (item url, old nr, new nr) and the
+    rows to add as (item url, chapter nr, chapter url), matching chapters by url.
+    """
+    removed, moved, added = [], [], []
+
+    for item in items:
+        wanted = {}
+        for nr, chapter_url in enumerate(item.chapter_urls):
+            wanted.setdefault(chapter_url, nr)
+
+        # One stored row per url, the one already in place if a url was stored twice
+        kept = {}
+        for nr, chapter_url in stored.get(item.url, []):
+            if chapter_url in wanted and (chapter_url not in kept or nr == wanted[chapter_url]):
+                kept[chapter_url] = nr
+
+        removed += [(item.url, nr) for nr, chapter_url in stored.get(item.url, []) if kept.get(chapter_url) != nr]
+        moved += [(item.url, nr, wanted[chapter_url]) for chapter_url, nr in kept.items() if nr != wanted[chapter_url]]
+        added += [(item.url, nr, chapter_url) for chapter_url, nr in wanted.items() if chapter_url not in kept]
+
+    return removed, moved, added
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+"""
+Local object store for the SQLite backend: `<root>/<bucket>/<first two characters>/<object name>`.
+
+Object names are already content hashes (see `storage.objects`), so a name that exists holds the same bytes and isn't
+written again. Writes go to a temporary file that is renamed into place, a crash never leaves half an object.
+"""
+import os
+import shutil
+import tempfile
+
+
+class FileStore:
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, bucket_name: str, object_name: str) -> str:
+        return os.path.join(self.root, bucket_name, object_name[:2], object_name)
+
+    def exists(self, bucket_name: str, object_name: str) -> bool:
+        return os.path.isfile(self.path(bucket_name, object_name))
+
+    def put(self, bucket_name: str, object_name: str, data: bytes):
+        path = self.path(bucket_name, object_name)
+        if os.path.isfile(path):
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def put_file(self, bucket_name: str, object_name: str, source: str):
+        with open(source, 'rb') as f:
+            self.put(bucket_name, object_name, f.read())
+
+    def get_file(self, bucket_name: str, object_name: str, destination: str):
+        shutil.copyfile(self.path(bucket_name, object_name), destination)
+
+    def stored_bytes(self) -> int:
+        return sum(os.path.getsize(os.path.join(directory, name))
+                   for directory, _, names in os.walk(self.root) for name in names if not name.startswith(".tmp-"))
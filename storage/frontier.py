@@ -0,0 +1,240 @@
+"""
+Durable crawl frontier: the state of every listing page, item and chapter of a scan, kept in `crawl_frontier`.
+
+Workers lease batches of ready entries with `SELECT ... FOR UPDATE SKIP LOCKED`, so any number of worker processes on
+any number of hosts share a scan without ever getting the same entry. A lease expires after `lease_seconds` unless it's
+renewed, so the work of a crashed worker is picked up by the others. An entry is marked done in the same transaction
+that saves its results, and only by the worker holding its lease, so a scan resumes exactly where it stopped and never
+fetches finished work again. Failed entries are retried with exponential backoff until MAX_ATTEMPTS.
+
+A chapter shared by several items is one entry with every placement (item url, position) in `placements`, so it's
+fetched once and placed in all of them, see `add` and `placements`.
+"""
+import json
+
+from psycopg2.extras import execute_values
+
+from storage.db import PAGE_SIZE
+
+LISTING = "listing"
+ITEM = "item"
+CHAPTER = "chapter"
+KINDS = (CHAPTER, ITEM, LISTING)  # in lease order, so started items are finished first
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 30  # seconds, doubled on every failed attempt
+BACKOFF_MAX = 3600
+LEASE_SECONDS = 600
+
+
+def add(entries: [(str, str, str, int)], connection) -> [(str, str, str, int)]:
+    """
+    Adds (kind, url, parent, position) entries as pending, entries that are already known keep their state.
+    `parent` and `position` place a chapter in its item, a known chapter gains the placement. Returns the entries
+    whose chapter is already done: the chapter won't place them anymore, so the caller has to.
+    """
+    merged = {}
+    for kind, url, parent, position in entries:
+        entry = merged.setdefault((kind, url), (kind, url, parent, position, []))
+        if parent is not None and [parent, position] not in entry[4]:
+            entry[4].append([parent, position])
+
+    # The conflicting row is locked even if nothing is updated, so a chapter being marked done either sees the new
+    # placement or is done before it's added (and returned here)
+    done_entries = execute_values(connection.cursor(), '''
+        INSERT INTO crawl_frontier AS f (kind, url, parent, position, placements) VALUES %s
+        ON CONFLICT (kind, url) DO UPDATE SET placements = f.placements || excluded.placements, updated = now()
+        WHERE excluded.parent IS NOT NULL AND NOT f.placements @> excluded.placements
+        RETURNING f.kind, f.url, f.state
+    ''', [(kind, url, parent, position, json.dumps(placements))
+          for kind, url, parent, position, placements in merged.values()],
+        template='(%s, %s, %s, %s, %s::jsonb)', page_size=PAGE_SIZE, fetch=True)
+
+    done_keys = {(kind, url) for kind, url, state in done_entries if state == DONE}
+    return [entry for entry in entries if (entry[0], entry[1]) in done_keys]
+
+
+def placements(url: str, connection) -> [(str, int)]:
+    """
+    Returns every (item url, position) a chapter entry has to be placed at. Call it after marking the entry done in
+    the same transaction, the row lock keeps items from adding placements until it's committed.
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        SELECT parent, position, placements FROM crawl_frontier WHERE kind = %s AND url = %s
+    ''', (CHAPTER, url))
+
+    row = cursor.fetchone()
+    if row is None:
+        return []
+
+    parent, position, placed = row
+    # Entries added before `placements` existed only have their first placement
+    result = [(item_url, nr) for item_url, nr in placed or []]
+    if parent is not None and (parent, position) not in result:
+        result.insert(0, (parent, position))
+
+    return result
+
+
+def lease(worker_id: str, connection, limit: int = 1, lease_seconds: int = LEASE_SECONDS,
+          kinds: [str] = KINDS) -> [(str, str, str, int, int)]:
+    """
+    Leases up to `limit` ready entries to `worker_id` and returns their (kind, url, parent, position, attempts).
+    Ready are pending entries, failed entries whose backoff is over and entries whose lease expired. Entries locked by
+    another worker's lease transaction are skipped instead of waited for.
+    """
+    cursor = connection.cursor()
+
+    cursor.execute('''
+        UPDATE crawl_frontier f SET
+            state = 'in_progress',
+            attempts = f.attempts + 1,
+            leased_by = %s,
+            lease_expires = now() + %s * interval '1 second',
+            updated = now()
+        FROM (
+            SELECT kind, url FROM crawl_frontier
+            WHERE kind = ANY(%s) AND attempts < %s
+              AND ((state IN ('pending', 'failed') AND next_attempt <= now())
+                   OR (state = 'in_progress' AND lease_expires < now()))
+            ORDER BY array_position(%s, kind), seq
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) ready
+        WHERE f.kind = ready.kind AND f.url = ready.url
+        RETURNING f.kind, f.url, f.parent, f.position, f.attempts
+    ''', (worker_id, lease_seconds, list(kinds), MAX_ATTEMPTS, list(kinds), limit))
+
+    # UPDATE ... RETURNING doesn't keep the subquery's order
+    order = {kind: i for i, kind in enumerate(kinds)}
+    return sorted(cursor.fetchall(), key=lambda entry: order[entry[0]])
+
+
+def renew(worker_id: str, entries: [(str, str)], connection, lease_seconds: int = LEASE_SECONDS) -> int:
+    """
+    Extends the leases `worker_id` still holds on (kind, url) entries, returns how many it still holds.
+    """
+    if not entries:
+        return 0
+
+    cursor = connection.cursor()
+    cursor.execute('''
+        UPDATE crawl_frontier SET lease_expires = now() + %s * interval '1 second'
+        WHERE state = 'in_progress' AND leased_by = %s
+          AND (kind, url) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+    ''', (lease_seconds, worker_id, [kind for kind, _ in entries], [url for _, url in entries]))
+
+    return cursor.rowcount
+
+
+def release(worker_id: str, connection) -> int:
+    """
+    Gives back the entries `worker_id` leased but didn't start, without counting the attempt. Returns how many.
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        UPDATE crawl_frontier SET state = 'pending', attempts = attempts - 1, leased_by = NULL, lease_expires = NULL,
+                                  updated = now()
+        WHERE state = 'in_progress' AND leased_by = %s
+    ''', (worker_id,))
+
+    return cursor.rowcount
+
+
+def done(kind: str, url: str, connection, worker_id: str = None) -> bool:
+    """
+    Marks an entry as done. With `worker_id` only if that worker still holds the lease, returns whether it did.
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        UPDATE crawl_frontier SET state = 'done', last_error = NULL, leased_by = NULL, lease_expires = NULL,
+                                  updated = now()
+        WHERE kind = %s AND url = %s AND (%s IS NULL OR leased_by = %s)
+    ''', (kind, url, worker_id, worker_id))
+
+    return cursor.rowcount > 0
+
+
+def fail(kind: str, url: str, error: str, connection, worker_id: str = None) -> bool:
+    """
+    Marks an entry as failed, it becomes ready again after BACKOFF_BASE * 2^(attempts - 1) seconds.
+    With `worker_id` only if that worker still holds the lease, returns whether it did.
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        UPDATE crawl_frontier SET
+            state = 'failed',
+            last_error = %s,
+            next_attempt = now() + LEAST(%s * power(2, attempts - 1), %s) * interval '1 second',
+            leased_by = NULL,
+            lease_expires = NULL,
+            updated = now()
+        WHERE kind = %s AND url = %s AND (%s IS NULL OR leased_by = %s)
+    ''', (error, BACKOFF_BASE, BACKOFF_MAX, kind, url, worker_id, worker_id))
+
+    return cursor.rowcount > 0
+
+
+def recover(connection) -> int:
+    """
+    Puts every entry in progress back to pending, returns how many. Only for a single process scan, workers get
+    the entries of crashed workers back through the lease expiry.
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        UPDATE crawl_frontier SET state = 'pending', leased_by = NULL, lease_expires = NULL, updated = now()
+        WHERE state = 'in_progress'
+    ''')
+
+    return cursor.rowcount
+
+
+def remaining(connection) -> (int, float or None):
+    """
+    Returns the number of entries that still have to be done, and the seconds until the next of them is ready (or its
+    lease expires).
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        SELECT COUNT(*), GREATEST(EXTRACT(EPOCH FROM MIN(
+            CASE WHEN state = 'in_progress' THEN lease_expires ELSE next_attempt END) - now()), 0)
+        FROM crawl_frontier
+        WHERE (state = 'in_progress' AND lease_expires >= now()) OR (state <> 'done' AND attempts < %s)
+    ''', (MAX_ATTEMPTS,))
+
+    count, wait = cursor.fetchone()
+    return count, float(wait) if wait is not None else None
+
+
+def clear(connection):
+    connection.cursor().execute('TRUNCATE crawl_frontier')
+
+
+def progress(connection) -> {(str, str): int}:
+    """
+    Returns the number of entries per (kind, state).
+    """
+    cursor = connection.cursor()
+    cursor.execute('SELECT kind, state, COUNT(*) FROM crawl_frontier GROUP BY kind, state ORDER BY kind, state')
+
+    return {(kind, state): count for kind, state, count in cursor.fetchall()}
+
+
+def leases(connection) -> {str: int}:
+    """
+    Returns the number of entries every worker currently holds a lease on.
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        SELECT leased_by, COUNT(*) FROM crawl_frontier
+        WHERE state = 'in_progress' AND lease_expires >= now()
+        GROUP BY leased_by ORDER BY leased_by
+    ''')
+
+    return dict(cursor.fetchall())
@@ -1,35 +1,40 @@
-from dotenv import load_dotenv
-import os
 from minio import Minio
 from minio.error import S3Error
 
+from storage.context import get_context
+from util import metrics
 
-def store_object(bucket_name: str, object_name: str, object_path: str):
-    client = get_client()
 
-    if not client.bucket_exists(bucket_name):
-        client.make_bucket(bucket_name)
+@metrics.timer("object_store_seconds", op="fput")
+def store_object(bucket_name: str, object_name: str, object_path: str):
+    try:
+        get_context().backend.fput_object(bucket_name, object_name, object_path)
+    except S3Error as e:
+        print("Error occurred, couldn't save object:", e)
 
+@metrics.timer("object_store_seconds", op="put")
+def put_bytes(bucket_name: str, object_name: str, data: bytes,
+              content_type: str = "application/octet-stream") -> bool:
+    """
+    Uploads a buffer, returns whether it was stored.
+    """
     try:
-        client.fput_object(bucket_name, object_name, object_path)
+        get_context().backend.put_object(bucket_name, object_name, data, content_type)
     except S3Error as e:
         print("Error occurred, couldn't save object:", e)
+        return False
+
+    metrics.inc("object_store_bytes_total", len(data), bucket=bucket_name)
+    return True
 
 def get_object(bucket_name: str, object_name: str, destination: str):
-    client = get_client()
     try:
-        client.fget_object(bucket_name, object_name, destination)
+        get_context().backend.fget_object(bucket_name, object_name, destination)
     except S3Error as e:
         print("Error occurred:", e)
 
-def get_client():
-    load_dotenv()
-
-    return Minio(f"{os.environ['MINIO_ADDR']}:{os.environ['MINIO_PORT']}",
-                 access_key=os.environ['MINIO_ACCESS_KEY'],
-                 secret_key=os.environ['MINIO_SECRET_KEY'],
-                 secure=False
-                 )
+def get_client() -> Minio:
+    return get_context().minio()
 
 if __name__ == "__main__":
     store_object("mangalib.thumbnails", "test", "../thumbnail.heif")
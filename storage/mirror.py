@@ -0,0 +1,241 @@
+"""
+Mirrors the chapter images into MinIO so the library can be read offline.
+
+Every image gets a row in `mirror_images` (pending, done or failed, with its attempts and last error), written after
+each batch, so an interrupted run resumes where it stopped and failed images are retried on the next run. Images are
+downloaded by `connections` threads, throttled to `bytes_per_sec`, transcoded in a process pool and stored by content
+hash (see `storage.objects`), so an image that is already mirrored is never encoded or uploaded again.
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from psycopg2.extras import execute_values
+
+from storage.db import DB, PAGE_SIZE
+from storage.objects import FAILED, StoredObject, store_image
+from util import fetch, transcode
+from util.transcode import Variant
+from util.util import format_size
+
+MIRROR_BUCKET = "mangalib.pages"
+MIRROR_QUALITY = 60
+DEFAULT_CONNECTIONS = 8
+DEFAULT_BATCH_SIZE = 200
+MAX_ATTEMPTS = 5
+
+FORMATS = ["heif", "webp"]
+
+
+class RateLimiter:
+    """
+    Limits the average throughput to `rate` units per second. A caller reports what it used after the fact and waits
+    until the budget catches up, so single downloads aren't slowed down but the total is.
+    """
+
+    def __init__(self, rate: float = None):
+        self.rate = rate
+        self._available = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int):
+        if not self.rate:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            # Allow bursts of up to one second worth of budget
+            self._available = min(self.rate, self._available + (now - self._updated) * self.rate) - amount
+            self._updated = now
+            wait = -self._available / self.rate if self._available < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Mirror:
+    """
+    Mirrors pending chapter images, see the module docstring. Use as a context manager.
+
+    Parameters:
+        connections (int): Max concurrent downloads.
+        bytes_per_sec (int): Max average download rate, unlimited if None.
+        image_format (str): "heif" or "webp".
+        quality (int): Encoder quality (0-100), the upper bound if `target_bytes` is set.
+        encode_workers (int): Encoder processes, one per core by default.
+        target_bytes (int): Encode every page at the highest quality that fits this size, see `util.transcode`.
+    """
+
+    def __init__(self, connections: int = DEFAULT_CONNECTIONS, bytes_per_sec: int = None, image_format: str = "heif",
+                 quality: int = MIRROR_QUALITY, encode_workers: int = None, target_bytes: int = None):
+        self.variants = [Variant("page", image_format, quality=quality, target_bytes=target_bytes)]
+        self.encode_function = partial(transcode.transcode, variants=self.variants)
+        self.connections = connections
+        self.encode_workers = encode_workers or os.cpu_count() or 1
+        self.limiter = RateLimiter(bytes_per_sec)
+
+        self._encoder = None
+        self._io = None
+        self._lock = threading.Lock()
+        self._counts = {"images": 0, "uploaded": 0, "linked": 0, "unchanged": 0, "failed": 0,
+                        "downloaded_bytes": 0, "stored_bytes": 0}
+
+    def __enter__(self):
+        # Spawned, forking a process with busy threads can leave an inherited lock held in the child
+        self._encoder = ProcessPoolExecutor(max_workers=self.encode_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        self._io = ThreadPoolExecutor(max_workers=self.connections)
+        return self
+
+    def __exit__(self, *exc):
+        self._io.shutdown()
+        self._encoder.shutdown()
+
+    def run(self, item_url: str = None, batch_size: int = DEFAULT_BATCH_SIZE, limit: int = None) -> dict:
+        """
+        Mirrors every image that isn't mirrored yet (of one item if `item_url` is given), `batch_size` at a time.
+        """
+        last_key = ("", -1)
+        start = time.perf_counter()
+
+        while limit is None or self._counts["images"] < limit:
+            rows = pending_images(last_key, batch_size, item_url)
+            if not rows:
+                break
+
+            last_key = rows[-1][:2]
+            states = []
+
+            futures = [(chapter_url, nr, image_url, self._io.submit(self.mirror_image, image_url))
+                       for chapter_url, nr, image_url in rows]
+            for chapter_url, nr, image_url, future in futures:
+                try:
+                    stored, error = future.result(), None
+                except Exception as e:
+                    stored, error = StoredObject(FAILED), str(e)
+
+                if stored.status == FAILED and error is None:
+                    error = "Image couldn't be retrieved"
+
+                self._count(images=1, downloaded_bytes=stored.source_bytes, stored_bytes=stored.stored_bytes,
+                            **{stored.status: 1})
+                states.append((chapter_url, nr, image_url, "failed" if stored.status == FAILED else "done",
+                               stored.object_name, stored.stored_bytes or None, error))
+
+            save_states(states)
+
+            elapsed = time.perf_counter() - start
+            print(f"Mirrored {self._counts['images']} images ({self._counts['failed']} failed), "
+                  f"{format_size(self._counts['downloaded_bytes'])} downloaded, "
+                  f"{format_size(self._counts['downloaded_bytes'] / elapsed)}/s")
+
+        return self.stats()
+
+    def mirror_image(self, url: str) -> StoredObject:
+        return store_image(url, MIRROR_BUCKET, self._encode, self.variants, get=self._get)
+
+    def _get(self, url: str, **kwargs):
+        response = fetch.get(url, **kwargs)
+        self.limiter.consume(len(response.content))
+        return response
+
+    def _encode(self, data: bytes) -> {str: transcode.Output}:
+        return self._encoder.submit(self.encode_function, data).result()
+
+    def _count(self, **counts: int):
+        with self._lock:
+            for key, value in counts.items():
+                self._counts[key] += value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+def pending_images(after: (str, int), limit: int, item_url: str = None) -> [(str, int, str)]:
+    """
+    Returns (chapter url, image nr, image url) of the next images after `after` that aren't mirrored yet and haven't
+    failed too often.
+    """
+    with DB.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT ci.chapter_url, ci.image_url_nr, ci.image_url
+            FROM chapter_images ci
+            LEFT JOIN mirror_images mi ON mi.chapter_url = ci.chapter_url AND mi.image_url_nr = ci.image_url_nr
+            WHERE (ci.chapter_url, ci.image_url_nr) > (%s, %s)
+              AND (mi.status IS NULL OR mi.image_url <> ci.image_url OR (mi.status = 'failed' AND mi.attempts < %s))
+              AND (%s IS NULL OR ci.chapter_url IN (SELECT chapter_url FROM item_chapters WHERE item_url = %s))
+            ORDER BY ci.chapter_url, ci.image_url_nr
+            LIMIT %s
+        ''', (*after, MAX_ATTEMPTS, item_url, item_url, limit))
+
+        return cursor.fetchall()
+
+
+def save_states(states: [(str, int, str, str, str, int, str)]):
+    """
+    Records (chapter url, image nr, image url, status, object name, stored bytes, error) of mirrored images.
+    Attempts start over when the chapter was re-scraped with a different image at that position.
+    """
+    now = datetime.now().isoformat()
+
+    with DB.get_connection() as conn:
+        execute_values(conn.cursor(), '''
+            INSERT INTO mirror_images (chapter_url, image_url_nr, image_url, status, object_name, byte_size,
+                                       last_error, attempts, updated)
+            VALUES %s
+            ON CONFLICT (chapter_url, image_url_nr) DO UPDATE SET
+                image_url = excluded.image_url,
+                status = excluded.status,
+                object_name = excluded.object_name,
+                byte_size = excluded.byte_size,
+                last_error = excluded.last_error,
+                attempts = CASE WHEN mirror_images.image_url = excluded.image_url
+                                THEN mirror_images.attempts + 1 ELSE 1 END,
+                updated = excluded.updated
+        ''', [(*state, 1, now) for state in states], page_size=PAGE_SIZE)
+
+
+def progress(connection) -> {str: int}:
+    """
+    Returns the number of images per mirror state, images without a state are "pending".
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        SELECT COALESCE(mi.status, 'pending'), COUNT(*)
+        FROM chapter_images ci
+        LEFT JOIN mirror_images mi ON mi.chapter_url = ci.chapter_url AND mi.image_url_nr = ci.image_url_nr
+                                  AND mi.image_url = ci.image_url
+        GROUP BY 1
+    ''')
+
+    return dict(cursor.fetchall())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mirror the chapter images into MinIO")
+    parser.add_argument("command", choices=["mirror", "progress"])
+    parser.add_argument("--item", default=None, help="Only mirror the chapters of this item")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS)
+    parser.add_argument("--rate", type=int, default=None, help="Max download rate in bytes/s")
+    parser.add_argument("--format", choices=FORMATS, default="heif")
+    parser.add_argument("--quality", type=int, default=MIRROR_QUALITY)
+    parser.add_argument("--target-bytes", type=int, default=None, help="Highest quality that fits this size")
+    parser.add_argument("--limit", type=int, default=None, help="Max number of images to mirror")
+    args = parser.parse_args()
+
+    DB.create()
+
+    if args.command == "mirror":
+        with Mirror(args.connections, args.rate, args.format, args.quality, target_bytes=args.target_bytes) as mirror:
+            print(mirror.run(args.item, limit=args.limit))
+    else:
+        with DB.get_connection() as conn:
+            print(progress(conn))
@@ -0,0 +1,156 @@
+"""
+Content addressed storage of downloaded images.
+
+Every stored object is recorded in `stored_objects` under the sha256 of its source bytes, and every source url in
+`object_sources` with its ETag, hash and size. Before anything is encoded or uploaded the source is revalidated with
+its ETag and compared by hash, so unchanged images cost one conditional GET, and the same image used by several items
+(or chapters) is stored once.
+
+A source is transcoded into one or more variants (see `util.transcode`) with a single decode. The first variant is the
+object recorded for the source, `<sha256>.<extension>`, the others are stored next to it as
+`<sha256>.<variant name>.<extension>`, see `variant_object_name`.
+"""
+import hashlib
+from datetime import datetime
+
+from storage.context import get_context
+from storage.media import put_bytes
+from util import fetch, metrics
+from util.transcode import Variant
+
+UNCHANGED = "unchanged"  # same source as last time, nothing downloaded or nothing encoded
+LINKED = "linked"  # new source url for an image that is already stored
+UPLOADED = "uploaded"
+FAILED = "failed"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def variant_object_name(object_name: str, variant: Variant) -> str:
+    """
+    Name of a secondary variant of the stored object `object_name`.
+    """
+    return f"{object_name.split('.', 1)[0]}.{variant.name}.{variant.extension}"
+
+
+class StoredObject:
+    def __init__(self, status: str, object_name: str | None = None, source_bytes: int = 0, stored_bytes: int = 0):
+        self.status = status
+        self.object_name = object_name
+        self.source_bytes = source_bytes
+        self.stored_bytes = stored_bytes
+
+
+def _get_source(bucket: str, url: str) -> (str, str, str) or None:
+    with get_context().connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT s.etag, s.content_hash, o.object_name
+            FROM object_sources s
+            JOIN stored_objects o ON o.bucket = s.bucket AND o.content_hash = s.content_hash
+            WHERE s.bucket = %s AND s.source_url = %s
+        ''', (bucket, url))
+
+        return cursor.fetchone()
+
+
+def _get_object_name(bucket: str, digest: str) -> str | None:
+    with get_context().connection(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT object_name FROM stored_objects WHERE bucket = %s AND content_hash = %s',
+                       (bucket, digest))
+        row = cursor.fetchone()
+
+    return row[0] if row else None
+
+
+def _record(bucket: str, url: str, etag: str | None, digest: str, source_bytes: int,
+            object_name: str = None, stored_bytes: int = None):
+    with get_context().connection() as conn:
+        cursor = conn.cursor()
+
+        if object_name is not None:
+            cursor.execute('''
+                INSERT INTO stored_objects (bucket, content_hash, object_name, byte_size, created)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (bucket, content_hash) DO NOTHING
+            ''', (bucket, digest, object_name, stored_bytes, datetime.now().isoformat()))
+
+        cursor.execute('''
+            INSERT INTO object_sources (bucket, source_url, content_hash, etag, byte_size, checked)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (bucket, source_url) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                etag = excluded.etag,
+                byte_size = excluded.byte_size,
+                checked = excluded.checked
+        ''', (bucket, url, digest, etag, source_bytes, datetime.now().isoformat()))
+
+
+def _touch(bucket: str, url: str):
+    with get_context().connection() as conn:
+        conn.cursor().execute('UPDATE object_sources SET checked = %s WHERE bucket = %s AND source_url = %s',
+                              (datetime.now().isoformat(), bucket, url))
+
+
+def store_image(url: str, bucket: str, encode, variants: [Variant], get=fetch.get) -> StoredObject:
+    """
+    Stores the image at `url` in `bucket` as every one of `variants`, encoded with `encode`
+    (bytes -> {variant name: `transcode.Output`}, e.g. `transcode.transcode`), unless the same source is already
+    stored. `get` downloads, e.g. a throttled `fetch.get`.
+    """
+    stored = _store_image(url, bucket, encode, variants, get)
+
+    metrics.inc("stored_images_total", bucket=bucket, status=stored.status)
+    metrics.inc("stored_image_bytes_total", stored.stored_bytes, bucket=bucket)
+
+    return stored
+
+
+def _store_image(url: str, bucket: str, encode, variants: [Variant], get) -> StoredObject:
+    source = _get_source(bucket, url)
+    etag, previous_hash, previous_name = source if source else (None, None, None)
+
+    with metrics.timer("image_download_seconds", bucket=bucket):
+        response = get(url, headers={"If-None-Match": etag} if etag else None)
+
+    if response.status_code == 304 and source is not None:
+        _touch(bucket, url)
+        return StoredObject(UNCHANGED, previous_name)
+
+    if response.status_code != 200:
+        print('Image Couldn\'t be retrieved: ' + url)
+        return StoredObject(FAILED)
+
+    data = response.content
+    digest = content_hash(data)
+    etag = response.headers.get("ETag")
+
+    if digest == previous_hash:
+        _record(bucket, url, etag, digest, len(data))
+        return StoredObject(UNCHANGED, previous_name, len(data))
+
+    object_name = _get_object_name(bucket, digest)
+    if object_name is not None:
+        _record(bucket, url, etag, digest, len(data))
+        return StoredObject(LINKED, object_name, len(data))
+
+    with metrics.timer("image_encode_seconds", bucket=bucket):
+        outputs = encode(data)
+    object_name = f"{digest}.{variants[0].extension}"
+
+    stored_bytes = 0
+    for variant in variants:
+        output = outputs[variant.name]
+        name = object_name if variant is variants[0] else variant_object_name(object_name, variant)
+
+        # Nothing is recorded for an object that isn't stored, the next run downloads and uploads it again
+        if not put_bytes(bucket, name, output.data, variant.content_type):
+            return StoredObject(FAILED, source_bytes=len(data))
+        stored_bytes += len(output.data)
+
+    _record(bucket, url, etag, digest, len(data), object_name, stored_bytes)
+
+    return StoredObject(UPLOADED, object_name, len(data), stored_bytes)
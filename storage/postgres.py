@@ -0,0 +1,108 @@
+import io
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from minio import Minio
+from psycopg2.pool import ThreadedConnectionPool
+
+from storage.backend import Backend, POSTGRES
+
+
+class PostgresBackend(Backend):
+    """
+    A thread-safe psycopg2 connection pool, one MinIO client and the buckets known to exist. Everything is created on
+    first use and shared by every thread afterwards.
+    """
+    dialect = POSTGRES
+
+    def __init__(self, config):
+        self.config = config
+
+        self._pool = None
+        self._slots = None
+        self._minio = None
+        self._buckets = set()
+        self._lock = threading.Lock()
+        self._bucket_lock = threading.Lock()
+
+    def pool(self) -> ThreadedConnectionPool:
+        with self._lock:
+            if self._pool is None:
+                try:
+                    self._pool = ThreadedConnectionPool(self.config.pool_min, self.config.pool_max, **self.config.db)
+                except psycopg2.OperationalError as e:
+                    raise RuntimeError("Couldn't connect to database: " + str(e))
+
+                # ThreadedConnectionPool raises when it's exhausted, make callers wait for a free connection instead
+                self._slots = threading.BoundedSemaphore(self.config.pool_max)
+
+            return self._pool
+
+    @contextmanager
+    def connection(self, readonly: bool = False):
+        """
+        Borrows a pooled connection; commits when the block succeeds, rolls back when it raises.
+        `readonly` makes no difference, Postgres readers never wait for writers.
+        """
+        pool = self.pool()
+
+        with self._slots:
+            try:
+                conn = pool.getconn()
+            except psycopg2.OperationalError as e:
+                raise RuntimeError("Couldn't connect to database: " + str(e))
+
+            try:
+                with conn:
+                    yield conn
+            finally:
+                pool.putconn(conn, close=bool(conn.closed))
+
+    def connect(self):
+        try:
+            return psycopg2.connect(**self.config.db)
+        except psycopg2.OperationalError as e:
+            raise RuntimeError("Couldn't connect to database: " + str(e))
+
+    def minio(self) -> Minio:
+        with self._lock:
+            if self._minio is None:
+                self._minio = Minio(self.config.minio_endpoint,
+                                    access_key=self.config.minio_access_key,
+                                    secret_key=self.config.minio_secret_key,
+                                    secure=False
+                                    )
+
+            return self._minio
+
+    def ensure_bucket(self, bucket_name: str):
+        if bucket_name in self._buckets:
+            return
+
+        with self._bucket_lock:
+            if bucket_name in self._buckets:
+                return
+
+            client = self.minio()
+            if not client.bucket_exists(bucket_name):
+                client.make_bucket(bucket_name)
+
+            self._buckets.add(bucket_name)
+
+    def put_object(self, bucket_name: str, object_name: str, data: bytes, content_type: str):
+        self.ensure_bucket(bucket_name)
+        self.minio().put_object(bucket_name, object_name, io.BytesIO(data), len(data), content_type=content_type)
+
+    def fput_object(self, bucket_name: str, object_name: str, path: str):
+        self.ensure_bucket(bucket_name)
+        self.minio().fput_object(bucket_name, object_name, path)
+
+    def fget_object(self, bucket_name: str, object_name: str, destination: str):
+        self.minio().fget_object(bucket_name, object_name, destination)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
@@ -0,0 +1,75 @@
+"""
+Process wide registry of the authors and genres already stored, so saving an item only writes the ones that are new
+or changed. A full scan references the same few dozen genres and a few thousand authors hundreds of thousands of
+times, without the registry every one of those references was an upsert.
+
+A registry is warmed from its table the first time it's used and learns what was written once the transaction
+commits (see `StorageContext.after_commit`), so a rolled back save never leaves it believing a row exists.
+"""
+import threading
+
+from models.metadata import Author, Genre
+from storage.context import get_context
+from util import metrics
+
+
+class Registry:
+    """
+    Parameters:
+        table (str): Table of the records.
+        key (str): Primary key column, holds `record.id`.
+    """
+
+    def __init__(self, table: str, key: str):
+        self.table = table
+        self.key = key
+
+        self._stored = None  # id -> (name, url)
+        self._lock = threading.Lock()
+
+    def warm(self, connection):
+        cursor = connection.cursor()
+        cursor.execute(f'SELECT {self.key}, name, url FROM {self.table}')
+        stored = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+        with self._lock:
+            self._stored = stored
+
+    def changed(self, records: [Author | Genre], connection) -> [Author | Genre]:
+        """
+        Returns the records that aren't stored with the same values yet, one per id and sorted by id.
+        """
+        if self._stored is None:
+            self.warm(connection)
+
+        records = {record.id: record for record in records}
+
+        with self._lock:
+            changed = [record for id, record in sorted(records.items())
+                       if self._stored.get(id) != (record.name, record.url)]
+
+        metrics.inc("registry_skipped_total", len(records) - len(changed), table=self.table)
+        return changed
+
+    def written(self, records: [Author | Genre], connection):
+        """
+        Remembers records written in the connection's transaction once it commits.
+        """
+        metrics.inc("registry_written_total", len(records), table=self.table)
+        get_context().after_commit(connection, lambda: self.remember(records))
+
+    def remember(self, records: [Author | Genre]):
+        with self._lock:
+            if self._stored is not None:
+                self._stored.update((record.id, (record.name, record.url)) for record in records)
+
+    def clear(self):
+        """
+        Forgets everything, the next use warms the registry again. Call it when the table is changed outside of it.
+        """
+        with self._lock:
+            self._stored = None
+
+
+AUTHORS = Registry("authors", "author_id")
+GENRES = Registry("genres", "genre_id")
@@ -0,0 +1,236 @@
+"""
+Read path over the library: paginated search by text, genres, authors and status, sorted by relevance, views, rating
+or last update, with facet counts for the matches.
+
+Text is matched against a weighted tsvector of name and alternative titles (A) and description (B), plus trigram word
+similarity on name and alternative, so partial titles and typos still match. Every filter has an index behind it, see
+`create_indexes`, which `DB.create` calls. Results are cached in-process for CACHE_TTL seconds, the library only
+changes when a scan runs.
+"""
+import argparse
+import threading
+import time
+
+from cachetools import TTLCache
+
+from storage.context import get_context
+
+CACHE_SIZE = 1024
+CACHE_TTL = 60  # seconds
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+TEXT_CONFIG = "simple"  # titles are in many languages, no stemming
+
+SEARCH_VECTOR = (f"setweight(to_tsvector('{TEXT_CONFIG}', coalesce(name, '') || ' ' || coalesce(alternative, '')), 'A')"
+                 f" || setweight(to_tsvector('{TEXT_CONFIG}', coalesce(description, '')), 'B')")
+
+SORTS = {
+    "relevance": "rank DESC",
+    "views": "i.views DESC NULLS LAST",
+    "rating": "i.rating DESC NULLS LAST",
+    "last_updated": "i.last_updated DESC NULLS LAST",  # ISO 8601 text, sorts like the timestamp
+}
+
+_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+_cache_lock = threading.Lock()
+
+
+class SearchResult:
+    def __init__(self, total: int, items: [dict], facets: {str: {str: int}}):
+        self.total = total
+        self.items = items
+        self.facets = facets
+
+
+def create_indexes(connection):
+    """
+    Creates the extension and indexes search relies on. Safe to run on every start, existing indexes are kept.
+    """
+    cursor = connection.cursor()
+
+    cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS items_search_vector ON items USING gin (({SEARCH_VECTOR}))')
+    cursor.execute('CREATE INDEX IF NOT EXISTS items_name_trgm ON items USING gin (name gin_trgm_ops)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS items_alternative_trgm ON items USING gin (alternative gin_trgm_ops)')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS items_status ON items (status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS items_views ON items (views DESC NULLS LAST, item_url)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS items_rating ON items (rating DESC NULLS LAST, item_url)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS items_last_updated ON items (last_updated DESC NULLS LAST, item_url)')
+
+    # The primary keys start with item_url, these serve the lookups from the other side
+    cursor.execute('CREATE INDEX IF NOT EXISTS item_genres_genre ON item_genres (genre_id, item_url)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS item_authors_author ON item_authors (author_id, item_url)')
+
+
+def _where(text: str | None, genres: [int], exclude_genres: [int], authors: [str],
+           statuses: [str]) -> (str, [object]):
+    conditions, params = [], []
+
+    if text:
+        conditions.append(f'''(({SEARCH_VECTOR}) @@ websearch_to_tsquery('{TEXT_CONFIG}', %s)
+                               OR %s <%% i.name OR %s <%% i.alternative)''')
+        params += [text, text, text]
+
+    if genres:
+        # Items having all of the genres
+        conditions.append('''i.item_url IN (SELECT item_url FROM item_genres WHERE genre_id = ANY(%s)
+                                            GROUP BY item_url HAVING count(*) = %s)''')
+        params += [list(genres), len(set(genres))]
+
+    if exclude_genres:
+        conditions.append('NOT EXISTS (SELECT 1 FROM item_genres ig WHERE ig.item_url = i.item_url '
+                          'AND ig.genre_id = ANY(%s))')
+        params.append(list(exclude_genres))
+
+    if authors:
+        conditions.append('EXISTS (SELECT 1 FROM item_authors ia WHERE ia.item_url = i.item_url '
+                          'AND ia.author_id = ANY(%s))')
+        params.append(list(authors))
+
+    if statuses:
+        conditions.append('i.status = ANY(%s)')
+        params.append(list(statuses))
+
+    return ' AND '.join(conditions) or 'true', params
+
+
+def search(text: str = None, genres: [int] = (), exclude_genres: [int] = (), authors: [str] = (),
+           statuses: [str] = (), sort: str = None, page: int = 1, page_size: int = DEFAULT_PAGE_SIZE,
+           facets: bool = False, connection=None, cached: bool = True) -> SearchResult:
+    """
+    Returns one page of the items matching every given filter.
+
+    Parameters:
+        text (str): Words to look for in name, alternative titles and description, websearch syntax ("quoted phrases",
+            -excluded words). Close matches of the title count too.
+        genres ([int]): Genre ids the items must all have.
+        exclude_genres ([int]): Genre ids the items must have none of.
+        authors ([str]): Author ids, items by any of them.
+        statuses ([str]): Statuses, e.g. "ongoing" or "completed", matched case insensitively (they're stored
+            lowercase).
+        sort (str): One of SORTS, relevance by default when there's text and views otherwise.
+        page (int): 1 based page number.
+        facets (bool): Also count the matches per status and genre.
+        connection: Open DB connection, one is borrowed from the pool if not given.
+        cached (bool): Answer from (and fill) the in-process cache.
+    """
+    text = ' '.join(text.split()) if text else None
+    statuses = [status.lower() for status in statuses]
+    sort = sort or ("relevance" if text else "views")
+    if sort not in SORTS:
+        raise ValueError(f"Unknown sort {sort}, expected one of {', '.join(SORTS)}")
+    if sort == "relevance" and not text:
+        sort = "views"
+
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+
+    key = (text, tuple(sorted(set(genres))), tuple(sorted(set(exclude_genres))), tuple(sorted(set(authors))),
+           tuple(sorted(set(statuses))), sort, page, page_size, facets)
+    if cached:
+        with _cache_lock:
+            result = _cache.get(key)
+        if result is not None:
+            return result
+
+    if connection is None:
+        with get_context().connection(readonly=True) as conn:
+            result = _search(conn, text, genres, exclude_genres, authors, statuses, sort, page, page_size, facets)
+    else:
+        result = _search(connection, text, genres, exclude_genres, authors, statuses, sort, page, page_size, facets)
+
+    if cached:
+        with _cache_lock:
+            _cache[key] = result
+
+    return result
+
+
+def _search(connection, text, genres, exclude_genres, authors, statuses, sort, page, page_size,
+            facets) -> SearchResult:
+    where, params = _where(text, genres, exclude_genres, authors, statuses)
+    cursor = connection.cursor()
+
+    if text:
+        rank = (f"ts_rank(({SEARCH_VECTOR}), websearch_to_tsquery('{TEXT_CONFIG}', %s))"
+                " + word_similarity(%s, i.name)")
+        rank_params = [text, text]
+    else:
+        rank, rank_params = "0", []
+
+    # The total comes with the page, counted over all matches before LIMIT
+    cursor.execute(f'''
+        SELECT i.item_url, i.name, i.alternative, i.status, i.last_updated, i.views, i.rating, i.votes,
+               i.thumbnail_object_name, {rank} AS rank, count(*) OVER () AS total
+        FROM items i
+        WHERE {where}
+        ORDER BY {SORTS[sort]}, i.item_url
+        LIMIT %s OFFSET %s
+    ''', rank_params + params + [page_size, (page - 1) * page_size])
+    rows = cursor.fetchall()
+
+    columns = ["url", "name", "alternative", "status", "last_updated", "views", "rating", "votes",
+               "thumbnail_object_name"]
+    items = [dict(zip(columns, row)) for row in rows]
+
+    if rows:
+        total = rows[0][-1]
+    elif page == 1:
+        total = 0
+    else:
+        cursor.execute(f'SELECT count(*) FROM items i WHERE {where}', params)
+        total = cursor.fetchone()[0]
+
+    return SearchResult(total, items, _facets(cursor, where, params) if facets else {})
+
+
+def _facets(cursor, where: str, params: [object]) -> {str: {str: int}}:
+    cursor.execute(f'''
+        WITH matches AS (SELECT i.item_url, i.status FROM items i WHERE {where})
+        SELECT 'status', coalesce(status, ''), count(*) FROM matches GROUP BY status
+        UNION ALL
+        SELECT 'genre', g.name, count(*)
+        FROM matches m
+        JOIN item_genres ig ON ig.item_url = m.item_url
+        JOIN genres g ON g.genre_id = ig.genre_id
+        GROUP BY g.name
+    ''', params)
+
+    facets = {"status": {}, "genre": {}}
+    for facet, value, count in cursor.fetchall():
+        facets[facet][value] = count
+
+    return facets
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the library")
+    parser.add_argument("text", nargs="?", default=None)
+    parser.add_argument("--genre", type=int, action="append", default=[], help="Genre id, repeat for several")
+    parser.add_argument("--exclude-genre", type=int, action="append", default=[])
+    parser.add_argument("--author", action="append", default=[], help="Author id, repeat for several")
+    parser.add_argument("--status", action="append", default=[], help="e.g. ongoing or completed, repeat for several")
+    parser.add_argument("--sort", choices=list(SORTS), default=None)
+    parser.add_argument("--page", type=int, default=1)
+    parser.add_argument("--facets", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = search(args.text, args.genre, args.exclude_genre, args.author, args.status, args.sort, args.page,
+                    facets=args.facets)
+    print(f"{result.total} items, page {args.page} in {time.perf_counter() - start:.3f}s")
+
+    for item in result.items:
+        print(f"{item['views'] or 0:>12} {item['rating'] or 0:>4} {item['status'] or '':<10} {item['name']}")
+
+    for facet, counts in result.facets.items():
+        print(f"\n{facet}:")
+        for value, count in sorted(counts.items(), key=lambda c: c[1], reverse=True):
+            print(f"  {value:<30} {count:>8}")
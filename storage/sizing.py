@@ -0,0 +1,160 @@
+"""
+Estimates the size of the library from HEAD requests on the chapter images.
+
+Sizes are stored in `chapter_images.byte_size`, so a re-run only sizes the images that weren't sized yet, and the
+totals per chapter, item and genre are aggregated in SQL.
+"""
+import argparse
+import time
+
+from psycopg2.extras import execute_values
+
+from storage.db import DB, PAGE_SIZE
+from util import fetch
+from util.util import format_size
+
+DEFAULT_WORKERS = 32
+BATCH_SIZE = 1000
+
+
+def size_images(workers: int = DEFAULT_WORKERS, batch_size: int = BATCH_SIZE, limit: int = None) -> {str: int}:
+    """
+    Sizes every image without a stored size, `batch_size` at a time with `workers` concurrent HEAD requests.
+    Images whose size can't be determined stay unsized and are retried on the next run.
+    """
+    stats = {"sized": 0, "unknown": 0, "bytes": 0}
+    last_key = ("", -1)
+    start = time.perf_counter()
+
+    while limit is None or stats["sized"] + stats["unknown"] < limit:
+        with DB.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT chapter_url, image_url_nr, image_url FROM chapter_images
+                WHERE byte_size IS NULL AND (chapter_url, image_url_nr) > (%s, %s)
+                ORDER BY chapter_url, image_url_nr
+                LIMIT %s
+            ''', (*last_key, batch_size))
+            rows = cursor.fetchall()
+
+        if not rows:
+            break
+
+        last_key = rows[-1][:2]
+        sizes = fetch.content_lengths([row[2] for row in rows], workers)
+
+        sized = [(chapter_url, nr, size) for (chapter_url, nr, _), size in zip(rows, sizes) if size is not None]
+        stats["sized"] += len(sized)
+        stats["unknown"] += len(rows) - len(sized)
+        stats["bytes"] += sum(size for _, _, size in sized)
+
+        with DB.get_connection() as conn:
+            execute_values(conn.cursor(), '''
+                UPDATE chapter_images ci SET byte_size = v.byte_size
+                FROM (VALUES %s) AS v(chapter_url, image_url_nr, byte_size)
+                WHERE ci.chapter_url = v.chapter_url AND ci.image_url_nr = v.image_url_nr
+            ''', sized, page_size=PAGE_SIZE)
+
+        elapsed = time.perf_counter() - start
+        print(f"Sized {stats['sized']} images ({format_size(stats['bytes'])}), {stats['unknown']} unknown, "
+              f"{(stats['sized'] + stats['unknown']) / elapsed:.1f} images/s")
+
+    return stats
+
+
+def chapter_sizes(item_url: str, connection) -> [(int, str, int, int)]:
+    """
+    Returns (chapter nr, chapter url, bytes, unsized images) for every chapter of an item.
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        SELECT ic.chapter_nr, ic.chapter_url, COALESCE(SUM(ci.byte_size), 0), COUNT(*) - COUNT(ci.byte_size)
+        FROM item_chapters ic
+        JOIN chapter_images ci ON ci.chapter_url = ic.chapter_url
+        WHERE ic.item_url = %s
+        GROUP BY ic.chapter_nr, ic.chapter_url
+        ORDER BY ic.chapter_nr
+    ''', (item_url,))
+
+    return cursor.fetchall()
+
+
+def item_sizes(connection, limit: int = 50) -> [(str, str, int, int)]:
+    """
+    Returns (item url, name, bytes, unsized images) of the largest items.
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        SELECT i.item_url, i.name, COALESCE(SUM(ci.byte_size), 0) AS total, COUNT(*) - COUNT(ci.byte_size)
+        FROM items i
+        JOIN item_chapters ic ON ic.item_url = i.item_url
+        JOIN chapter_images ci ON ci.chapter_url = ic.chapter_url
+        GROUP BY i.item_url, i.name
+        ORDER BY total DESC
+        LIMIT %s
+    ''', (limit,))
+
+    return cursor.fetchall()
+
+
+def genre_sizes(connection) -> [(str, int, int, int)]:
+    """
+    Returns (genre, items, bytes, unsized images) per genre. Items with several genres count towards each of them.
+    """
+    cursor = connection.cursor()
+    cursor.execute('''
+        SELECT g.name, COUNT(DISTINCT ig.item_url), COALESCE(SUM(ci.byte_size), 0) AS total,
+               COUNT(ci.image_url_nr) - COUNT(ci.byte_size)
+        FROM genres g
+        JOIN item_genres ig ON ig.genre_id = g.genre_id
+        JOIN item_chapters ic ON ic.item_url = ig.item_url
+        JOIN chapter_images ci ON ci.chapter_url = ic.chapter_url
+        GROUP BY g.name
+        ORDER BY total DESC
+    ''')
+
+    return cursor.fetchall()
+
+
+def library_size(connection) -> (int, int, int):
+    """
+    Returns (images, bytes, unsized images) of the whole library.
+    """
+    cursor = connection.cursor()
+    cursor.execute('SELECT COUNT(*), COALESCE(SUM(byte_size), 0), COUNT(*) - COUNT(byte_size) FROM chapter_images')
+
+    return cursor.fetchone()
+
+
+def report(item_url: str = None):
+    with DB.get_connection() as conn:
+        images, total, unsized = library_size(conn)
+        print(f"Library: {format_size(total)} in {images} images ({unsized} not sized yet)\n")
+
+        print("Genres:")
+        for name, items, size, unsized in genre_sizes(conn):
+            print(f"  {name:<24} {format_size(size):>12} {items:>8} items {unsized:>8} unsized")
+
+        print("\nLargest items:")
+        for url, name, size, unsized in item_sizes(conn):
+            print(f"  {name[:40]:<40} {format_size(size):>12} {unsized:>8} unsized  {url}")
+
+        if item_url is not None:
+            print(f"\nChapters of {item_url}:")
+            for nr, url, size, unsized in chapter_sizes(item_url, conn):
+                print(f"  {nr:>5} {format_size(size):>12} {unsized:>6} unsized  {url}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Size the chapter images and report the library size")
+    parser.add_argument("command", choices=["size", "report"])
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--limit", type=int, default=None, help="Max number of images to size")
+    parser.add_argument("--item", default=None, help="Also list the chapter sizes of this item")
+    args = parser.parse_args()
+
+    if args.command == "size":
+        DB.create()
+        print(size_images(args.workers, limit=args.limit))
+    else:
+        report(args.item)
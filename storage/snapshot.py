@@ -0,0 +1,250 @@
+"""
+Moves a library between hosts without scraping it again.
+
+`export_snapshot` writes every library table to a directory as gzip compressed JSONL, one JSON array per row and a new
+file every CHUNK_ROWS rows, streamed from a server-side cursor so memory stays constant however large the library is.
+All tables are read in one repeatable-read transaction, the snapshot is consistent even while a scan is writing.
+`manifest.json` lists the tables, columns and files and is written last, a directory without it is an interrupted
+export.
+
+`import_snapshot` loads a snapshot into an empty library (or replaces it) in one transaction: on Postgres the indexes,
+primary keys and foreign keys of the tables are dropped, every chunk is loaded with COPY and they are built again once
+at the end, which is much faster than maintaining them row by row.
+
+The images themselves are objects (see `storage.objects`), copy the buckets separately; `items.thumbnail_object_name`
+keeps pointing at them.
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+
+from storage import registry, search
+from storage.backend import POSTGRES
+from storage.bulk import copy_rows
+from storage.context import get_context
+from storage.db import DB
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+CHUNK_ROWS = 100_000  # rows per file, also the rows held in memory per COPY on import
+FETCH_ROWS = 2_000  # rows per round-trip of the server-side cursor
+COMPRESS_LEVEL = 6  # gzip's default of 9 costs a lot of time for little gain on text
+MAINTENANCE_WORK_MEM = "512MB"  # for rebuilding the indexes after an import
+
+# Parents before children, the order they're loaded in
+TABLES = ["authors", "genres", "items", "chapters", "chapter_images", "item_authors", "item_genres", "item_chapters"]
+
+
+def _chunk_name(table: str, chunk: int) -> str:
+    return f"{table}.{chunk:05d}.jsonl.gz"
+
+
+def _export_table(cursor, table: str, directory: str) -> dict:
+    cursor.execute(f'SELECT * FROM {table}')
+    rows = cursor.fetchmany(FETCH_ROWS)
+    columns = [column[0] for column in cursor.description]
+
+    files = []
+    count = 0
+    out = None
+
+    try:
+        while rows:
+            for row in rows:
+                if count % CHUNK_ROWS == 0:
+                    if out is not None:
+                        out.close()
+
+                    files.append(_chunk_name(table, len(files)))
+                    out = gzip.open(os.path.join(directory, files[-1]), 'wt', encoding='utf-8',
+                                    compresslevel=COMPRESS_LEVEL)
+
+                out.write(json.dumps(list(row), ensure_ascii=False, separators=(',', ':'), default=str))
+                out.write('\n')
+                count += 1
+
+            rows = cursor.fetchmany(FETCH_ROWS)
+    finally:
+        if out is not None:
+            out.close()
+
+    return {"name": table, "columns": columns, "rows": count, "files": files}
+
+
+def export_snapshot(directory: str) -> dict:
+    """
+    Writes a snapshot of the library tables to `directory` and returns its manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    postgres = get_context().dialect == POSTGRES
+    start = time.perf_counter()
+
+    # A dedicated connection, a pooled one would be held for the whole export
+    conn = get_context().connect()
+    try:
+        if postgres:
+            conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        else:
+            conn.cursor().execute('BEGIN')
+
+        tables = []
+        for table in TABLES:
+            # A named cursor is server-side, rows come FETCH_ROWS at a time instead of all at once
+            cursor = conn.cursor(name=f"export_{table}") if postgres else conn.cursor()
+
+            tables.append(_export_table(cursor, table, directory))
+            cursor.close()
+            print(f"Exported {tables[-1]['rows']} rows of {table} in {len(tables[-1]['files'])} files, "
+                  f"{time.perf_counter() - start:.1f}s")
+
+        conn.rollback()
+    finally:
+        conn.close()
+
+    manifest = {"version": FORMAT_VERSION, "created": datetime.now().isoformat(), "tables": tables}
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def read_manifest(directory: str) -> dict:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(path):
+        raise RuntimeError(f"No {MANIFEST} in {directory}, not a snapshot or the export didn't finish")
+
+    with open(path) as f:
+        manifest = json.load(f)
+
+    if manifest.get("version") != FORMAT_VERSION:
+        raise RuntimeError(f"Unsupported snapshot version {manifest.get('version')}, expected {FORMAT_VERSION}")
+
+    return manifest
+
+
+def _read_chunk(path: str):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _drop_constraints(cursor, tables: [str]) -> [str]:
+    """
+    Drops the indexes, primary keys and foreign keys of `tables` and returns the statements that create them again,
+    in the order they have to run.
+    """
+    cursor.execute('''
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid), contype FROM pg_constraint
+        WHERE conrelid::regclass::text = ANY(%s) AND contype IN ('p', 'u', 'f')
+    ''', (tables,))
+    constraints = cursor.fetchall()
+
+    cursor.execute('''
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = ANY(%s)
+          AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE contype IN ('p', 'u'))
+    ''', (tables,))
+    indexes = cursor.fetchall()
+
+    keys = [c for c in constraints if c[3] != 'f']
+    foreign_keys = [c for c in constraints if c[3] == 'f']
+
+    # Foreign keys depend on the keys they reference, drop them first and create them last
+    for table, name, _, _ in foreign_keys:
+        cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {name}')
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX {name}')
+    for table, name, _, _ in keys:
+        cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {name}')
+
+    return ([f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}' for table, name, definition, _ in keys]
+            + [definition for _, definition in indexes]
+            + [f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}' for table, name, definition, _ in
+               foreign_keys])
+
+
+def import_snapshot(directory: str, replace: bool = False) -> {str: int}:
+    """
+    Loads the snapshot in `directory` and returns the rows loaded per table. The library tables have to be empty
+    unless `replace` is set, then they're emptied first. Nothing is changed if the import fails.
+    """
+    manifest = read_manifest(directory)
+    tables = [table for table in manifest["tables"] if table["name"] in TABLES]
+    postgres = get_context().dialect == POSTGRES
+    loaded = {}
+    start = time.perf_counter()
+
+    DB.create()
+
+    with DB.get_connection() as conn:
+        cursor = conn.cursor()
+
+        if replace:
+            if postgres:
+                cursor.execute(f'TRUNCATE {", ".join(TABLES)}')
+            else:
+                for table in reversed(TABLES):
+                    cursor.execute(f'DELETE FROM {table}')
+        else:
+            for table in TABLES:
+                cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {table})')
+                if cursor.fetchone()[0]:
+                    raise RuntimeError(f"{table} isn't empty, import into an empty library or replace it")
+
+        # SQLite keeps its keys in the table itself, there is nothing to defer
+        rebuild = []
+        if postgres:
+            cursor.execute(f"SET LOCAL maintenance_work_mem = '{MAINTENANCE_WORK_MEM}'")
+            cursor.execute('SET LOCAL synchronous_commit = off')
+            rebuild = _drop_constraints(cursor, TABLES)
+
+        for table in tables:
+            loaded[table["name"]] = 0
+            for name in table["files"]:
+                loaded[table["name"]] += copy_rows(cursor, table["name"], table["columns"],
+                                                   _read_chunk(os.path.join(directory, name)))
+
+            if loaded[table["name"]] != table["rows"]:
+                raise RuntimeError(f"{table['name']}: loaded {loaded[table['name']]} rows, the manifest lists "
+                                   f"{table['rows']}")
+
+            print(f"Loaded {loaded[table['name']]} rows of {table['name']}, {time.perf_counter() - start:.1f}s")
+
+        for statement in rebuild:
+            cursor.execute(statement)
+        if rebuild:
+            print(f"Rebuilt {len(rebuild)} indexes and constraints, {time.perf_counter() - start:.1f}s")
+
+        cursor.execute(f'ANALYZE {", ".join(TABLES)}' if postgres else 'ANALYZE')
+
+    # The tables changed under the in-process caches
+    registry.AUTHORS.clear()
+    registry.GENRES.clear()
+    search.clear_cache()
+
+    return loaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import a snapshot of the library")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Write the library to a snapshot directory")
+    export_parser.add_argument("directory")
+
+    import_parser = commands.add_parser("import", help="Load a snapshot directory into an empty library")
+    import_parser.add_argument("directory")
+    import_parser.add_argument("--replace", action="store_true", help="Replace the library instead of failing")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "export":
+        manifest = export_snapshot(args.directory)
+        rows = sum(table["rows"] for table in manifest["tables"])
+    else:
+        rows = sum(import_snapshot(args.directory, args.replace).values())
+
+    print(f"{rows} rows in {time.perf_counter() - start:.1f}s")
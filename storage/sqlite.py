@@ -0,0 +1,221 @@
+"""
+Embedded backend: the whole library in one SQLite file and the images in a local `FileStore`, for a laptop or an edge
+box without Postgres or MinIO.
+
+Every thread keeps one connection in WAL mode, so readers never wait for the writer and the writer never waits for
+readers. Write transactions start with BEGIN IMMEDIATE, writers queue up on the busy timeout instead of failing when a
+read transaction would have to be upgraded. Read-only blocks (`connection(readonly=True)`) start a deferred transaction
+that never takes the write lock. A `connection()` block inside another one on the same thread joins its
+transaction through a savepoint, the way one pooled Postgres connection would be passed down.
+
+The SQL of `storage.db` is shared with Postgres: `%s` placeholders become `?` and `x = ANY(%s)` with a list becomes
+`x IN (SELECT value FROM json_each(?))`.
+"""
+import json
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+from storage.backend import Backend, SQLITE
+from storage.filestore import FileStore
+
+BUSY_TIMEOUT = 60  # seconds a writer waits for the write lock
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # with WAL only the last commits can be lost on power loss, never corrupted
+    "foreign_keys": "ON",
+    "temp_store": "MEMORY",
+    "cache_size": -64 * 1024,  # KiB, 64 MiB of page cache per connection
+    "mmap_size": 256 * 2 ** 20,
+    "wal_autocheckpoint": 10000,  # pages, checkpoint less often during large ingests
+}
+
+_TOKENS = re.compile(r"=\s*ANY\(\s*%s\s*\)|%s|%%|IS DISTINCT FROM", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def translate(sql: str) -> (str, (int, ...)):
+    """
+    Returns the SQLite version of a Postgres statement and the positions of the parameters passed as JSON arrays.
+    """
+    arrays = []
+    position = 0
+
+    def replace(match) -> str:
+        nonlocal position
+        token = match.group(0)
+
+        if token == "%%":
+            return "%"
+        if token.upper() == "IS DISTINCT FROM":
+            return "IS NOT"
+
+        position += 1
+        if token == "%s":
+            return "?"
+
+        arrays.append(position - 1)
+        return "IN (SELECT value FROM json_each(?))"
+
+    return _TOKENS.sub(replace, sql), tuple(arrays)
+
+
+def _params(params, arrays: (int, ...)) -> tuple:
+    params = tuple(params or ())
+    if not arrays:
+        return params
+
+    return tuple(json.dumps(list(p)) if i in arrays else p for i, p in enumerate(params))
+
+
+class SQLiteCursor:
+    """
+    sqlite3 cursor that takes the Postgres SQL of `storage.db`.
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def execute(self, sql: str, params=None):
+        sql, arrays = translate(sql)
+        self._cursor.execute(sql, _params(params, arrays))
+        return self
+
+    def executemany(self, sql: str, rows):
+        sql, arrays = translate(sql)
+        self._cursor.executemany(sql, (_params(row, arrays) for row in rows))
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size: int = None):
+        return self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, conn: sqlite3.Connection):
+        self.raw = conn
+
+    def cursor(self) -> SQLiteCursor:
+        return SQLiteCursor(self.raw.cursor())
+
+    def commit(self):
+        if self.raw.in_transaction:
+            self.raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def close(self):
+        self.raw.close()
+
+    @property
+    def closed(self) -> bool:
+        try:
+            self.raw.execute("SELECT 1")
+            return False
+        except sqlite3.ProgrammingError:
+            return True
+
+
+class SQLiteBackend(Backend):
+    dialect = SQLITE
+
+    def __init__(self, config):
+        self.path = config.sqlite_path
+        self.objects = FileStore(config.object_store_path)
+
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connect(self) -> SQLiteConnection:
+        # Autocommit mode in sqlite3, transactions are started explicitly
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        for pragma, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+
+        return SQLiteConnection(conn)
+
+    def _thread_connection(self) -> SQLiteConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+            self._local.depth = 0
+
+            with self._lock:
+                self._connections.append(conn)
+
+        return conn
+
+    @contextmanager
+    def connection(self, readonly: bool = False):
+        """
+        Yields this thread's connection; commits when the outermost block succeeds, rolls back when it raises.
+        A nested block is a savepoint, rolled back alone when it raises. A `readonly` outermost block only reads a
+        snapshot and doesn't wait for the writer, writing in it can fail with SQLITE_BUSY instead of waiting.
+        """
+        conn = self._thread_connection()
+        depth = self._local.depth
+        savepoint = f"sp_{depth}"
+
+        if depth == 0:
+            conn.raw.execute("BEGIN" if readonly else "BEGIN IMMEDIATE")
+        else:
+            conn.raw.execute(f"SAVEPOINT {savepoint}")
+        self._local.depth = depth + 1
+
+        try:
+            yield conn
+        except BaseException:
+            if depth == 0:
+                conn.rollback()
+            else:
+                conn.raw.execute(f"ROLLBACK TO {savepoint}")
+                conn.raw.execute(f"RELEASE {savepoint}")
+            raise
+        else:
+            if depth == 0:
+                conn.commit()
+            else:
+                conn.raw.execute(f"RELEASE {savepoint}")
+        finally:
+            self._local.depth = depth
+
+    def put_object(self, bucket_name: str, object_name: str, data: bytes, content_type: str):
+        self.objects.put(bucket_name, object_name, data)
+
+    def fput_object(self, bucket_name: str, object_name: str, path: str):
+        self.objects.put_file(bucket_name, object_name, path)
+
+    def fget_object(self, bucket_name: str, object_name: str, destination: str):
+        self.objects.get_file(bucket_name, object_name, destination)
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+        self._local = threading.local()
@@ -0,0 +1,143 @@
+"""
+Thumbnail pipeline: download into memory, transcode into the detail cover and the list thumbnail (see
+`util.transcode`) with one decode in a process pool and upload the buffers to MinIO.
+
+Thumbnails are stored by content hash (see `storage.objects`): an unchanged thumbnail costs one conditional GET and
+items sharing a cover share one object. Apart from that only `items.thumbnail_object_name` is written, so thumbnails
+are handled after the item's transaction has been committed and the encode runs on every core instead of blocking the
+scanner. `items.thumbnail_object_name` is the cover, the list thumbnail is at `objects.variant_object_name`.
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from models.item import Item
+from storage.context import get_context
+from storage.objects import FAILED, StoredObject, store_image
+from util import metrics, transcode
+from util.transcode import THUMBNAIL_VARIANTS, Variant
+
+THUMBNAIL_BUCKET = "mangalib.thumbnail"
+DEFAULT_IO_WORKERS = 16
+
+
+@metrics.timer("thumbnail_upload_seconds")
+def upload_thumbnail(item_url: str, url: str, variants: [Variant] = THUMBNAIL_VARIANTS, encoder=None,
+                     connection=None) -> StoredObject:
+    """
+    Stores the thumbnail at `url` as every one of `variants` unless an identical one is already stored, and points
+    the item at the first variant. The encode runs on `encoder` (an executor) if given, in this process otherwise. The
+    item row is updated with `connection` if given (e.g. when it isn't committed yet), in its own short transaction
+    otherwise.
+    """
+    def encode(data: bytes) -> {str: transcode.Output}:
+        if encoder is not None:
+            return encoder.submit(transcode.transcode, data, variants).result()
+        return transcode.transcode(data, variants)
+
+    stored = store_image(url, THUMBNAIL_BUCKET, encode, variants)
+    if stored.status == FAILED:
+        return stored
+
+    if connection is not None:
+        set_thumbnail(item_url, stored.object_name, connection)
+    else:
+        with get_context().connection() as conn:
+            set_thumbnail(item_url, stored.object_name, conn)
+
+    return stored
+
+
+def set_thumbnail(item_url: str, object_name: str, connection):
+    connection.cursor().execute('''
+        UPDATE items SET thumbnail_object_name = %s
+        WHERE item_url = %s AND thumbnail_object_name IS DISTINCT FROM %s
+    ''', (object_name, item_url, object_name))
+
+
+class ThumbnailPipeline:
+    """
+    Uploads thumbnails with `io_workers` threads downloading and uploading, and a pool of `encode_workers` processes
+    (one per core by default) encoding. Use as a context manager, `stats()` reports the throughput.
+    """
+
+    def __init__(self, encode_workers: int = None, io_workers: int = DEFAULT_IO_WORKERS,
+                 variants: [Variant] = THUMBNAIL_VARIANTS):
+        self.encode_workers = encode_workers or os.cpu_count() or 1
+        self.io_workers = io_workers
+        self.variants = variants
+
+        self._encoder = None
+        self._io = None
+        self._lock = threading.Lock()
+        self._start = None
+        self._counts = {"thumbnails": 0, "uploaded": 0, "linked": 0, "unchanged": 0, "failed": 0, "bytes": 0}
+
+    def __enter__(self):
+        # Spawned, forking a process with busy threads can leave an inherited lock held in the child
+        self._encoder = ProcessPoolExecutor(max_workers=self.encode_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        self._io = ThreadPoolExecutor(max_workers=self.io_workers)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._io.shutdown()
+        self._encoder.shutdown()
+
+    def upload(self, item_url: str, url: str) -> StoredObject:
+        """
+        Blocking upload of one item's thumbnail, safe to call from any thread.
+        """
+        try:
+            stored = upload_thumbnail(item_url, url, self.variants, self._encoder)
+        except Exception:
+            self._count(failed=1)
+            raise
+
+        self._count(thumbnails=1, bytes=stored.stored_bytes, **{stored.status: 1})
+        return stored
+
+    def submit(self, item_url: str, url: str):
+        return self._io.submit(self.upload, item_url, url)
+
+    def run(self, thumbnails: [(str, str)]) -> dict:
+        """
+        Uploads every (item url, thumbnail url) pair and waits for all of them.
+        """
+        for future in [self.submit(item_url, url) for item_url, url in thumbnails]:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Couldn't upload thumbnail, {e}")
+
+        return self.stats()
+
+    def _count(self, **counts: int):
+        with self._lock:
+            for key, value in counts.items():
+                self._counts[key] += value
+
+    def stats(self) -> dict:
+        elapsed = time.perf_counter() - self._start if self._start is not None else 0.0
+
+        with self._lock:
+            return {
+                **self._counts,
+                "seconds": round(elapsed, 2),
+                "thumbnails_per_sec": round(self._counts["thumbnails"] / elapsed, 2) if elapsed else 0.0,
+            }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encode and upload the thumbnails of stored items")
+    parser.add_argument("items", nargs='+', help="Item urls")
+    parser.add_argument("--encode-workers", type=int, default=None)
+    parser.add_argument("--io-workers", type=int, default=DEFAULT_IO_WORKERS)
+    args = parser.parse_args()
+
+    with ThumbnailPipeline(args.encode_workers, args.io_workers) as pipeline:
+        print(pipeline.run([(url, Item(url).thumbnail_url) for url in args.items]))
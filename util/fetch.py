@@ -0,0 +1,331 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from util import metrics
+from util.httpcache import DiskCache, DEFAULT_MAX_BYTES
+from util.throttle import Scheduler
+
+DEFAULT_HEADERS = {
+    "Referer": "https://manganato.com/",
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+}
+
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) in seconds
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5  # seconds, doubled on every retry
+BACKOFF_MAX = 30
+RETRY_STATUS = {429, 500, 502, 503, 504}
+POOL_SIZE = 32  # keep-alive connections per host
+HEAD_WORKERS = 16
+DEFAULT_CACHE_PATH = ".cache/http.sqlite"
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Seconds to wait from a Retry-After header, given in seconds or as an HTTP date. None if missing or malformed.
+    """
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class Page:
+    """
+    Body of a fetched page. `not_modified` is set when the server answered a conditional GET with 304 and the body
+    was taken from the cache.
+    """
+
+    def __init__(self, url: str, content: bytes, encoding: str = None, status_code: int = 200,
+                 not_modified: bool = False):
+        self.url = url
+        self.content = content
+        self.encoding = encoding
+        self.status_code = status_code
+        self.not_modified = not_modified
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+class Client:
+    """
+    Shared HTTP client that keeps one pooled keep-alive `requests.Session` per host.
+
+    Requests answered with 5xx or 429, or that fail to connect, are retried with jittered exponential backoff.
+    The latency of every request is accounted per host, see `latency()`.
+    Pages fetched with `get_page` go through `cache` (if any) and are revalidated with conditional GETs. With
+    `cache_factory` the cache is only created by the first page that needs it, so importing this module creates no
+    files and opens no database.
+    Every attempt waits for a permit of `scheduler` (if any), which paces the requests per host and kind, see
+    `util.throttle`.
+    """
+
+    def __init__(self, headers: {str: str} = None, timeout=DEFAULT_TIMEOUT, retries: int = MAX_RETRIES,
+                 backoff: float = BACKOFF_BASE, pool_size: int = POOL_SIZE, cache: DiskCache = None,
+                 scheduler: Scheduler = None, cache_factory=None):
+        self.headers = {**DEFAULT_HEADERS, **(headers or {})}
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.scheduler = scheduler
+
+        self._cache = cache
+        self._cache_factory = cache_factory if cache is None else None
+        self._sessions: {str: requests.Session} = {}
+        self._stats: {str: dict} = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> DiskCache | None:
+        if self._cache_factory is not None:
+            with self._lock:
+                if self._cache_factory is not None:
+                    self._cache = self._cache_factory()
+                    self._cache_factory = None
+
+        return self._cache
+
+    @cache.setter
+    def cache(self, cache: DiskCache | None):
+        with self._lock:
+            self._cache = cache
+            self._cache_factory = None
+
+    def session(self, host: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(host)
+
+            if session is None:
+                session = requests.Session()
+                session.headers.update(self.headers)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+
+            return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        host = urlsplit(url).netloc
+        session = self.session(host)
+        limiter = self.scheduler.limiter(url) if self.scheduler is not None else None
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(self.retries + 1):
+            if limiter is not None:
+                limiter.acquire()
+
+            start = time.perf_counter()
+            status = retry_after = latency = None
+            try:
+                response = session.request(method, url, **kwargs)
+                status = response.status_code
+                # Time to the headers: the body's transfer time grows with its size, not with the host's load
+                latency = response.elapsed.total_seconds()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(host, time.perf_counter() - start, error=True)
+
+                if attempt == self.retries:
+                    raise
+
+                delay = self._delay(attempt)
+                logging.warning(f"{method} {url} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                self._record(host, time.perf_counter() - start, error=response.status_code in RETRY_STATUS)
+                if response.status_code in RETRY_STATUS:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    return response
+
+                delay = self._delay(attempt, retry_after)
+                logging.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+                response.close()
+            finally:
+                if limiter is not None:
+                    limiter.release(latency if latency is not None else time.perf_counter() - start, status,
+                                    retry_after)
+
+            self._record_retry(host)
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, **kwargs)
+
+    @metrics.timer("get_page_seconds")
+    def get_page(self, url: str) -> Page:
+        cache = self.cache
+        entry = cache.get(url) if cache is not None else None
+        response = self.get(url, headers=entry.conditional_headers() if entry else None)
+
+        if response.status_code == 304 and entry is not None:
+            metrics.inc("pages_total", result="not_modified")
+            return Page(url, entry.body, entry.encoding, 200, not_modified=True)
+
+        metrics.inc("pages_total", result=str(response.status_code))
+        metrics.inc("page_bytes_total", len(response.content))
+
+        encoding = response.encoding or response.apparent_encoding
+        if response.status_code == 200 and cache is not None:
+            cache.put(url, response.content, response.headers.get("ETag"),
+                           response.headers.get("Last-Modified"), encoding)
+
+        return Page(url, response.content, encoding, response.status_code)
+
+    def content_length(self, url: str) -> int | None:
+        response = self.head(url)
+
+        if response.status_code == 200 and 'Content-Length' in response.headers:
+            return int(response.headers['Content-Length'])
+
+        return None
+
+    def content_lengths(self, urls: [str], workers: int = HEAD_WORKERS) -> [int | None]:
+        """
+        Sizes of many resources from concurrent HEAD requests, None where the size is unknown or the request failed.
+        """
+
+        def size(url: str) -> int | None:
+            try:
+                return self.content_length(url)
+            except requests.RequestException as e:
+                logging.error(f"Couldn't size {url}, {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(size, urls))
+
+    def forget(self, url: str):
+        cache = self.cache
+        if cache is not None:
+            cache.forget(url)
+
+    def _delay(self, attempt: int, retry_after: float = None) -> float:
+        if retry_after is not None:
+            return min(BACKOFF_MAX, retry_after)
+
+        # "full jitter": a random delay up to the exponential cap, so parallel workers don't retry in lockstep
+        return random.uniform(0, min(BACKOFF_MAX, self.backoff * 2 ** attempt))
+
+    def _stats_for(self, host: str) -> dict:
+        return self._stats.setdefault(host, {"requests": 0, "errors": 0, "retries": 0, "total": 0.0, "max": 0.0})
+
+    def _record(self, host: str, elapsed: float, error: bool = False):
+        metrics.observe("http_request_seconds", elapsed, host=host)
+        if error:
+            metrics.inc("http_errors_total", host=host)
+
+        with self._lock:
+            stats = self._stats_for(host)
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+
+    def _record_retry(self, host: str):
+        metrics.inc("http_retries_total", host=host)
+
+        with self._lock:
+            self._stats_for(host)["retries"] += 1
+
+    def latency(self) -> {str: dict}:
+        with self._lock:
+            return {
+                host: {
+                    "requests": s["requests"],
+                    "errors": s["errors"],
+                    "retries": s["retries"],
+                    "avg_ms": round(1000 * s["total"] / s["requests"], 1) if s["requests"] else 0.0,
+                    "max_ms": round(1000 * s["max"], 1),
+                }
+                for host, s in self._stats.items()
+            }
+
+    def limits(self) -> {str: {str: dict}}:
+        return self.scheduler.state() if self.scheduler is not None else {}
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+def default_cache() -> DiskCache | None:
+    load_dotenv()
+
+    path = os.environ.get("HTTP_CACHE_PATH", DEFAULT_CACHE_PATH)
+    if not path:
+        return None
+
+    return DiskCache(path, int(os.environ.get("HTTP_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)))
+
+
+def default_scheduler() -> Scheduler | None:
+    load_dotenv()
+
+    if os.environ.get("FETCH_THROTTLE", "1") == "0":
+        return None
+
+    return Scheduler()
+
+
+client = Client(cache_factory=default_cache, scheduler=default_scheduler())
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return client.get(url, **kwargs)
+
+
+def head(url: str, **kwargs) -> requests.Response:
+    return client.head(url, **kwargs)
+
+
+def content_lengths(urls: [str], workers: int = HEAD_WORKERS) -> [int | None]:
+    return client.content_lengths(urls, workers)
+
+
+def get_page(url: str) -> Page:
+    return client.get_page(url)
+
+
+def forget(url: str):
+    client.forget(url)
+
+
+def latency() -> {str: dict}:
+    return client.latency()
+
+
+def limits() -> {str: {str: dict}}:
+    return client.limits()
+
+
+if __name__ == "__main__":
+    for _ in range(3):
+        get("https://chapmanganato.to/manga-wo999471")
+
+    print(latency())
+    print(limits())
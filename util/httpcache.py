@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+EVICT_TO = 0.9  # evict down to this fraction of max_bytes
+
+
+class CacheEntry:
+    def __init__(self, body: bytes, etag: str, last_modified: str, encoding: str):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.encoding = encoding
+
+    def conditional_headers(self) -> {str: str}:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class DiskCache:
+    """
+    Disk backed HTTP response cache keyed by url.
+
+    Bodies are stored zlib compressed in a SQLite file together with their ETag and Last-Modified headers, so they
+    can be revalidated with conditional GETs. When the compressed size of all entries exceeds `max_bytes` the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                body BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                encoding TEXT,
+                size INTEGER,
+                accessed REAL
+            )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, url: str) -> CacheEntry | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, encoding FROM responses WHERE url = ?", (url,)).fetchone()
+
+            if row is None:
+                return None
+
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE url = ?", (time.time(), url))
+
+        return CacheEntry(zlib.decompress(row[0]), row[1], row[2], row[3])
+
+    def put(self, url: str, body: bytes, etag: str = None, last_modified: str = None, encoding: str = None):
+        if not etag and not last_modified:
+            return  # nothing to revalidate with
+
+        compressed = zlib.compress(body)
+
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self._conn.execute('''
+                INSERT OR REPLACE INTO responses (url, body, etag, last_modified, encoding, size, accessed)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (url, compressed, etag, last_modified, encoding, len(compressed), time.time()))
+
+            self._size += len(compressed) - (old[0] if old else 0)
+
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def forget(self, url: str):
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._size -= row[0]
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TO
+        rows = self._conn.execute("SELECT url, size FROM responses ORDER BY accessed").fetchall()
+
+        evicted = []
+        for url, size in rows:
+            if self._size <= target:
+                break
+            evicted.append((url,))
+            self._size -= size
+
+        self._conn.executemany("DELETE FROM responses WHERE url = ?", evicted)
+
+    def size(self) -> int:
+        return self._size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,19 +1,16 @@
 import re
 import shutil
 
-import requests
 from PIL import Image
 import pillow_heif
 import os
 
+from util import fetch, transcode
+
 pillow_heif.register_heif_opener()
 
 def download_image(url: str, dest: str):
-    headers = {
-        "Referer": "https://manganato.com/"
-    }
-
-    res = requests.get(url, headers=headers, stream=True)
+    res = fetch.get(url, stream=True)
 
     if res.status_code == 200:
         with open(dest, 'wb') as f:
@@ -21,6 +18,24 @@ def download_image(url: str, dest: str):
     else:
         print('Image Couldn\'t be retrieved: ' + url)
 
+def _convert(input_path: str, output_path: str, format: str, quality: int, method: int = 4, lossless: bool = False,
+             icc_profile: bool = True):
+    try:
+        with open(input_path, 'rb') as f:
+            image = transcode.decode(f.read())
+    except OSError as e:
+        raise transcode.TranscodeError(f"Couldn't read {input_path}, {e}") from e
+
+    data = transcode.encode(image, format, quality, method, image.info.get('icc_profile') if icc_profile else None,
+                            lossless)
+
+    try:
+        with open(output_path, 'wb') as f:
+            f.write(data)
+    except OSError as e:
+        raise transcode.TranscodeError(f"Couldn't write {output_path}, {e}") from e
+
+
 def convert_to_heif(input_path: str, output_path: str, quality: int = 90):
     """
     Converts an image to HEIF format with specified quality.
@@ -29,13 +44,11 @@ def convert_to_heif(input_path: str, output_path: str, quality: int = 90):
         input_path (str): Path to the input image.
         output_path (str): Destination path for the HEIF image (should end with .heif or .heic).
         quality (int): Compression quality (0-100). Higher means better quality.
-    """
-    try:
-        img = Image.open(input_path)
 
-        img.save(output_path, format="HEIF", quality=quality)
-    except Exception as e:
-        print(f"Error converting to HEIF: {e}")
+    Raises:
+        TranscodeError: The image can't be read, decoded, encoded or written.
+    """
+    _convert(input_path, output_path, "HEIF", quality)
 
 
 def convert_to_webp(input_path: str, output_path: str, quality: int = 90, lossless: bool = False, method: int = 6,
@@ -50,21 +63,11 @@ def convert_to_webp(input_path: str, output_path: str, quality: int = 90, lossle
         lossless (bool): Whether to use lossless compression. Default is False (lossy compression).
         method (int): Compression method (0-6), where 0 is fastest and 6 is best compression.
         icc_profile (bool): Whether to embed the ICC color profile in the image. Default is True.
+
+    Raises:
+        TranscodeError: The image can't be read, decoded, encoded or written.
     """
-    try:
-        img = Image.open(input_path)
-
-        # Convert to WebP with the specified parameters
-        save_options = {
-            'quality': quality,
-            'lossless': lossless,
-            'method': method,
-            'icc_profile': img.info.get('icc_profile') if icc_profile else None
-        }
-
-        img.save(output_path, format="WebP", **save_options)
-    except Exception as e:
-        print(f"Error converting to WebP: {e}")
+    _convert(input_path, output_path, "WEBP", quality, method, lossless, icc_profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,245 @@
+"""
+Process wide latency histograms and counters for the hot paths of a scan.
+
+Time a block with `with metrics.timer("name", label="value"):` (or use it as a decorator), count with
+`metrics.inc("name")`. Everything is exported in the Prometheus text format by `serve(port)` and summarised as JSON
+(count, mean, percentiles and rates) by `summary()` at the end of a run.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import ContextDecorator, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds, from a parsed page to a slow download or a full transaction
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_SUMMARY_PATH = "metrics.json"
+
+
+class Histogram:
+    def __init__(self, buckets: (float,) = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket the q-quantile falls in (the max for the +Inf bucket).
+        """
+        rank = q * self.count
+        seen = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, self.max), 6)
+
+        return round(self.max, 6)
+
+
+class Registry:
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = []
+
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """
+        Returns count, total, mean, p50/p95/p99 (bucket upper bounds) and max of every histogram and the value and rate
+        of every counter, keyed by `name{labels}`.
+        """
+        elapsed = time.time() - self._start
+
+        with self._lock:
+            return {
+                "seconds": round(elapsed, 2),
+                "histograms": {
+                    f"{name}{_labels(labels)}": {
+                        "count": h.count,
+                        "total": round(h.sum, 4),
+                        "mean": round(h.sum / h.count, 6) if h.count else 0.0,
+                        "p50": h.quantile(0.5),
+                        "p95": h.quantile(0.95),
+                        "p99": h.quantile(0.99),
+                        "max": round(h.max, 6),
+                    }
+                    for (name, labels), h in sorted(self._histograms.items())
+                },
+                "counters": {
+                    f"{name}{_labels(labels)}": {
+                        "value": value,
+                        "per_sec": round(value / elapsed, 2) if elapsed else 0.0,
+                    }
+                    for (name, labels), value in sorted(self._counters.items())
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._start = time.time()
+
+
+class timer(ContextDecorator):
+    """
+    Observes the duration of a block (or of every call, as a decorator) in the histogram `name`.
+    """
+
+    def __init__(self, name: str, registry: Registry = None, **labels: str):
+        self.name = name
+        self.registry = registry or REGISTRY
+        self.labels = labels
+        self._local = threading.local()
+
+    def __enter__(self):
+        # Per thread, the same decorator instance times concurrent calls
+        self._local.__dict__.setdefault("starts", []).append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self._local.starts.pop(), **self.labels)
+        return False
+
+
+def _labels(labels: ((str, str),)) -> str:
+    if not labels:
+        return ""
+
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+REGISTRY = Registry()
+
+
+def observe(name: str, value: float, **labels: str):
+    REGISTRY.observe(name, value, **labels)
+
+
+def inc(name: str, value: float = 1, **labels: str):
+    REGISTRY.inc(name, value, **labels)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def summary() -> dict:
+    return REGISTRY.summary()
+
+
+def write_summary(path: str):
+    with open(path, 'w') as f:
+        json.dump(summary(), f, indent=2)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves `/metrics` on a daemon thread, returns the server (`shutdown()` stops it).
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def add_arguments(parser):
+    """
+    Adds --metrics-port (default $METRICS_PORT) and --metrics-json to a command line parser, see `exported`.
+    """
+    port = os.environ.get("METRICS_PORT")
+    parser.add_argument("--metrics-port", type=int, default=int(port) if port else None,
+                        help="Serve Prometheus metrics on this local port while running")
+    parser.add_argument("--metrics-json", default=DEFAULT_SUMMARY_PATH,
+                        help="Write the metrics summary here at the end")
+
+
+@contextmanager
+def exported(port: int = None, summary_path: str = DEFAULT_SUMMARY_PATH):
+    """
+    Serves the metrics on `port` (if given) for the duration of the block and writes the summary when it ends, also
+    when it raises.
+    """
+    server = serve(port) if port else None
+
+    try:
+        yield
+    finally:
+        if server is not None:
+            server.shutdown()
+        if summary_path:
+            write_summary(summary_path)
@@ -0,0 +1,270 @@
+"""
+Politeness scheduler for the scrapers: the most throughput a host allows without getting us blocked.
+
+Every host has separate budgets for HTML pages and images, each a token bucket (the sustained request rate and burst
+we allow ourselves) and a concurrency window that finds what the host tolerates on its own, AIMD style like TCP: every
+successful request grows the window by 1/window, so by about one request per window's worth of successes, and an
+error (429, 5xx, a failed connection) halves it. A smoothed latency (time to the response headers, so a large body
+isn't mistaken for a slow host) well above the best latency seen counts as congestion too and shrinks the window
+gently, before the host starts failing. The window shrinks at most once per smoothed latency, so one burst of failures
+from the requests in flight together is one decrease, not many. A Retry-After pauses the whole budget for that long.
+
+`fetch.Client` takes a permit from `Scheduler.limiter(url)` for every attempt, see `util.fetch`. Budgets are per
+process: processes that scrape the same hosts together each get a `share` of them, see `worker`.
+"""
+import math
+import threading
+import time
+from urllib.parse import urlsplit
+
+from util import metrics
+
+PAGE = "page"
+IMAGE = "image"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".avif", ".heif")
+
+ERROR_DECREASE = 0.5  # window factor after an error
+LATENCY_DECREASE = 0.8  # window factor when the latency shows congestion
+LATENCY_TOLERANCE = 2.0  # smoothed latency over the baseline that counts as congestion
+SMOOTHING = 0.2  # weight of a new sample in the smoothed latency
+BASELINE_DRIFT = 0.001  # the baseline rises this much per sample, so it follows a host that got slower for good
+MAX_PAUSE = 60  # seconds, longer Retry-After values are capped
+
+
+class Budget:
+    """
+    Limits of one kind of request to one host.
+
+    Parameters:
+        rate (float): Sustained requests per second, unlimited if None.
+        burst (int): Requests that may be sent at once after an idle period.
+        min_window (int): The window never shrinks below this many concurrent requests.
+        max_window (int): Nor grows above this many.
+        initial_window (int): Concurrent requests to start with, `min_window` if None.
+    """
+
+    def __init__(self, rate: float | None, burst: int, min_window: int, max_window: int, initial_window: int = None):
+        self.rate = rate
+        self.burst = burst
+        self.min_window = min_window
+        self.max_window = max_window
+        self.initial_window = initial_window or min_window
+
+    def scaled(self, share: float) -> "Budget":
+        """
+        This budget cut down to `share` (0-1) of it, for one of several processes scraping the same host. Never less
+        than one request at a time.
+        """
+        if share >= 1:
+            return self
+
+        max_window = max(1, math.floor(self.max_window * share))
+        return Budget(self.rate * share if self.rate else self.rate, max(1, math.floor(self.burst * share)),
+                      min(self.min_window, max_window), max_window, min(self.initial_window, max_window))
+
+
+DEFAULT_BUDGETS = {
+    PAGE: Budget(rate=4, burst=4, min_window=1, max_window=8, initial_window=2),
+    IMAGE: Budget(rate=20, burst=20, min_window=2, max_window=32, initial_window=4),
+}
+
+# Matched on the host or any of its parent domains
+HOST_BUDGETS = {
+    "chapmanganato.to": {
+        PAGE: Budget(rate=5, burst=5, min_window=1, max_window=16, initial_window=4),
+        IMAGE: DEFAULT_BUDGETS[IMAGE],
+    },
+    "avt.mkklcdnv6temp.com": {
+        PAGE: DEFAULT_BUDGETS[PAGE],
+        IMAGE: Budget(rate=30, burst=30, min_window=2, max_window=64, initial_window=8),
+    },
+}
+
+
+def kind_of(url: str) -> str:
+    return IMAGE if urlsplit(url).path.lower().endswith(IMAGE_EXTENSIONS) else PAGE
+
+
+def is_error(status: int | None) -> bool:
+    """
+    Whether a response tells us to slow down: no response at all, 429 or a 5xx.
+    """
+    return status is None or status == 429 or status >= 500
+
+
+class TokenBucket:
+    """
+    Sustained `rate` requests per second with bursts of `burst`. Tokens are reserved ahead, a caller is told how long
+    to wait for its token, so waiting callers are served in order instead of racing for every new token.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - 1
+            self._updated = now
+
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class Window:
+    """
+    AIMD concurrency window, see the module docstring.
+    """
+
+    def __init__(self, budget: Budget):
+        self.budget = budget
+        self.limit = float(budget.initial_window)
+        self.in_flight = 0
+        self.latency = None  # smoothed, seconds
+        self.baseline = None  # lowest latency seen, slowly drifting up
+
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+
+            self.in_flight += 1
+
+    def release(self, elapsed: float, error: bool) -> str | None:
+        """
+        Gives back a permit and adjusts the window to how the request went. Returns why the window shrank, if it did.
+        """
+        with self._condition:
+            # Only a full window proves the host can take more, an idle one would grow without limit
+            full = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            reason = None
+
+            if error:
+                reason, factor = "error", ERROR_DECREASE
+            else:
+                # Failed requests often end on a timeout, their latency says nothing about the host's
+                self.latency = elapsed if self.latency is None else (1 - SMOOTHING) * self.latency + SMOOTHING * elapsed
+                self.baseline = elapsed if self.baseline is None else min(elapsed,
+                                                                          self.baseline * (1 + BASELINE_DRIFT))
+
+                if self.latency > self.baseline * LATENCY_TOLERANCE:
+                    reason, factor = "latency", LATENCY_DECREASE
+                elif full:
+                    self.limit = min(self.budget.max_window, self.limit + 1 / self.limit)
+
+            now = time.monotonic()
+            if reason is not None:
+                if now - self._last_decrease >= (self.latency or 0.0):
+                    self.limit = max(self.budget.min_window, self.limit * factor)
+                    self._last_decrease = now
+                else:
+                    reason = None
+
+            self._condition.notify_all()
+            return reason
+
+
+class Limiter:
+    """
+    The token bucket and window of one kind of request to one host. Call `acquire()` before sending a request and
+    `release()` with how it went once it's answered, exactly once per `acquire()`.
+    """
+
+    def __init__(self, host: str, kind: str, budget: Budget):
+        self.host = host
+        self.kind = kind
+        self.bucket = TokenBucket(budget.rate, budget.burst) if budget.rate else None
+        self.window = Window(budget)
+
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        start = time.monotonic()
+        self.window.acquire()
+
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+        wait = self.bucket.take() if self.bucket is not None else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+        metrics.observe("throttle_wait_seconds", time.monotonic() - start, host=self.host, kind=self.kind)
+
+    def release(self, elapsed: float, status: int | None, retry_after: float = None):
+        reason = self.window.release(elapsed, is_error(status))
+        if reason is not None:
+            metrics.inc("throttle_decreases_total", host=self.host, kind=self.kind, reason=reason)
+
+        if retry_after:
+            self.pause(retry_after)
+
+    def pause(self, seconds: float):
+        """
+        Holds back every request of this budget for `seconds`, e.g. what the host asked for in a Retry-After.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + min(seconds, MAX_PAUSE))
+
+    def state(self) -> dict:
+        return {
+            "window": round(self.window.limit, 2),
+            "in_flight": self.window.in_flight,
+            "latency_ms": round(1000 * self.window.latency, 1) if self.window.latency is not None else None,
+            "baseline_ms": round(1000 * self.window.baseline, 1) if self.window.baseline is not None else None,
+            "rate": self.bucket.rate if self.bucket is not None else None,
+        }
+
+
+class Scheduler:
+    """
+    Hands out the `Limiter` of every (host, kind) pair, created on first use from `budgets` (host -> kind -> Budget,
+    matched on the host or a parent domain) or `default` (kind -> Budget), scaled down to `share` of them.
+    """
+
+    def __init__(self, budgets: {str: {str: Budget}} = None, default: {str: Budget} = None, share: float = 1.0):
+        self.budgets = HOST_BUDGETS if budgets is None else budgets
+        self.default = DEFAULT_BUDGETS if default is None else default
+        self.share = share
+
+        self._limiters: {(str, str): Limiter} = {}
+        self._lock = threading.Lock()
+
+    def budget(self, host: str, kind: str) -> Budget:
+        name = host.split(':')[0]
+        while name:
+            if name in self.budgets:
+                return self.budgets[name][kind].scaled(self.share)
+            name = name.partition('.')[2]
+
+        return self.default[kind].scaled(self.share)
+
+    def limiter(self, url: str) -> Limiter:
+        host = urlsplit(url).netloc
+        kind = kind_of(url)
+
+        with self._lock:
+            limiter = self._limiters.get((host, kind))
+            if limiter is None:
+                limiter = self._limiters[(host, kind)] = Limiter(host, kind, self.budget(host, kind))
+
+            return limiter
+
+    def state(self) -> {str: {str: dict}}:
+        with self._lock:
+            limiters = list(self._limiters.values())
+
+        state = {}
+        for limiter in limiters:
+            state.setdefault(limiter.host, {})[limiter.kind] = limiter.state()
+
+        return state
@@ -0,0 +1,182 @@
+"""
+Transcodes one source image into several variants (e.g. a list thumbnail, a detail cover and a full resolution reader
+page) with a single decode.
+
+Every variant is resized from the decoded source, never from another variant, and can either use a fixed quality or
+search for the highest quality that stays under a target size. Failures raise `TranscodeError` instead of printing.
+"""
+import io
+
+from PIL import Image, UnidentifiedImageError
+import pillow_heif
+
+pillow_heif.register_heif_opener()
+
+MIN_QUALITY = 10
+CONTENT_TYPES = {"HEIF": "image/heif", "WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+EXTENSIONS = {"HEIF": "heif", "WEBP": "webp", "JPEG": "jpg", "PNG": "png"}
+
+
+class TranscodeError(Exception):
+    pass
+
+
+class Variant:
+    """
+    One output of `transcode`.
+
+    Parameters:
+        name (str): Key of the output.
+        format (str): PIL format name, "HEIF", "WEBP", "JPEG" or "PNG".
+        max_size ((int, int)): Bounding box the image is scaled down into (keeping the aspect ratio), None for the
+            source resolution. Images are never scaled up.
+        quality (int): Compression quality (0-100), the upper bound if `target_bytes` is set.
+        target_bytes (int): Pick the highest quality between MIN_QUALITY and `quality` whose output fits this size.
+        method (int): WebP compression method (0-6), where 0 is fastest and 6 is best compression.
+    """
+
+    def __init__(self, name: str, format: str, max_size: (int, int) = None, quality: int = 80,
+                 target_bytes: int = None, method: int = 4):
+        self.name = name
+        self.format = format.upper()
+        self.max_size = max_size
+        self.quality = quality
+        self.target_bytes = target_bytes
+        self.method = method
+
+        if self.format not in CONTENT_TYPES:
+            raise ValueError(f"Unsupported format {format}")
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES[self.format]
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS[self.format]
+
+    def __repr__(self):
+        return f"Variant({self.name}, {self.format}, {self.max_size}, q={self.quality}, target={self.target_bytes})"
+
+
+class Output:
+    def __init__(self, variant: Variant, data: bytes, size: (int, int), quality: int):
+        self.variant = variant
+        self.data = data
+        self.size = size
+        self.quality = quality
+
+    def __repr__(self):
+        return f"Output({self.variant.name}, {len(self.data)} bytes, {self.size}, q={self.quality})"
+
+
+LIST_THUMBNAIL = Variant("list", "HEIF", (160, 240), quality=40, target_bytes=12_000)
+DETAIL_COVER = Variant("cover", "HEIF", (480, 720), quality=60)
+READER_PAGE = Variant("page", "WEBP", None, quality=75, method=4)
+
+# The first variant of a set is the object an item or chapter points at, see `storage.objects`
+THUMBNAIL_VARIANTS = [DETAIL_COVER, LIST_THUMBNAIL]
+PAGE_VARIANTS = [READER_PAGE]
+
+
+def decode(data: bytes) -> Image.Image:
+    """
+    Decodes an in-memory image into an RGB(A) image that every encoder accepts.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        raise TranscodeError(f"Couldn't decode image, {e}") from e
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+
+    return image
+
+
+def resize(image: Image.Image, max_size: (int, int) = None) -> Image.Image:
+    if max_size is None or (image.width <= max_size[0] and image.height <= max_size[1]):
+        return image
+
+    resized = image.copy()
+    resized.thumbnail(max_size, Image.LANCZOS)
+    return resized
+
+
+def encode(image: Image.Image, format: str, quality: int, method: int = 4, icc_profile: bytes = None,
+           lossless: bool = False) -> bytes:
+    out = io.BytesIO()
+    options = {"quality": quality}
+
+    if format == "WEBP":
+        options["method"] = method
+        options["lossless"] = lossless
+    if format in ("WEBP", "JPEG") and icc_profile:
+        options["icc_profile"] = icc_profile
+    if format == "JPEG" and image.mode == "RGBA":
+        image = image.convert("RGB")
+
+    try:
+        image.save(out, format=format, **options)
+    except (OSError, ValueError, KeyError) as e:
+        raise TranscodeError(f"Couldn't encode {format} at quality {quality}, {e}") from e
+
+    return out.getvalue()
+
+
+def fit_quality(image: Image.Image, variant: Variant, icc_profile: bytes = None) -> (bytes, int):
+    """
+    Binary search for the highest quality whose output is at most `variant.target_bytes`. Returns the smallest output
+    (at MIN_QUALITY) if none fits.
+    """
+    low, high = MIN_QUALITY, variant.quality
+    best = None
+
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode(image, variant.format, quality, variant.method, icc_profile)
+
+        if len(data) <= variant.target_bytes:
+            best = (data, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+            if best is None and quality == MIN_QUALITY:
+                best = (data, quality)
+
+    if best is None:
+        best = (encode(image, variant.format, MIN_QUALITY, variant.method, icc_profile), MIN_QUALITY)
+
+    return best
+
+
+def transcode_image(image: Image.Image, variants: [Variant], icc_profile: bytes = None) -> {str: Output}:
+    outputs = {}
+
+    for variant in variants:
+        resized = resize(image, variant.max_size)
+
+        if variant.target_bytes is not None:
+            data, quality = fit_quality(resized, variant, icc_profile)
+        else:
+            quality = variant.quality
+            data = encode(resized, variant.format, quality, variant.method, icc_profile)
+
+        outputs[variant.name] = Output(variant, data, resized.size, quality)
+
+    return outputs
+
+
+def transcode(data: bytes, variants: [Variant]) -> {str: Output}:
+    """
+    Decodes `data` once and encodes every variant, returns the outputs by variant name.
+    Module level so it can be sent to a process pool.
+
+    Raises:
+        TranscodeError: The source can't be decoded or a variant can't be encoded.
+    """
+    image = decode(data)
+    icc_profile = image.info.get('icc_profile')
+
+    return transcode_image(image, variants, icc_profile)
@@ -0,0 +1,162 @@
+"""
+Worker mode: any number of worker processes, on one host or many, share one scan through the crawl frontier.
+
+Every worker leases a batch of listing pages, items and chapters from `crawl_frontier` (see `storage.frontier`),
+processes it and renews the leases it still holds after every entry. A worker that dies loses its leases once they
+expire and the other workers pick the entries up. Seed a scan once with `python worker.py seed`, then start
+`python worker.py run` wherever there's a DB connection, or `python worker.py local --workers 4` to try it on one host.
+
+The politeness budgets of `util.throttle` are per process, so N workers would send N times the rate a host allows.
+`local` gives every worker 1/N of them, workers started with `run` take theirs from `--share`.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+
+import scan
+from storage import frontier
+from storage.db import DB
+from util import fetch, metrics
+from util.throttle import Scheduler
+
+DEFAULT_BATCH_SIZE = 8
+POLL_INTERVAL = 5  # seconds between lease attempts when nothing is ready
+
+
+class Worker:
+    """
+    Processes frontier entries until the scan is finished (or forever with `stop_when_done=False`).
+
+    Parameters:
+        worker_id (str): Name of the worker in the leases, host:pid plus a random suffix by default.
+        batch_size (int): Entries leased at once.
+        lease_seconds (int): How long a lease lasts without being renewed. Has to be longer than the slowest entry.
+        kinds ([str]): Kinds of entries to work on, e.g. only chapters.
+    """
+
+    def __init__(self, worker_id: str = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 lease_seconds: int = frontier.LEASE_SECONDS, kinds: [str] = frontier.KINDS):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.kinds = kinds
+        self.stats = {"done": 0, "failed": 0, "lost": 0}
+
+    def run(self, stop_when_done: bool = True) -> dict:
+        start = time.perf_counter()
+
+        try:
+            while True:
+                with DB.get_connection() as conn:
+                    batch = frontier.lease(self.worker_id, conn, self.batch_size, self.lease_seconds, self.kinds)
+                    if not batch:
+                        count, wait = frontier.remaining(conn)
+
+                if batch:
+                    self.process_batch(batch)
+                    continue
+
+                if count == 0 and stop_when_done:
+                    break
+
+                # Whatever is left is leased by other workers or waiting for its backoff, and other workers may add
+                # new entries any time
+                time.sleep(min(wait if wait is not None else POLL_INTERVAL, POLL_INTERVAL) + 0.1)
+        finally:
+            with DB.get_connection() as conn:
+                frontier.release(self.worker_id, conn)
+
+        self.stats["seconds"] = round(time.perf_counter() - start, 2)
+        return self.stats
+
+    def process_batch(self, batch: [(str, str, str, int, int)]):
+        for i, (kind, url, parent, position, attempts) in enumerate(batch):
+            print(self.worker_id, kind, url)
+
+            try:
+                with metrics.timer("frontier_entry_seconds", kind=kind):
+                    scan.process_entry(kind, url, parent, position, self.worker_id)
+                self.stats["done"] += 1
+                metrics.inc("frontier_entries_total", kind=kind, result="done")
+            except scan.LeaseLost as e:
+                logging.warning(f"{self.worker_id}: {e}")
+                self.stats["lost"] += 1
+                metrics.inc("frontier_entries_total", kind=kind, result="lost")
+            except Exception as e:
+                logging.error(f"{self.worker_id} couldn't process {kind} {url} (attempt {attempts}), {e}",
+                              exc_info=True)
+                print(f"Couldn't process {kind} {url} (attempt {attempts}), {e}")
+                self.stats["failed"] += 1
+                metrics.inc("frontier_entries_total", kind=kind, result="failed")
+
+                with DB.get_connection() as conn:
+                    frontier.fail(kind, url, str(e), conn, self.worker_id)
+
+            rest = [(kind, url) for kind, url, _, _, _ in batch[i + 1:]]
+            if rest:
+                with DB.get_connection() as conn:
+                    frontier.renew(self.worker_id, rest, conn, self.lease_seconds)
+
+
+def run_worker(batch_size: int = DEFAULT_BATCH_SIZE, lease_seconds: int = frontier.LEASE_SECONDS,
+               share: float = 1.0) -> dict:
+    """
+    Runs a worker in this process with `share` of the politeness budgets, e.g. 1/N for one of N workers.
+    """
+    # Throttling stays off if it was turned off (FETCH_THROTTLE=0)
+    if fetch.client.scheduler is not None:
+        fetch.client.scheduler = Scheduler(share=share)
+
+    return Worker(batch_size=batch_size, lease_seconds=lease_seconds).run()
+
+
+def run_local(workers: int, batch_size: int = DEFAULT_BATCH_SIZE, lease_seconds: int = frontier.LEASE_SECONDS):
+    """
+    Runs `workers` worker processes on this host and waits for all of them, sharing the politeness budgets.
+    """
+    # Every process opens its own pool and HTTP sessions, nothing is inherited
+    context = multiprocessing.get_context("spawn")
+
+    with context.Pool(workers) as pool:
+        results = [pool.apply_async(run_worker, (batch_size, lease_seconds, 1 / workers)) for _ in range(workers)]
+        return [result.get() for result in results]
+
+
+def status():
+    with DB.get_connection() as conn:
+        for (kind, state), count in frontier.progress(conn).items():
+            print(f"{kind:<8} {state:<12} {count:>8}")
+
+        print()
+        for worker_id, count in frontier.leases(conn).items():
+            print(f"{worker_id:<40} {count:>4} leased")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Share a scan between worker processes through the crawl frontier")
+    parser.add_argument("command", choices=["seed", "run", "local", "status"])
+    parser.add_argument("--restart", action="store_true", help="seed: start a new scan even if one is unfinished")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="local: worker processes")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--lease-seconds", type=int, default=frontier.LEASE_SECONDS)
+    parser.add_argument("--share", type=float, default=1.0,
+                        help="run: share of the per-host politeness budgets, 1/N for one of N workers")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    DB.create()
+
+    if args.command == "seed":
+        with DB.get_connection() as conn:
+            print("Seeded a new scan" if scan.start_scan(conn, args.restart) else "Unfinished scan left, not seeded")
+    elif args.command == "run":
+        with metrics.exported(args.metrics_port, args.metrics_json):
+            print(run_worker(args.batch_size, args.lease_seconds, args.share))
+    elif args.command == "local":
+        print(run_local(args.workers, args.batch_size, args.lease_seconds))
+    else:
+        status()